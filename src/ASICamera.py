@@ -1,10 +1,12 @@
 from pathlib import Path
-from shutil import copyfile
 import time
-from CameraInterface import CameraInterface
+from CameraInterface import CameraInterface, CameraFrame
+from stills_archiver import StillsArchiver
+from camera_metrics import CameraMetrics
 import zwoasi as asi
 import Display
-from typing import Dict
+from typing import Dict, Optional, Tuple
+import numpy as np
 import logging
 import utils
 import sys
@@ -29,6 +31,8 @@ class ASICamera(CameraInterface):
         self.home_path: Path = home_path
         self.stills_path: Path = home_path / "Stills"
         utils.create_path(self.stills_path)  # create stills dir if not already therew
+        self.metrics = CameraMetrics()
+        self.archiver = StillsArchiver(self.stills_path, metrics=self.metrics)
 
         # find a camera
         asi.init("/lib/zwoasi/armv7/libASICamera2.so")
@@ -64,6 +68,29 @@ class ASICamera(CameraInterface):
         camera.set_control_value(asi.ASI_BRIGHTNESS, 50)
         camera.set_control_value(asi.ASI_FLIP, 0)
         camera.set_image_type(asi.ASI_IMG_RAW8)
+        properties = camera.get_camera_property()
+        self.sensor_size = properties["MaxWidth"], properties["MaxHeight"]
+        self.binning = 1
+        self._apply_binning(1)
+
+    def _apply_binning(self, bins: int) -> None:
+        """Sets the readout to the whole sensor at the given binning"""
+        camera.set_roi(bins=bins)
+        self.roi_binning = bins
+        # every frame is read into this buffer, the frames are views on it
+        width, height = camera.get_roi_format()[:2]
+        self.buffer = bytearray(width * height)
+        self.roi_shape = (height, width)
+
+    def set_binning(self, bins: int) -> None:
+        """Sets the on sensor binning of the next captures, 2 reads out a quarter of the pixels
+
+        Parameters:
+        bins (int): The binning factor, 1 for full resolution"""
+        if self.camType == "not found":
+            return
+        self.binning = bins
+        self._apply_binning(bins)
 
     def capture(
         self, exposure_time: float, gain: float, radec: str, extras: Dict
@@ -81,17 +108,122 @@ class ASICamera(CameraInterface):
             self.handpad.display("camera not found", "", "")
             return
 
+        frame = self.capture_array(exposure_time, gain, radec, extras)
+        if frame is not None:
+            frame.save(self.images_path / "capture.jpg", self.metrics)
+
+    def capture_array(
+        self, exposure_time: float, gain: float, radec: str, extras: Dict
+    ) -> CameraFrame:
+        """Capture an image with the camera and return it in memory, no capture.jpg is written
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str): The Ra and Dec, used to name the stills
+        extras (Dict): "still": False to not archive the frame in the stills,
+            "full_resolution": True to capture this frame unbinned
+
+        Returns:
+        CameraFrame: The frame, its data is a view on the capture buffer,
+            None when the camera is not found"""
+        if self.camType == "not found":
+            self.handpad.display("camera not found", "", "")
+            return None
+
+        timing = self.metrics.begin(exposure_time / 1000000)
+        with timing.phase("settings"):
+            bins = 1 if extras.get("full_resolution") else self.binning
+            if bins != self.roi_binning:
+                self._apply_binning(bins)
+            camera.set_control_value(asi.ASI_GAIN, gain)
+            camera.set_control_value(asi.ASI_EXPOSURE, exposure_time)  # microseconds
         timestr = time.strftime("%Y%m%d-%H%M%S")
+        timestamp = time.time()
+        # camera.capture split up, to time the exposure and the USB readout separately
+        with timing.phase("exposure"):
+            camera.start_exposure()
+            deadline = timestamp + exposure_time / 1000000 + 10
+            time.sleep(min(exposure_time / 1000000, 0.01))
+            status = camera.get_exposure_status()
+            while status == asi.ASI_EXP_WORKING and time.time() < deadline:
+                time.sleep(0.005)
+                status = camera.get_exposure_status()
+        if status != asi.ASI_EXP_SUCCESS:
+            if status == asi.ASI_EXP_WORKING:
+                camera.stop_exposure()
+                self.metrics.count("timeouts")
+            else:
+                self.metrics.count("failed")
+            self.metrics.end(timing)
+            raise asi.ZWO_CaptureError("Could not capture image", status)
+        with timing.phase("readout"):
+            camera.get_data_after_exposure(buffer_=self.buffer)
+        data = np.frombuffer(self.buffer, dtype=np.uint8).reshape(self.roi_shape)
+        with timing.phase("temperature"):
+            temperature = self.get_temperature()
+        frame = CameraFrame(
+            data, exposure_time / 1000000, gain, timestamp, self.sensor_size,
+            {"radec": radec, "camera": self.camType, "temperature": temperature}, bins,
+        )
+        # the stills are encoded and written in the background, this is only the copy
+        if extras.get("still", True):
+            with timing.phase("still"):
+                self.archiver.submit(frame, f"{timestr}_{radec}")
+        self.metrics.count("captures")
+        self.metrics.end(timing)
+        return frame
+
+    def start_live(self, exposure_time: float, gain: float) -> None:
+        """Puts the camera in video mode
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain"""
         camera.set_control_value(asi.ASI_GAIN, gain)
         camera.set_control_value(asi.ASI_EXPOSURE, exposure_time)  # microseconds
-        capture_path = self.images_path / "capture.jpg"
-        camera.capture(filename=capture_path)
-        copyfile(
-            capture_path,
-            self.stills_path / f"{timestr}_{radec}.jpg",
-        )
+        if self.binning != self.roi_binning:
+            self._apply_binning(self.binning)
+        camera.start_video_capture()
+
+    def read_live_frame(self, buffer: bytearray, timeout: float) -> bool:
+        """Reads the next video frame straight into the buffer
+
+        Parameters:
+        buffer (bytearray): A preallocated buffer the size of a live_frame_shape frame
+        timeout (float): Seconds to wait for the frame
+
+        Returns:
+        bool: True if a complete frame was read"""
+        start_time = time.perf_counter()
+        try:
+            camera.capture_video_frame(buffer_=buffer, timeout=int(timeout * 1000))
+            self.metrics.record("live_read", time.perf_counter() - start_time)
+            self.metrics.count("live_frames")
+            return True
+        except asi.ZWO_IOError as ex:
+            logging.debug(f"No video frame: {ex}")
+            self.metrics.count("timeouts")
+            return False
+
+    def stop_live(self) -> None:
+        """Ends video mode"""
+        camera.stop_video_capture()
+
+    def live_frame_shape(self) -> Tuple[Tuple[int, int], np.dtype]:
+        """Returns the shape (height, width) and dtype of the video frames"""
+        width, height = camera.get_roi_format()[:2]
+        return (height, width), np.dtype(np.uint8)
+
+    def get_temperature(self) -> Optional[float]:
+        """Returns the sensor temperature in degrees C"""
+        return camera.get_control_value(asi.ASI_TEMPERATURE)[0] / 10
 
-        return
+    def get_metrics(self) -> Dict:
+        """Returns the capture timings and counters, plus the frames the driver dropped in video mode"""
+        metrics = self.metrics.summary()
+        metrics["counters"]["driver_dropped"] = camera.get_dropped_frames()
+        return metrics
 
     def get_cam_type(self) -> str:
         """Return the type of the camera
@@ -1,8 +1,13 @@
 from pathlib import Path
 from shutil import copyfile
 import logging
-from typing import Dict
+import time
+from typing import Dict, Optional, Tuple
+import numpy as np
+from PIL import Image
 import Display
+from CameraInterface import CameraFrame
+from camera_metrics import CameraMetrics
 
 
 class CameraDebug:
@@ -11,11 +16,21 @@ class CameraDebug:
     def __init__(self, handpad: Display, images_path=Path('/dev/shm/images'), cwd_path=Path.cwd()) -> None:
         self.cwd_path: Path = cwd_path
         self.images_path: Path = images_path 
+        self.test_images: Dict[Tuple[str, int], np.ndarray] = {}
+        self.binning = 1
+        self.metrics = CameraMetrics()
 
     def initialize(self) -> None:
         """Initializes the camera and set the needed control parameters"""
         pass
 
+    def set_binning(self, bins: int) -> None:
+        """Bins the test images like a camera would
+
+        Parameters:
+        bins (int): The binning factor, 1 for full resolution"""
+        self.binning = bins
+
     def capture(
             self, exposure_time: float, gain: float, radec: str, extras: Dict
     ) -> None:
@@ -35,9 +50,91 @@ class CameraDebug:
             logging.warning("No debug image was selected, choosing polaris")
             self.copy_polaris()
 
+    def capture_array(
+            self, exposure_time: float, gain: float, radec: str, extras: Dict
+    ) -> CameraFrame:
+        """Return a test image as if it was captured, decoded once and kept in memory
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str)
+        extras (Dict): "testimage": m31 or polaris, "full_resolution": True to not bin this frame
+
+        Returns:
+        CameraFrame: The frame"""
+        name = extras.get('testimage')
+        if name not in ('m31', 'polaris'):
+            logging.warning("No debug image was selected, choosing polaris")
+            name = 'polaris'
+        logging.info(f"Capturing debug image of {name}")
+        bins = 1 if extras.get("full_resolution") else self.binning
+        timing = self.metrics.begin(exposure_time / 1000000)
+        with timing.phase("load"):
+            self._load(name, bins)
+            # a copy, the frame is calibrated in place
+            data = self.test_images[(name, bins)].copy()
+        self.metrics.count("captures")
+        self.metrics.end(timing)
+        height, width = data.shape
+        return CameraFrame(
+            data, exposure_time / 1000000, gain, time.time(), (width * bins, height * bins),
+            {"radec": radec, "camera": "TEST", "testimage": name}, bins,
+        )
+
+    def _load(self, name: str, bins: int) -> None:
+        if (name, bins) not in self.test_images:
+            image = np.asarray(Image.open(self.cwd_path / f"testimages/{name}.jpg").convert("L"))
+            if bins > 1:
+                h, w = (image.shape[0] // bins) * bins, (image.shape[1] // bins) * bins
+                binned = image[:h, :w].reshape(h // bins, bins, w // bins, bins).mean(axis=(1, 3))
+                image = binned.astype(np.uint8)
+            self.test_images[(name, bins)] = image
+
+    def start_live(self, exposure_time: float, gain: float) -> None:
+        """Streams the polaris test image
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain"""
+        self.live_exposure = exposure_time / 1000000
+        self.live_image = self.capture_array(exposure_time, gain, "", {'testimage': 'polaris'}).data
+
+    def read_live_frame(self, buffer: bytearray, timeout: float) -> bool:
+        """Waits an exposure time and copies the test image into the buffer
+
+        Parameters:
+        buffer (bytearray): A preallocated buffer the size of a live_frame_shape frame
+        timeout (float): Seconds to wait for the frame
+
+        Returns:
+        bool: True if a complete frame was read"""
+        if self.live_exposure > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(self.live_exposure)
+        np.frombuffer(buffer, dtype=self.live_image.dtype)[:] = self.live_image.ravel()
+        return True
+
+    def stop_live(self) -> None:
+        """Ends streaming"""
+        pass
+
+    def live_frame_shape(self) -> Tuple[Tuple[int, int], np.dtype]:
+        """Returns the shape (height, width) and dtype of the streamed frames"""
+        return self.live_image.shape, self.live_image.dtype
+
     def copy_polaris(self):
         copyfile(self.cwd_path / "testimages/polaris.jpg", self.images_path / "capture.jpg")
 
+    def get_temperature(self) -> Optional[float]:
+        """The test images have no sensor temperature"""
+        return None
+
+    def get_metrics(self) -> Dict:
+        """Returns the capture timings and counters"""
+        return self.metrics.summary()
+
     def get_cam_type(self) -> str:
         """Return the type of the camera
 
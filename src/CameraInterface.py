@@ -1,4 +1,65 @@
-from typing import Dict
+from pathlib import Path
+import io
+import time
+from typing import Dict, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+
+class CameraFrame:
+    """A captured frame, the pixels as a NumPy array plus what is known about the exposure"""
+
+    def __init__(
+            self,
+            data: np.ndarray,
+            exposure: float,
+            gain: float,
+            timestamp: float,
+            sensor_size: Tuple[int, int],
+            metadata: Optional[Dict] = None,
+            binning: int = 1,
+    ) -> None:
+        """Initializes the frame
+
+        Parameters:
+        data (np.ndarray): The pixels, height x width. Cameras may return a view on their driver
+            buffer, which the next capture overwrites: copy the data to keep it longer
+        exposure (float): The exposure time in seconds
+        gain (float): The gain
+        timestamp (float): The time.time() at the start of the exposure
+        sensor_size (Tuple[int, int]): Width and height of the full sensor in pixels
+        metadata (Dict): Anything else, like the radec string, the camera type and the sensor temperature
+        binning (int): The on sensor binning, a frame pixel covers binning x binning sensor pixels"""
+        self.data = data
+        self.exposure = exposure
+        self.gain = gain
+        self.timestamp = timestamp
+        self.sensor_size = sensor_size
+        self.metadata = metadata if metadata is not None else {}
+        self.binning = binning
+
+    def save(self, path: Path, metrics=None) -> None:
+        """Encodes the frame to a file, the format follows the suffix (jpg, png, ...)
+
+        Parameters:
+        path (Path): The file to write
+        metrics (CameraMetrics): Records the encode and write times separately when given"""
+        if metrics is None:
+            Image.fromarray(self.data).save(path)
+            return
+        start_time = time.perf_counter()
+        encoded = io.BytesIO()
+        Image.fromarray(self.data).save(encoded, format=Image.registered_extensions()[path.suffix.lower()])
+        metrics.record("encode", time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        with open(path, "wb") as f:
+            f.write(encoded.getbuffer())
+        metrics.record("write", time.perf_counter() - start_time)
+
+    def to_image(self) -> Image.Image:
+        """Returns the frame as a PIL image for display, without encoding it"""
+        return Image.fromarray(self.data)
+
 
 class CameraInterface:
     """All cameras should implement this interface.  The interface is used in the eFinder and eFinder_VNCGUI code"""
@@ -10,14 +71,76 @@ class CameraInterface:
     def capture(
             self, exposure_time: float, gain: float, radec: str, extras: Dict
     ) -> None:
-        """Capture an image with the camera
+        """Capture an image with the camera and write it to capture.jpg
 
         Parameters:
-        exposure_time (float): The exposure time in seconds
+        exposure_time (float): The exposure time in microseconds
         gain (float): The gain
         radec (str)"""
         pass
 
+    def capture_array(
+            self, exposure_time: float, gain: float, radec: str, extras: Dict
+    ) -> CameraFrame:
+        """Capture an image with the camera and return it in memory, no capture.jpg is written
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str): The Ra and Dec, used to name the stills
+        extras (Dict): "still": False to not archive the frame in the stills,
+            "full_resolution": True to capture this frame unbinned
+
+        Returns:
+        CameraFrame: The frame, None when the camera delivered none"""
+        pass
+
+    def set_binning(self, bins: int) -> None:
+        """Sets the on sensor binning of the next captures, 2 reads out a quarter of the pixels
+
+        Parameters:
+        bins (int): The binning factor, 1 for full resolution"""
+        pass
+
+    def start_live(self, exposure_time: float, gain: float) -> None:
+        """Puts the camera in streaming (video) mode, see LiveCapture
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain"""
+        pass
+
+    def read_live_frame(self, buffer: bytearray, timeout: float) -> bool:
+        """Reads the next streamed frame into the buffer
+
+        Parameters:
+        buffer (bytearray): A preallocated buffer the size of a live_frame_shape frame
+        timeout (float): Seconds to wait for the frame
+
+        Returns:
+        bool: True if a complete frame was read"""
+        pass
+
+    def stop_live(self) -> None:
+        """Ends streaming mode"""
+        pass
+
+    def live_frame_shape(self) -> Tuple[Tuple[int, int], np.dtype]:
+        """Returns the shape (height, width) and dtype of the streamed frames"""
+        pass
+
+    def get_temperature(self) -> Optional[float]:
+        """Returns the sensor temperature in degrees C, None if the camera does not report it"""
+        pass
+
+    def get_metrics(self) -> Dict:
+        """Returns where the time of the recent captures went, see CameraMetrics.summary
+
+        Returns:
+        Dict: "counters" (captures, timeouts, dropped frames...), "phases" with statistics of the
+            seconds per phase (settings, exposure, readout, encode, write...) and "last", the newest capture"""
+        pass
+
     def get_cam_type(self) -> str:
         """Return the type of the camera
 
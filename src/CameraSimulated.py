@@ -0,0 +1,302 @@
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+import logging
+import time
+import fitsio
+import numpy as np
+import Display
+from CameraInterface import CameraInterface, CameraFrame
+from camera_metrics import CameraMetrics
+from wcs_transform import TanSipWcs
+
+# star flux in ADU for a magnitude 0 star in a 1 s exposure at gain 50, stars to about magnitude
+# 11 stand out of the noise then, 20 to 50 of them in the default field, like a 50 mm lens
+FLUX_ZERO_POINT = 8e6
+
+
+def load_catalog(catalog_file: Path) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Reads RA, Dec (degrees) and magnitude of the stars from a FITS table like the hip.fits of astrometry.net
+
+    Parameters:
+    catalog_file (Path): The catalog
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray, np.ndarray]: RA, Dec and magnitude"""
+    table = fitsio.read(str(catalog_file), ext=1)
+    columns = {name.lower(): name for name in table.dtype.names}
+    ra = table[columns["ra"]].astype(np.float64)
+    dec = table[columns["dec"]].astype(np.float64)
+    mag_column = next((columns[c] for c in ("mag", "vmag", "hpmag", "vtmag") if c in columns), None)
+    mag = table[mag_column].astype(np.float64) if mag_column else np.full(len(ra), 8.0)
+    good = np.isfinite(ra) & np.isfinite(dec) & np.isfinite(mag)
+    return ra[good], dec[good], mag[good]
+
+
+def random_catalog(seed: int, count: int = 200000) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Scatters stars uniformly over the sky with a realistic magnitude distribution. The frames
+    only solve against index files built from the same catalog, use it for throughput tests.
+
+    Parameters:
+    seed (int): The seed of the random generator
+    count (int): The number of stars
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray, np.ndarray]: RA, Dec and magnitude"""
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0, 360, count)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    # the number of stars grows about 3x (e ** 1.1) per magnitude, up to magnitude 12
+    mag = 12 + np.log(rng.uniform(0, 1, count)) / 1.1
+    return ra, dec, np.clip(mag, -1, 12)
+
+
+class CameraSimulated(CameraInterface):
+    """Renders frames of a star catalog where the (debug) Nexus points, with a PSF, sky background,
+    noise, hot pixels and drift. Deterministic for a given seed, so whole sessions can be replayed
+    headless for throughput and accuracy benchmarks."""
+
+    def __init__(
+        self,
+        handpad: Display = None,
+        images_path: Path = Path("/dev/shm/images"),
+        pointing: Optional[Callable[[], Tuple[float, float]]] = None,
+        catalog_file: Path = Path("/usr/local/astrometry/annotate_data/hip.fits"),
+        pix_scale: float = 15,
+        sensor_size: Tuple[int, int] = (1280, 960),
+        roll: float = 0.0,
+        seeing: float = 2.5,
+        sky: float = 20.0,
+        read_noise: float = 2.0,
+        hot_pixels: int = 200,
+        drift: Tuple[float, float] = (0.0, 0.0),
+        seed: int = 0,
+    ) -> None:
+        """Initializes the simulated camera
+
+        Parameters:
+        handpad (Display): The link to the handpad
+        images_path (Path): Where capture.jpg is written
+        pointing (Callable[[], Tuple[float, float]]): Returns the RA (hours) and Dec the scope points at,
+            like NexusDebug.get_radec, or None while that is not known
+        catalog_file (Path): A FITS table with ra, dec and mag columns, a random sky if it does not exist
+        pix_scale (float): The pixel scale in arcsec per unbinned pixel
+        sensor_size (Tuple[int, int]): Width and height of the sensor in pixels
+        roll (float): The rotation of the camera in degrees
+        seeing (float): The FWHM of the stars in unbinned pixels
+        sky (float): The sky background in ADU for a 1 s exposure at gain 50
+        read_noise (float): The read noise in ADU
+        hot_pixels (int): The number of hot pixels on the sensor
+        drift (Tuple[float, float]): RA and Dec drift of the pointing in arcsec per second, an untracked scope
+        seed (int): The seed of the noise and the hot pixels"""
+        self.handpad = handpad
+        self.images_path = images_path
+        self.pointing = pointing
+        self.pix_scale = pix_scale
+        self.sensor_size = sensor_size
+        self.roll = roll
+        self.seeing = seeing
+        self.sky = sky
+        self.read_noise = read_noise
+        self.drift = drift
+        self.seed = seed
+        if catalog_file.exists():
+            self.ra, self.dec, self.mag = load_catalog(catalog_file)
+            logging.info(f"Simulating {len(self.ra)} stars of {catalog_file}")
+        else:
+            logging.warning(f"{catalog_file} not found, simulating a random sky")
+            self.ra, self.dec, self.mag = random_catalog(seed)
+        # unit vectors, the stars in the field are found with one dot product
+        ra, dec = np.radians(self.ra), np.radians(self.dec)
+        self.vectors = np.column_stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)])
+        rng = np.random.default_rng(seed)
+        self.hot_pixels = (rng.uniform(0, 1, hot_pixels), rng.uniform(0, 1, hot_pixels))
+        self.binning = 1
+        self.frame_count = 0
+        self.started = time.time()
+        self.live_exposure = 1.0
+        self.live_gain = 50.0
+        self.metrics = CameraMetrics()
+
+    def set_binning(self, bins: int) -> None:
+        """Renders the next frames binned
+
+        Parameters:
+        bins (int): The binning factor, 1 for full resolution"""
+        self.binning = bins
+
+    def wcs(self, ra: float, dec: float, bins: int) -> TanSipWcs:
+        """Returns the transform of a frame centred on the position
+
+        Parameters:
+        ra (float): RA of the centre in degrees
+        dec (float): Dec of the centre in degrees
+        bins (int): The binning
+
+        Returns:
+        TanSipWcs: The transform"""
+        width, height = self.sensor_size[0] // bins, self.sensor_size[1] // bins
+        scale = self.pix_scale * bins / 3600
+        roll = np.radians(self.roll)
+        return TanSipWcs({
+            "CRVAL1": ra, "CRVAL2": dec, "CRPIX1": (width + 1) / 2, "CRPIX2": (height + 1) / 2,
+            "CD1_1": -scale * np.cos(roll), "CD1_2": scale * np.sin(roll),
+            "CD2_1": scale * np.sin(roll), "CD2_2": scale * np.cos(roll),
+            "IMAGEW": width, "IMAGEH": height,
+        })
+
+    def render(self, ra: float, dec: float, exposure: float, gain: float, bins: int = 1, seed: Optional[int] = None) -> np.ndarray:
+        """Renders a frame
+
+        Parameters:
+        ra (float): RA of the frame centre in degrees
+        dec (float): Dec of the frame centre in degrees
+        exposure (float): The exposure time in seconds
+        gain (float): The gain
+        bins (int): The binning
+        seed (int): The seed of the noise of this frame
+
+        Returns:
+        np.ndarray: The frame, uint8"""
+        rng = np.random.default_rng(self.seed if seed is None else seed)
+        width, height = self.sensor_size[0] // bins, self.sensor_size[1] // bins
+        wcs = self.wcs(ra, dec, bins)
+        scale = exposure * gain / 50
+        # the stars within the circle around the frame
+        radius = np.radians(np.hypot(width, height) / 2 * self.pix_scale * bins / 3600)
+        centre = np.array([
+            np.cos(np.radians(dec)) * np.cos(np.radians(ra)),
+            np.cos(np.radians(dec)) * np.sin(np.radians(ra)),
+            np.sin(np.radians(dec)),
+        ])
+        near = np.flatnonzero(self.vectors @ centre > np.cos(radius))
+        x, y = wcs.rd2xy(self.ra[near], self.dec[near])
+        flux = FLUX_ZERO_POINT * 10 ** (-0.4 * self.mag[near]) * scale
+        inside = (x > 0.5) & (x < width + 0.5) & (y > 0.5) & (y < height + 0.5)
+        x, y, flux = x[inside] - 1, y[inside] - 1, flux[inside]
+
+        image = np.full(height * width, self.sky * scale + 10, dtype=np.float32)
+        if len(x):
+            # a gaussian stamp per star, summed into the frame with one bincount
+            sigma = self.seeing / bins / 2.355
+            half = int(np.ceil(3 * sigma))
+            offsets = np.arange(-half, half + 1)
+            px = np.rint(x).astype(np.int64)[:, None, None] + offsets[None, None, :]
+            py = np.rint(y).astype(np.int64)[:, None, None] + offsets[None, :, None]
+            weights = np.exp(-((px - x[:, None, None]) ** 2 + (py - y[:, None, None]) ** 2) / (2 * sigma**2))
+            weights *= (flux / weights.sum(axis=(1, 2)))[:, None, None]
+            keep = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            keep = np.broadcast_to(keep, weights.shape)
+            index = np.broadcast_to(py * width + px, weights.shape)
+            image += np.bincount(index[keep], weights[keep], minlength=height * width).astype(np.float32)
+        image = image.reshape(height, width)
+        # photon noise of the sky plus read noise, the noise of the stars themselves is left out
+        # independent noise in every frame, a reused noise pattern would correlate frames
+        image += rng.standard_normal((height, width), dtype=np.float32) * np.float32(
+            np.sqrt(self.sky * scale + self.read_noise**2)
+        )
+        hot_x = (self.hot_pixels[0] * width).astype(np.int64)
+        hot_y = (self.hot_pixels[1] * height).astype(np.int64)
+        image[hot_y, hot_x] += 200 * scale
+        return np.clip(image, 0, 255).astype(np.uint8)
+
+    def position(self, extras: Dict) -> Tuple[float, float]:
+        """Returns where the next frame is centred: the radec given in extras, else the pointing,
+        plus the drift since the camera started. Without either, or when the pointing has no
+        position yet, the frame is centred on RA 0, Dec 0
+
+        Returns:
+        Tuple[float, float]: RA and Dec in degrees"""
+        position = extras.get("radec")
+        if position is None and self.pointing is not None:
+            position = self.pointing()
+        ra_hours, dec = position if position is not None else (0.0, 0.0)
+        elapsed = time.time() - self.started
+        ra = (15 * float(ra_hours) + self.drift[0] * elapsed / 3600) % 360
+        dec = float(np.clip(float(dec) + self.drift[1] * elapsed / 3600, -90, 90))
+        return ra, dec
+
+    def capture(self, exposure_time: float, gain: float, radec: str, extras: Dict) -> None:
+        """Renders a frame and writes it to capture.jpg
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str): The Ra and Dec"""
+        self.capture_array(exposure_time, gain, radec, extras).save(self.images_path / "capture.jpg")
+
+    def capture_array(self, exposure_time: float, gain: float, radec: str, extras: Dict) -> CameraFrame:
+        """Renders a frame where the scope points, without waiting for the exposure time
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str): The Ra and Dec, used to name the stills
+        extras (Dict): "radec": (RA hours, Dec) to render another position than the pointing,
+            "full_resolution": True to not bin this frame, "seed": the noise seed of this frame
+
+        Returns:
+        CameraFrame: The frame, the metadata holds the true centre and WCS"""
+        bins = 1 if extras.get("full_resolution") else self.binning
+        ra, dec = self.position(extras)
+        self.frame_count += 1
+        seed = extras.get("seed", self.seed + self.frame_count)
+        timestamp = time.time()
+        timing = self.metrics.begin(exposure_time / 1000000)
+        with timing.phase("render"):
+            data = self.render(ra, dec, exposure_time / 1000000, gain, bins, seed)
+        self.metrics.count("captures")
+        self.metrics.end(timing)
+        return CameraFrame(
+            data, exposure_time / 1000000, gain, timestamp, self.sensor_size,
+            {"radec": radec, "camera": "SIM", "ra": ra, "dec": dec, "wcs": self.wcs(ra, dec, bins)}, bins,
+        )
+
+    def start_live(self, exposure_time: float, gain: float) -> None:
+        """Streams rendered frames
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain"""
+        self.live_exposure = exposure_time / 1000000
+        self.live_gain = gain
+
+    def read_live_frame(self, buffer: bytearray, timeout: float) -> bool:
+        """Renders the next frame into the buffer, paced at the exposure time
+
+        Parameters:
+        buffer (bytearray): A preallocated buffer the size of a live_frame_shape frame
+        timeout (float): Seconds to wait for the frame
+
+        Returns:
+        bool: True if a complete frame was read"""
+        if self.live_exposure > timeout:
+            time.sleep(timeout)
+            return False
+        start_time = time.time()
+        frame = self.capture_array(self.live_exposure * 1000000, self.live_gain, "", {})
+        np.frombuffer(buffer, dtype=np.uint8)[:] = frame.data.ravel()
+        time.sleep(max(0.0, self.live_exposure - (time.time() - start_time)))
+        return True
+
+    def stop_live(self) -> None:
+        """Ends streaming"""
+        pass
+
+    def live_frame_shape(self) -> Tuple[Tuple[int, int], np.dtype]:
+        """Returns the shape (height, width) and dtype of the streamed frames"""
+        return (self.sensor_size[1] // self.binning, self.sensor_size[0] // self.binning), np.dtype(np.uint8)
+
+    def get_temperature(self) -> Optional[float]:
+        """The simulated sensor has no temperature"""
+        return None
+
+    def get_metrics(self) -> Dict:
+        """Returns the capture timings and counters"""
+        return self.metrics.summary()
+
+    def get_cam_type(self) -> str:
+        """Return the type of the camera
+
+        Returns:
+        str: The type of the camera"""
+        return "SIM"
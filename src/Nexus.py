@@ -1,6 +1,6 @@
+from typing import List, Tuple
 import serial
 import time
-import socket
 from skyfield.api import load, Star, wgs84
 from datetime import datetime, timedelta
 import os
@@ -8,6 +8,8 @@ import math
 import re
 import Display
 import Coordinates
+from nexus_connection import SerialConnection, TcpConnection
+from nexus_poller import NexusSnapshot
 
 
 class Nexus:
@@ -26,49 +28,52 @@ class Nexus:
         self.coordinates = coordinates
         self.NexStr = "not connected"
         self.short = "no RADec"
+        self.radec = None
         self.long = 0
         self.lat = 0
+        self.poller = None
 
-        try:
-            self.ser = serial.Serial("/dev/ttyS0", baudrate=9600)
-            self.ser.write(b":P#")
-            time.sleep(0.1)
-            p = str(self.ser.read(self.ser.in_waiting), "ascii")
-            if p[0] == "L":
-                self.ser.write(b":U#")
-            self.ser.write(b":P#")
-            time.sleep(0.1)
-            print(
-                "Connected to Nexus in",
-                str(self.ser.read(self.ser.in_waiting), "ascii"),
-                "via USB",
-            )
-            self.NexStr = "connected"
-            self.handpad.display("Found Nexus", "via USB", "")
-            time.sleep(1)
-            self.nexus_link = "USB"
-        except:
-            self.HOST = "10.0.0.1"
-            self.PORT = 4060
+        self.connection = None
+        self.connect()
+
+    def connect(self) -> None:
+        """Finds the Nexus DSC, on USB first and then on WiFi"""
+        for link, shown in (("USB", "via USB"), ("Wifi", "via WiFi")):
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(2)
-                    s.connect((self.HOST, self.PORT))
-                    s.send(b":P#")
-                    time.sleep(0.1)
-                    p = str(s.recv(15), "ascii")
-                    if p[0] == "L":
-                        s.send(b":U#")
-                    s.send(b":P#")
-                    time.sleep(0.1)
-                    print("Connected to Nexus in", str(s.recv(15), "ascii"), "via wifi")
-                    self.NexStr = "connected"
-                    self.handpad.display("Found Nexus", "via WiFi", "")
-                    time.sleep(1)
-                    self.nexus_link = "Wifi"
-            except:
-                print("no USB or Wifi link to Nexus")
-                self.handpad.display("Nexus not found", "", "")
+                self.open_link(link)
+                self.handshake(link)
+                self.handpad.display("Found Nexus", shown, "")
+                time.sleep(1)
+                return
+            except (OSError, serial.SerialException, IndexError):
+                self.close()
+                self.connection = None
+        print("no USB or Wifi link to Nexus")
+        self.handpad.display("Nexus not found", "", "")
+
+    def open_link(self, link: str) -> None:
+        """Opens the link to the Nexus DSC, raises OSError when it is not there
+
+        Parameters:
+        link (str): "USB" or "Wifi"
+        """
+        if link == "USB":
+            self.connection = SerialConnection("/dev/ttyS0", 9600)
+        else:
+            self.connection = TcpConnection("10.0.0.1", 4060)
+
+    def handshake(self, link: str) -> None:
+        """Switches the Nexus to the long (high precision) coordinate format
+
+        Parameters:
+        link (str): How the Nexus DSC is connected
+        """
+        p = self.get(":P#")
+        if p[0] == "L":
+            self.write(":U#")
+        print("Connected to Nexus in", self.get(":P#"), "via", link)
+        self.NexStr = "connected"
+        self.nexus_link = link
 
     def write(self, txt: str) -> None:
         """Write a message to the Nexus DSC
@@ -77,12 +82,7 @@ class Nexus:
         txt (str): The text to send to the Nexus DSC
         """
         # print('write',flag)
-        if self.nexus_link == "USB":
-            self.ser.write(bytes(txt.encode("ascii")))
-        else:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.HOST, self.PORT))
-                s.send(bytes(txt.encode("ascii")))
+        self.connection.write(txt)
         print("sent", txt, "to Nexus")
 
     def get(self, txt: str) -> str:
@@ -94,29 +94,39 @@ class Nexus:
         Returns:
         str:  The requested information from the DSC
         """
-        if self.nexus_link == "USB":
-            self.ser.write(bytes(txt.encode("ascii")))
-            time.sleep(0.1)
-            res = str(self.ser.read(self.ser.in_waiting).decode("ascii")).strip("#")
-        else:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.HOST, self.PORT))
-                s.send(bytes(txt.encode("ascii")))
-                time.sleep(0.1)
-                res = str(s.recv(16).decode("ascii")).strip("#")
+        res = self.connection.query(txt)
         print("sent", txt, "got", res, "from Nexus")
         return res
 
+    def get_batch(self, commands: List[str]) -> List[str]:
+        """Receive the replies to several commands sent in one burst
+
+        Parameters:
+        commands (List[str]): The strings to send
+
+        Returns:
+        List[str]: The replies, in the order of the commands
+        """
+        res = self.connection.query_batch(commands)
+        print("sent", "".join(commands), "got", res, "from Nexus")
+        return res
+
+    def close(self) -> None:
+        """Closes the link to the Nexus DSC"""
+        if self.connection is not None:
+            self.connection.close()
+
     def read(self) -> None:
         """Establishes that Nexus DSC is talking to us and get observer location and time data"""
-        Lt = self.get(":Gt#")[0:6].split("*")
+        Lt, Lg, local_time, local_date, local_offset, p = self.get_batch(
+            [":Gt#", ":Gg#", ":GL#", ":GC#", ":GG#", ":GW#"]
+        )
+        Lt = Lt[0:6].split("*")
         self.lat = float(Lt[0] + "." + Lt[1])
-        Lg = self.get(":Gg#")[0:7].split("*")
+        Lg = Lg[0:7].split("*")
         self.long = -1 * float(Lg[0] + "." + Lg[1])
         self.location = self.coordinates.get_earth() + wgs84.latlon(self.lat, self.long)
-        local_time = self.get(":GL#")
-        local_date = self.get(":GC#")
-        local_offset = float(self.get(":GG#"))
+        local_offset = float(local_offset)
         print(
             "Nexus reports: local datetime as",
             local_date,
@@ -133,8 +143,7 @@ class Nexus:
         print("Calculated UTC", new_dt)
         print("setting pi clock to:", end=" ")
         os.system('sudo date -u --set "%s"' % new_dt + ".000Z")
-        p = self.get(":GW#")
-        if p != "AT2#":
+        if p != "AT2":
             self.handpad.display("Nexus reports", "not aligned yet", "")
         else:
             self.handpad.display("eFinder ready", "Nexus reports" + p, "")
@@ -150,17 +159,10 @@ class Nexus:
         Returns:
         np.array: The updated arr variable to show on the handpad
         """
-        ra = self.get(":GR#").split(":")
-        dec = re.split(r"[:*]", self.get(":GD#"))
-        self.radec = (
-            float(ra[0]) + float(ra[1]) / 60 + float(ra[2]) / 3600
-        ), math.copysign(
-            abs(abs(float(dec[0])) + float(dec[1]) / 60 + float(dec[2]) / 3600),
-            float(dec[0]),
-        )
-        self.altaz = self.coordinates.conv_altaz(self, *(self.radec))
-        self.scope_alt = self.altaz[0] * math.pi / 180
-        self.short = ra[0] + ra[1] + dec[0] + dec[1]
+        # with the poller running the latest snapshot is used, else the Nexus is read now
+        snapshot = self.poller.latest() if self.poller is not None else None
+        if snapshot is None:
+            snapshot = self.poll()
         print(
             "Nexus RA:  ",
             self.coordinates.hh2dms(self.radec[0]),
@@ -170,8 +172,7 @@ class Nexus:
         if arr is not None:
             arr[0, 1][0] = "Nex: RA " + self.coordinates.hh2dms(self.radec[0])
             arr[0, 1][1] = "   Dec " + self.coordinates.dd2dms(self.radec[1])
-        p = self.get(":GW#")
-        if p == "AT2#":
+        if snapshot.aligned:
             if arr is not None:
                 arr[0, 4][1] = "Nexus is aligned"
                 arr[0, 4][0] = "'Select' syncs"
@@ -179,6 +180,56 @@ class Nexus:
         if arr is not None:
             return arr
 
+    def poll(self) -> NexusSnapshot:
+        """Reads the position, the alignment status and the GoTo target in one burst
+
+        Returns:
+        NexusSnapshot: The mount state, also kept for get_radec, get_altAz and is_aligned
+        """
+        start_time = time.time()
+        ra, dec, p, target_ra, target_dec = self.get_batch([":GR#", ":GD#", ":GW#", ":Gr#", ":Gd#"])
+        timestamp = (start_time + time.time()) / 2
+        radec = self.parse_radec(ra, dec)
+        altaz = self.coordinates.conv_altaz(self, *radec)
+        target = None
+        if not (target_ra[0:2] == "00" and target_ra[3:5] == "00"):  # not a valid goto target set yet.
+            target = self.parse_radec(target_ra, target_dec)
+        ra, dec = ra.split(":"), re.split(r"[:*]", dec)
+        snapshot = NexusSnapshot(timestamp, radec, altaz, p == "AT2", target, ra[0] + ra[1] + dec[0] + dec[1])
+        self.radec, self.altaz, self.short = snapshot.radec, snapshot.altaz, snapshot.short
+        self.scope_alt = altaz[0] * math.pi / 180
+        if snapshot.aligned:
+            self.aligned = True
+        return snapshot
+
+    @staticmethod
+    def parse_radec(ra: str, dec: str) -> Tuple[float, float]:
+        """Converts the RA and Dec replies of the Nexus to numbers
+
+        Parameters:
+        ra (str): The RA as HH:MM:SS
+        dec (str): The declination as sDD*MM:SS
+
+        Returns:
+        Tuple[float, float]: The RA in hours and the declination in degrees
+        """
+        ra = ra.split(":")
+        dec = re.split(r"[:*]", dec)
+        return (
+            float(ra[0]) + float(ra[1]) / 60 + float(ra[2]) / 3600
+        ), math.copysign(
+            abs(abs(float(dec[0])) + float(dec[1]) / 60 + float(dec[2]) / 3600),
+            float(dec[0]),
+        )
+
+    def set_poller(self, poller) -> None:
+        """Sets the poller that keeps the mount state, None to read the Nexus on demand
+
+        Parameters:
+        poller (NexusPoller): The poller
+        """
+        self.poller = poller
+
     def get_short(self):
         """Returns a summary of RA & Dec for file labelling
 
@@ -1,7 +1,10 @@
+from typing import List
+from nexus_poller import NexusSnapshot
 from NexusInterface import NexusInterface
 import serial
 from skyfield.api import load, Star, wgs84
 from datetime import datetime, timedelta
+import time
 import Display
 import Coordinates
 
@@ -28,6 +31,8 @@ class NexusDebug(NexusInterface):
         self.short = "no_RADec"
         self.long = 40
         self.lat = 5
+        self.slew_target = None
+        self.poller = None
 
     def write(self, txt: str) -> None:
         """Write a message to the Nexus DSC
@@ -48,6 +53,17 @@ class NexusDebug(NexusInterface):
         """
         return "11:12:13"
 
+    def get_batch(self, commands: List[str]) -> List[str]:
+        """Receive the replies to several commands sent in one burst
+
+        Parameters:
+        commands (List[str]): The strings to send
+
+        Returns:
+        List[str]: The replies, in the order of the commands
+        """
+        return [self.get(txt) for txt in commands]
+
     def read(self) -> None:
         """Establishes that Nexus DSC is talking to us and get observer location and time data"""
         self.location = self.coordinates.get_earth() + wgs84.latlon(self.lat, self.long)
@@ -62,6 +78,22 @@ class NexusDebug(NexusInterface):
         np.array: The updated arr variable to show on the handpad
         """
 
+    def poll(self) -> NexusSnapshot:
+        """Reads the position, the alignment status and the GoTo target in one burst
+
+        Returns:
+        NexusSnapshot: The mount state, also kept for get_radec, get_altAz and is_aligned
+        """
+        return NexusSnapshot(time.time(), tuple(self.get_radec()), tuple(self.altaz), self.aligned, None, self.short)
+
+    def set_poller(self, poller) -> None:
+        """Sets the poller that keeps the mount state, None to read the Nexus on demand
+
+        Parameters:
+        poller (NexusPoller): The poller
+        """
+        self.poller = poller
+
     def get_short(self):
         """Returns a summary of RA & Dec for file labelling
 
@@ -116,8 +148,35 @@ class NexusDebug(NexusInterface):
         Returns:
         The RA and declination
         """
+        if self.slew_target is not None:
+            start, target, start_time, duration = self.slew_target
+            fraction = min((time.time() - start_time) / duration, 1.0) if duration > 0 else 1.0
+            ra = start[0] + ((target[0] - start[0] + 12) % 24 - 12) * fraction
+            self.radec = [ra % 24, start[1] + (target[1] - start[1]) * fraction]
+            if fraction >= 1.0:
+                self.slew_target = None
         return self.radec
 
+    def set_radec(self, ra: float, dec: float) -> None:
+        """Points the simulated telescope at once
+
+        Parameters:
+        ra (float): The RA in hours
+        dec (float): The declination in degrees"""
+        self.slew_target = None
+        self.radec = [ra, dec]
+
+    def slew(self, ra: float, dec: float, rate: float = 2.0) -> None:
+        """Moves the simulated telescope to a position, get_radec follows the motion
+
+        Parameters:
+        ra (float): The RA in hours
+        dec (float): The declination in degrees
+        rate (float): The slew speed in degrees per second"""
+        start = list(self.get_radec())
+        distance = max(abs((ra - start[0] + 12) % 24 - 12) * 15, abs(dec - start[1]))
+        self.slew_target = (start, (ra, dec), time.time(), distance / rate)
+
     def get_nexus_link(self) -> str:
         """Returns how the Nexus DSC is connected to the eFinder
 
@@ -1,3 +1,5 @@
+from typing import List
+from nexus_poller import NexusSnapshot
 
 
 class NexusInterface:
@@ -22,6 +24,21 @@ class NexusInterface:
         """
         pass
 
+    def close(self) -> None:
+        """Closes the link to the Nexus DSC"""
+        pass
+
+    def get_batch(self, commands: List[str]) -> List[str]:
+        """Receive the replies to several commands sent in one burst
+
+        Parameters:
+        commands (List[str]): The strings to send
+
+        Returns:
+        List[str]: The replies, in the order of the commands
+        """
+        pass
+
     def read(self) -> None:
         """Establishes that Nexus DSC is talking to us and get observer location and time data"""
         pass
@@ -37,6 +54,22 @@ class NexusInterface:
         """
         pass
 
+    def poll(self) -> NexusSnapshot:
+        """Reads the position, the alignment status and the GoTo target in one burst
+
+        Returns:
+        NexusSnapshot: The mount state, also kept for get_radec, get_altAz and is_aligned
+        """
+        pass
+
+    def set_poller(self, poller) -> None:
+        """Sets the poller that keeps the mount state, None to read the Nexus on demand
+
+        Parameters:
+        poller (NexusPoller): The poller
+        """
+        pass
+
     def get_short(self):
         """Returns a summary of RA & Dec for file labelling
 
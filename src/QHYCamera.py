@@ -1,14 +1,26 @@
 from pathlib import Path
-from shutil import copyfile
 import time
-from CameraInterface import CameraInterface
+from CameraInterface import CameraInterface, CameraFrame
+from stills_archiver import StillsArchiver
+from camera_metrics import CameraMetrics
 import Display
 import cv2
 import qhyccd
 from ctypes import *
-from typing import Dict
+from typing import Dict, Optional, Tuple
+import numpy as np
 import utils
 
+
+class QHYCaptureError(Exception):
+    """The SDK could not expose or read out a frame"""
+
+    def __init__(self, message: str, exposed: int, read: int) -> None:
+        super().__init__(f"{message} (exposure status {exposed}, readout status {read})")
+        self.exposed = exposed
+        self.read = read
+
+
 class QHYCamera(CameraInterface):
     """The camera class for ZWO cameras.  Implements the CameraInterface interface."""
 
@@ -22,6 +34,8 @@ class QHYCamera(CameraInterface):
         self.images_path = images_path 
         self.stills_path: Path = home_path / "Stills"
         utils.create_path(self.stills_path) # create stills dir if not already therew
+        self.metrics = CameraMetrics()
+        self.archiver = StillsArchiver(self.stills_path, metrics=self.metrics)
         self.handpad = handpad
         self.camType = "QHY"
         self.initialize()
@@ -36,6 +50,22 @@ class QHYCamera(CameraInterface):
         ident = camera.connect(0x02).decode('UTF-8')[0:9]
         self.handpad.display("QHY camera found", ident, "")
         print('Found camera:',ident)
+        self.binning = 1
+        self.roi_binning = 1
+
+    def set_binning(self, bins: int) -> None:
+        """Sets the on sensor binning of the next captures, 2 reads out a quarter of the pixels
+
+        Parameters:
+        bins (int): The binning factor, 1 for full resolution"""
+        if self.camType == "not found":
+            return
+        self.binning = bins
+        self._apply_binning(bins)
+
+    def _apply_binning(self, bins: int) -> None:
+        camera.SetBin(bins, bins)
+        self.roi_binning = bins
 
     def capture(
             self, exposure_time: float, gain: float, radec: str, extra: Dict 
@@ -53,18 +83,115 @@ class QHYCamera(CameraInterface):
             self.handpad.display("camera not found", "", "")
             return
 
+        frame = self.capture_array(exposure_time, gain, radec, extra)
+        if frame is not None:
+            start_time = time.perf_counter()
+            cv2.imwrite(str(self.images_path / "capture.jpg"), frame.data)
+            self.metrics.record("encode_write", time.perf_counter() - start_time)
+
+    def capture_array(
+            self, exposure_time: float, gain: float, radec: str, extras: Dict
+    ) -> CameraFrame:
+        """Capture an image with the camera and return it in memory, no capture.jpg is written
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str): The Ra and Dec, used to name the stills
+        extras (Dict): "still": False to not archive the frame in the stills,
+            "full_resolution": True to capture this frame unbinned
+
+        Returns:
+        CameraFrame: The frame, its data wraps the ctypes buffer of the driver,
+            None when the camera is not found"""
+        if self.camType == "not found":
+            self.handpad.display("camera not found", "", "")
+            return None
+
+        timing = self.metrics.begin(exposure_time / 1000000)
+        with timing.phase("settings"):
+            bins = 1 if extras.get("full_resolution") else self.binning
+            if bins != self.roi_binning:
+                self._apply_binning(bins)
+            camera.SetGain(gain)
+            camera.SetExposure(exposure_time/1000)  # milliseconds
+
         timestr = time.strftime("%Y%m%d-%H%M%S")
+        timestamp = time.time()
+        # GetSingleFrame split up, to time the exposure and the USB readout separately
+        with timing.phase("exposure"):
+            exposed = camera.ExpSingleFrame()
+        with timing.phase("readout"):
+            read = camera.ReadSingleFrame()
+        if exposed != 0 or read != 0:
+            # imgdata still holds the previous frame
+            self.metrics.count("failed")
+            self.metrics.end(timing)
+            raise QHYCaptureError("Could not capture image", exposed, read)
+        img = np.asarray(camera.imgdata)
+        with timing.phase("temperature"):
+            temperature = self.get_temperature()
+        frame = CameraFrame(
+            img, exposure_time / 1000000, gain, timestamp, (camera.w.value, camera.h.value),
+            {"radec": radec, "camera": self.camType, "bpp": camera.bpp.value, "temperature": temperature},
+            bins,
+        )
+        # the stills are encoded and written in the background, this is only the copy
+        if extras.get("still", True):
+            with timing.phase("still"):
+                self.archiver.submit(frame, f"{timestr}_{radec}")
+        self.metrics.count("captures")
+        self.metrics.end(timing)
+        return frame
+
+    def start_live(self, exposure_time: float, gain: float) -> None:
+        """Puts the camera in live mode
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain"""
         camera.SetGain(gain)
         camera.SetExposure(exposure_time/1000)  # milliseconds
+        if self.binning != self.roi_binning:
+            self._apply_binning(self.binning)
+        camera.BeginLive()
 
-        img = camera.GetSingleFrame()
-        capture_path = self.images_path / "capture.jpg"
-        cv2.imwrite(capture_path,img)
-        copyfile(
-            capture_path,
-            self.stills_path / f"{timestr}_{radec}.jpg",
-        )
-        return
+    def read_live_frame(self, buffer: bytearray, timeout: float) -> bool:
+        """Reads the next live frame into the buffer, polls the driver until one is ready
+
+        Parameters:
+        buffer (bytearray): A preallocated buffer the size of a live_frame_shape frame
+        timeout (float): Seconds to wait for the frame
+
+        Returns:
+        bool: True if a complete frame was read"""
+        start_time = time.perf_counter()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if camera.GetLiveFrameInto(buffer):
+                self.metrics.record("live_read", time.perf_counter() - start_time)
+                self.metrics.count("live_frames")
+                return True
+            time.sleep(0.005)
+        self.metrics.count("timeouts")
+        return False
+
+    def stop_live(self) -> None:
+        """Ends live mode"""
+        camera.StopLive()
+
+    def live_frame_shape(self) -> Tuple[Tuple[int, int], np.dtype]:
+        """Returns the shape (height, width) and dtype of the live frames"""
+        dtype = np.uint16 if camera.bpp.value == 16 else np.uint8
+        return (camera.roi_h.value, camera.roi_w.value), np.dtype(dtype)
+
+    def get_temperature(self) -> Optional[float]:
+        """Returns the sensor temperature in degrees C"""
+        return camera.GetTemperature()
+
+    def get_metrics(self) -> Dict:
+        """Returns the capture timings and counters"""
+        return self.metrics.summary()
 
     def get_cam_type(self) -> str:
         """Return the type of the camera
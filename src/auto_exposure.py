@@ -0,0 +1,187 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+import math
+import time
+from frame_triage import TriageResult
+
+
+def exposure_ladder(exposures: List[float], gains: List[float]) -> List[Tuple[float, float]]:
+    """Orders the exposure and gain combinations from the least to the most signal, leaving out
+    the ones that need a longer exposure for a signal a shorter exposure with more gain also reaches.
+    A step up the ladder never shortens the exposure, so the lowest step that solves is the fastest.
+
+    Parameters:
+    exposures (List[float]): The exposure times in seconds, Exp_range
+    gains (List[float]): The gains, Gain_range
+
+    Returns:
+    List[Tuple[float, float]]: The (exposure, gain) steps"""
+    ladder = []
+    best_signal = {}
+    for exposure in sorted(set(exposures)):
+        shorter = max(best_signal.values(), default=0.0)
+        for gain in sorted(set(gains)):
+            if exposure * gain > shorter:
+                ladder.append((exposure, gain))
+        best_signal[exposure] = exposure * max(gains)
+    return sorted(ladder, key=lambda step: (step[0] * step[1], step[0]))
+
+
+class AutoExposure:
+    """Picks the exposure and gain of the next frame from the triage of the last one: more signal
+    when there are too few stars, less when the frame saturates or has stars to spare. The outcome
+    of every step is remembered per sky condition, so the next session starts at the shortest step
+    that solved reliably under the same sky."""
+
+    def __init__(
+        self,
+        store_file: Path,
+        exposures: List[float],
+        gains: List[float],
+        min_stars: int = 5,
+        target_stars: int = 20,
+        reliability: float = 0.8,
+        outcomes: int = 10,
+        history: int = 200,
+    ) -> None:
+        """Initializes the controller
+
+        Parameters:
+        store_file (Path): The json file the outcomes and the history are kept in between sessions
+        exposures (List[float]): The exposure times in seconds to choose from
+        gains (List[float]): The gains to choose from
+        min_stars (int): Fewer stars than this is a failed frame, see FrameTriage
+        target_stars (int): Frames with twice this many stars try a shorter step
+        reliability (float): The fraction of solved frames a step needs to be used
+        outcomes (int): Number of recent outcomes kept per step and sky condition
+        history (int): Number of frames kept in the history"""
+        self.store_file = store_file
+        self.ladder = exposure_ladder(exposures, gains)
+        self.min_stars = min_stars
+        self.target_stars = target_stars
+        self.reliability = reliability
+        self.outcomes = outcomes
+        self.history = history
+        self.store = self._load()
+        self.step = None
+        self.condition = None
+
+    def _load(self) -> Dict:
+        if not self.store_file.exists():
+            return {"conditions": {}, "history": []}
+        try:
+            with open(self.store_file) as f:
+                store = json.load(f)
+            store.setdefault("conditions", {})
+            store.setdefault("history", [])
+            return store
+        except (OSError, ValueError) as ex:
+            logging.warning(f"Ignoring unreadable {self.store_file}: {ex}")
+            return {"conditions": {}, "history": []}
+
+    def _save(self) -> None:
+        with open(self.store_file, "w") as f:
+            json.dump(self.store, f, indent=2)
+
+    def _nearest_step(self, exposure: float, gain: float) -> int:
+        signal = exposure * gain
+        return min(
+            range(len(self.ladder)),
+            key=lambda i: (abs(math.log(self.ladder[i][0] * self.ladder[i][1] / signal)), self.ladder[i][0]),
+        )
+
+    @staticmethod
+    def sky_condition(verdict: TriageResult, exposure: float, gain: float) -> str:
+        """Classifies the sky by its brightness, the background per unit of exposure and gain.
+        The classes are a factor 2 apart: a dark site, the moon up, twilight...
+
+        Parameters:
+        verdict (TriageResult): The triage of a frame
+        exposure (float): The exposure time of the frame in seconds
+        gain (float): The gain of the frame
+
+        Returns:
+        str: The name of the condition"""
+        level = verdict.background / verdict.full_scale / max(exposure * gain, 1e-6)
+        return f"sky{round(math.log2(max(level, 1e-9)))}"
+
+    def _outcomes(self, condition: str) -> Dict[str, List[int]]:
+        return self.store["conditions"].setdefault(condition, {})
+
+    def _reliable(self, condition: str, step: int) -> Optional[bool]:
+        # None when the step was not tried often enough to tell
+        results = self._outcomes(condition).get(str(self.ladder[step]), [])
+        if len(results) < 3:
+            return None
+        return sum(results) / len(results) >= self.reliability
+
+    def learned_step(self, condition: str) -> Optional[int]:
+        """Returns the shortest step that solved reliably under the sky condition
+
+        Parameters:
+        condition (str): The sky condition
+
+        Returns:
+        int: The index in the ladder, None if no step is known to be reliable"""
+        for step in range(len(self.ladder)):
+            if self._reliable(condition, step):
+                return step
+        return None
+
+    def settings(self) -> Tuple[float, float]:
+        """Returns the exposure (seconds) and gain for the next frame"""
+        return self.ladder[self.step if self.step is not None else len(self.ladder) // 2]
+
+    def observe(self, verdict: TriageResult, exposure: float, gain: float, solved: Optional[bool] = None) -> Tuple[float, float]:
+        """Records the outcome of a frame and chooses the settings of the next one
+
+        Parameters:
+        verdict (TriageResult): The triage of the frame
+        exposure (float): The exposure time of the frame in seconds
+        gain (float): The gain of the frame
+        solved (bool): True if the frame solved, None when it was not solved (only triaged)
+
+        Returns:
+        Tuple[float, float]: The exposure (seconds) and gain for the next frame"""
+        step = self._nearest_step(exposure, gain)
+        condition = self.sky_condition(verdict, exposure, gain)
+        success = verdict.ok if solved is None else solved
+        results = self._outcomes(condition).setdefault(str(self.ladder[step]), [])
+        results[:] = (results + [int(success)])[-self.outcomes :]
+        self.store["history"] = (
+            self.store["history"]
+            + [{
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"), "condition": condition, "exposure": exposure,
+                "gain": gain, "stars": verdict.star_count, "background": verdict.background,
+                "saturation": verdict.saturation, "solved": success,
+            }]
+        )[-self.history :]
+
+        if condition != self.condition and self.learned_step(condition) is not None:
+            # the sky changed, start from what worked before under this sky
+            self.condition = condition
+            self.step = self.learned_step(condition)
+        else:
+            self.condition = condition
+            self.step = self._next_step(verdict, step, success)
+        self._save()
+        next_exposure, next_gain = self.ladder[self.step]
+        if (next_exposure, next_gain) != (exposure, gain):
+            logging.info(f"Auto exposure ({condition}, {verdict}): next {next_exposure} s gain {next_gain}")
+        return next_exposure, next_gain
+
+    def _next_step(self, verdict: TriageResult, step: int, success: bool) -> int:
+        top = len(self.ladder) - 1
+        if verdict.reason in ("saturated", "overexposed"):
+            return max(step - 2, 0)
+        if verdict.star_count < self.min_stars:
+            # stars roughly double with every step, jump further when far off
+            return min(step + (2 if verdict.star_count < self.min_stars / 2 else 1), top)
+        if not success:
+            return min(step + 1, top)
+        if step > 0 and verdict.star_count >= 2 * self.target_stars and self._reliable(self.condition, step - 1) is not False:
+            # stars to spare, try the shorter step unless it is known to fail
+            return step - 1
+        return step
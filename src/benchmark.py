@@ -0,0 +1,329 @@
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import json
+import logging
+import os
+import re
+import time
+import numpy as np
+from PIL import Image
+from platesolve import PlateSolve
+from CameraSimulated import CameraSimulated
+from wcs_transform import TanSipWcs
+
+# Runs a corpus of frames through PlateSolve and reports per stage timings, success rate and
+# the error against the known positions. A corpus is a directory with a manifest.json like
+#
+# {
+#     "pix_scale": 15,
+#     "frames": [
+#         {"file": "m31.jpg", "ra": 10.8557, "dec": 41.1980},
+#         {"file": "m31.jpg", "ra": 10.8557, "dec": 41.1980, "hint": true,
+#          "synthetic": {"noise": 8, "shift": [12, -7], "seed": 1}}
+#     ]
+# }
+#
+# ra and dec are the J2000 position of the frame centre in degrees, from a verified solve of the
+# frame, not the position of the target, which is rarely at the centre. Frames are jpg/png or npy.
+# "synthetic" derives a new frame from the file: shifted, with extra noise, hot pixels or a
+# reduced signal, to measure how the solver copes with poorer frames.
+# An entry without a file is rendered by CameraSimulated at its ra and dec:
+#         {"ra": 83.8, "dec": -5.4, "simulated": {"seed": 3, "exposure": 1, "gain": 50}}
+
+STAGES = ["load", "extraction", "tracking", "xylist", "solve_field", "wcs"]
+
+
+def load_frame(path: Path) -> np.ndarray:
+    """Reads a frame of the corpus
+
+    Parameters:
+    path (Path): A jpg/png image or a npy array
+
+    Returns:
+    np.ndarray: The frame, greyscale"""
+    if path.suffix == ".npy":
+        return np.load(path)
+    return np.asarray(Image.open(path).convert("L"))
+
+
+def synthesize(image: np.ndarray, settings: Dict) -> np.ndarray:
+    """Derives a poorer frame from a real one, the frame centre moves with the shift
+
+    Parameters:
+    image (np.ndarray): The real frame
+    settings (Dict): Optional shift [dx, dy] in pixels, noise (sigma), hot_pixels (count),
+        signal (factor on the stars above the median) and seed
+
+    Returns:
+    np.ndarray: The new frame, same shape and dtype"""
+    rng = np.random.default_rng(settings.get("seed", 0))
+    data = image.astype(np.float32)
+    dx, dy = settings.get("shift", [0, 0])
+    if dx or dy:
+        data = np.roll(data, (int(dy), int(dx)), axis=(0, 1))
+    if "signal" in settings:
+        median = np.median(data)
+        data = median + (data - median) * settings["signal"]
+    if settings.get("noise"):
+        data += rng.normal(0, settings["noise"], data.shape)
+    full_scale = float(np.iinfo(image.dtype).max) if image.dtype.kind in "ui" else 1.0
+    hot_pixels = settings.get("hot_pixels", 0)
+    if hot_pixels:
+        data[rng.integers(0, data.shape[0], hot_pixels), rng.integers(0, data.shape[1], hot_pixels)] = full_scale
+    return np.clip(data, 0, full_scale).astype(image.dtype)
+
+
+def simulated_manifest(count: int, seed: int, pix_scale: float) -> Dict:
+    """Returns a corpus of frames rendered at random positions on the sky
+
+    Parameters:
+    count (int): The number of frames
+    seed (int): The seed of the positions and of the frames
+    pix_scale (float): The pixel scale of the simulated camera
+
+    Returns:
+    Dict: The manifest"""
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0, 360, count)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    return {
+        "pix_scale": pix_scale,
+        "frames": [
+            {"ra": float(ra[i]), "dec": float(dec[i]), "simulated": {"seed": seed + i}} for i in range(count)
+        ],
+    }
+
+
+def separation(ra1: float, dec1: float, ra2: float, dec2: float) -> float:
+    """Returns the angle in degrees between two positions given in degrees"""
+    ra1, dec1, ra2, dec2 = np.radians([ra1, dec1, ra2, dec2])
+    cos_angle = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+    return float(np.degrees(np.arccos(np.clip(cos_angle, -1, 1))))
+
+
+class Benchmark:
+    """Feeds the frames of a corpus through PlateSolve and collects the measurements"""
+
+    def __init__(
+        self,
+        corpus_path: Path,
+        work_path: Path,
+        use_service: bool = False,
+        race: bool = False,
+        repeat: int = 1,
+        manifest: Optional[Dict] = None,
+    ) -> None:
+        """Initializes the benchmark
+
+        Parameters:
+        corpus_path (Path): The directory with the frames and manifest.json
+        work_path (Path): Scratch directory for the solver files and the learned scale
+        use_service (bool): Solve through the solver service instead of a new solve-field per frame
+        race (bool): Race the solve strategies instead of the hint ladder
+        repeat (int): Number of times every frame is solved
+        manifest (Dict): The frames to solve instead of the manifest.json of the corpus"""
+        self.corpus_path = corpus_path
+        if manifest is None:
+            with open(corpus_path / "manifest.json") as f:
+                manifest = json.load(f)
+        self.manifest = manifest
+        self.camera = None
+        self.repeat = repeat
+        os.makedirs(work_path, exist_ok=True)
+        self.platesolve = PlateSolve(self.manifest.get("pix_scale", 15), work_path, work_path, use_service)
+        self.platesolve.race = race
+        self.wcs_file = work_path / "capture.wcs"
+
+    def run(self) -> Dict:
+        """Solves every frame of the corpus
+
+        Returns:
+        Dict: The per frame results and the summary"""
+        frames = []
+        for entry in self.manifest["frames"]:
+            for run in range(self.repeat):
+                frames.append(self.run_frame(entry, run))
+        return {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "options": {"service": self.platesolve.service is not None, "race": self.platesolve.race},
+            "frames": frames,
+            "summary": self.summarize(frames),
+        }
+
+    def run_frame(self, entry: Dict, run: int) -> Dict:
+        """Solves one frame of the corpus
+
+        Parameters:
+        entry (Dict): The manifest entry of the frame
+        run (int): The repeat number
+
+        Returns:
+        Dict: The measurements"""
+        ra, dec = entry["ra"], entry["dec"]
+        start_time = time.time()
+        if "simulated" in entry:
+            name = f"simulated {ra:.2f} {dec:.2f}"
+            image = self.render(entry)
+        else:
+            name = entry["file"] + (" (synthetic)" if "synthetic" in entry else "")
+            image = load_frame(self.corpus_path / entry["file"])
+        load_time = time.time() - start_time
+        if "synthetic" in entry:
+            image = synthesize(image, entry["synthetic"])
+        if self.wcs_file.exists():
+            os.remove(self.wcs_file)
+
+        verdict = self.platesolve.triage_frame(image)
+        record = {"file": name, "run": run, "triage": verdict.reason or "ok", "stars": verdict.star_count}
+        # the hint is given in hours, like the Nexus reports it
+        radec_hint = (ra / 15, dec) if entry.get("hint") else None
+        result, elapsed_time = self.platesolve.solve_image(False, radec_hint, image)
+        solved = result is not None and self.platesolve.is_solved(result)
+        timings = dict(self.platesolve.timings)
+        timings["load"] = timings.get("load", 0.0) + load_time
+        record.update({"solved": solved, "elapsed": elapsed_time + load_time, "timings": timings})
+        if solved and self.wcs_file.exists():
+            wcs = TanSipWcs.from_file(self.wcs_file)
+            height, width = image.shape[:2]
+            # the synthetic shift moves the known position away from the frame centre
+            dx, dy = entry.get("synthetic", {}).get("shift", [0, 0])
+            centre_ra, centre_dec = wcs.xy2rd((width + 1) / 2 + dx, (height + 1) / 2 + dy)
+            record["error_arcsec"] = 3600 * separation(float(centre_ra), float(centre_dec), ra, dec)
+            record["pixel_scale"] = wcs.pixel_scale()
+        match = re.search(r"log-odds ratio ([-\d.]+)", str(result.stdout)) if result is not None else None
+        if match:
+            record["log_odds"] = float(match.group(1))
+        logging.info(
+            f"{name} run {run}: solved={solved} time={record['elapsed']:.2f} "
+            f"error={record.get('error_arcsec', float('nan')):.1f}\""
+        )
+        return record
+
+    def render(self, entry: Dict) -> np.ndarray:
+        """Renders a simulated frame of the corpus
+
+        Parameters:
+        entry (Dict): The manifest entry, with the settings of the frame in "simulated"
+
+        Returns:
+        np.ndarray: The frame"""
+        settings = entry["simulated"]
+        if self.camera is None:
+            self.camera = CameraSimulated(pix_scale=self.manifest.get("pix_scale", 15), seed=settings.get("seed", 0))
+        self.camera.roll = settings.get("roll", 0.0)
+        return self.camera.render(
+            entry["ra"], entry["dec"], settings.get("exposure", 1.0), settings.get("gain", 50), seed=settings.get("seed")
+        )
+
+    @staticmethod
+    def summarize(frames: List[Dict]) -> Dict:
+        """Reduces the per frame results to the numbers a baseline is compared on
+
+        Parameters:
+        frames (List[Dict]): The per frame results
+
+        Returns:
+        Dict: Success rate, timing percentiles, median stage timings and median error"""
+        solved = [f for f in frames if f["solved"]]
+        elapsed = [f["elapsed"] for f in frames]
+        errors = [f["error_arcsec"] for f in solved if "error_arcsec" in f]
+        stages = {}
+        for stage in STAGES:
+            times = [f["timings"][stage] for f in frames if stage in f["timings"]]
+            if times:
+                stages[stage] = float(np.median(times))
+        return {
+            "frames": len(frames),
+            "success_rate": len(solved) / len(frames) if frames else 0.0,
+            "median_time": float(np.median(elapsed)) if elapsed else 0.0,
+            "p90_time": float(np.percentile(elapsed, 90)) if elapsed else 0.0,
+            "median_error_arcsec": float(np.median(errors)) if errors else None,
+            "median_attempts": float(np.median([f["timings"].get("attempts", 0) for f in frames])) if frames else 0.0,
+            "stages": stages,
+        }
+
+
+def compare(summary: Dict, baseline: Dict, time_tolerance: float = 0.2, error_tolerance: float = 0.5) -> List[str]:
+    """Lists the regressions of a run against a baseline
+
+    Parameters:
+    summary (Dict): The summary of the new run
+    baseline (Dict): The summary of the baseline
+    time_tolerance (float): Relative slow down that is still accepted, 0.2 is 20%
+    error_tolerance (float): Relative increase of the position error that is still accepted
+
+    Returns:
+    List[str]: A line per regression, empty when there is none"""
+    regressions = []
+    if summary["success_rate"] < baseline["success_rate"]:
+        regressions.append(
+            f"success rate {summary['success_rate']:.0%} < baseline {baseline['success_rate']:.0%}"
+        )
+    for key in ("median_time", "p90_time"):
+        if summary[key] > baseline[key] * (1 + time_tolerance):
+            regressions.append(f"{key} {summary[key]:.2f} s > baseline {baseline[key]:.2f} s")
+    for stage, baseline_time in baseline["stages"].items():
+        stage_time = summary["stages"].get(stage)
+        # ignore stages too short to time reliably
+        if stage_time is not None and stage_time > 0.01 and stage_time > baseline_time * (1 + time_tolerance):
+            regressions.append(f"stage {stage} {stage_time:.3f} s > baseline {baseline_time:.3f} s")
+    error, baseline_error = summary["median_error_arcsec"], baseline["median_error_arcsec"]
+    if error is not None and baseline_error is not None and error > max(baseline_error * (1 + error_tolerance), 1.0):
+        regressions.append(f"median error {error:.1f}\" > baseline {baseline_error:.1f}\"")
+    return regressions
+
+
+def report(summary: Dict, baseline: Optional[Dict] = None) -> str:
+    """Formats the summary, next to the baseline when given"""
+    lines = []
+    for key in ("frames", "success_rate", "median_time", "p90_time", "median_error_arcsec", "median_attempts"):
+        line = f"{key:22} {summary[key]}"
+        if baseline is not None:
+            line += f"  (baseline {baseline.get(key)})"
+        lines.append(line)
+    for stage, stage_time in summary["stages"].items():
+        line = f"  {stage:20} {stage_time:.3f} s"
+        if baseline is not None and stage in baseline["stages"]:
+            line += f"  (baseline {baseline['stages'][stage]:.3f} s)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s: %(levelname)s %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="eFinder plate solve benchmark")
+    parser.add_argument("--corpus", help="Directory with the frames and manifest.json", default="testimages", required=False)
+    parser.add_argument("--work", help="Scratch directory for the solver", default="/dev/shm/benchmark", required=False)
+    parser.add_argument("--output", help="Write the results to this json file", required=False)
+    parser.add_argument("--save-baseline", help="Store the summary as a baseline in this json file", required=False)
+    parser.add_argument("--compare", help="Compare against the baseline in this json file", required=False)
+    parser.add_argument("--repeat", help="Solve every frame this many times", type=int, default=1, required=False)
+    parser.add_argument("--service", help="Solve through the solver service", action="store_true")
+    parser.add_argument("--race", help="Race the solve strategies", action="store_true")
+    parser.add_argument("--simulate", help="Solve this many simulated frames instead of the corpus", type=int, default=0, required=False)
+    parser.add_argument("--seed", help="Seed of the simulated frames", type=int, default=0, required=False)
+    parser.add_argument("--time-tolerance", help="Accepted relative slow down", type=float, default=0.2, required=False)
+    args = parser.parse_args()
+
+    manifest = simulated_manifest(args.simulate, args.seed, 15) if args.simulate else None
+    benchmark = Benchmark(Path(args.corpus), Path(args.work), args.service, args.race, args.repeat, manifest)
+    results = benchmark.run()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"created": results["created"], "options": results["options"], "summary": results["summary"]}, f, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["summary"]
+    print(report(results["summary"], baseline))
+    if baseline is not None:
+        regressions = compare(results["summary"], baseline, args.time_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,211 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from CameraInterface import CameraInterface, CameraFrame
+
+# Master darks and hot pixel maps, one set per camera, frame size, exposure, gain and sensor
+# temperature. Every set is a pair of .npy files in the store directory, opened memory-mapped so
+# a set is only read from disk (or /dev/shm) as far as it is used, and index.json lists the sets.
+
+
+class CalibrationSet:
+    """A master dark and the hot pixels found in it, applied to frames of the same settings"""
+
+    def __init__(self, dark: np.ndarray, hot_pixels: np.ndarray) -> None:
+        """Initializes the set
+
+        Parameters:
+        dark (np.ndarray): The master dark, memory-mapped, same shape and dtype as the frames
+        hot_pixels (np.ndarray): The flat indices of the hot pixels"""
+        self.dark = dark
+        self.hot_pixels = hot_pixels
+        height, width = dark.shape
+        # the hot pixels are replaced by the mean of their left and right neighbours
+        column = hot_pixels % width
+        self.left = np.where(column > 0, hot_pixels - 1, hot_pixels + 1)
+        self.right = np.where(column < width - 1, hot_pixels + 1, hot_pixels - 1)
+        self.scratch = np.empty_like(dark)
+        self.lock = threading.Lock()
+
+    def apply(self, data: np.ndarray) -> None:
+        """Subtracts the dark and repairs the hot pixels, in place
+
+        Parameters:
+        data (np.ndarray): The frame, overwritten"""
+        # clip at zero instead of wrapping around, without allocating: data -= min(data, dark)
+        with self.lock:
+            np.minimum(data, self.dark, out=self.scratch)
+            np.subtract(data, self.scratch, out=data)
+        if len(self.hot_pixels):
+            flat = data.reshape(-1)
+            flat[self.hot_pixels] = (
+                flat[self.left].astype(np.uint32) + flat[self.right]
+            ) // 2
+
+
+class Calibration:
+    """Builds the master darks and applies them to the captured frames"""
+
+    def __init__(self, store_path: Path, temperature_step: float = 5.0) -> None:
+        """Initializes the calibration store
+
+        Parameters:
+        store_path (Path): The directory the sets are kept in
+        temperature_step (float): Darks are reused for sensor temperatures within half this step (degrees C)"""
+        self.store_path = store_path
+        self.temperature_step = temperature_step
+        os.makedirs(store_path, exist_ok=True)
+        self.index_file = store_path / "index.json"
+        self.index = self._load()
+        # the opened sets by key, a missing set is cached as None
+        self.sets: Dict[str, Optional[CalibrationSet]] = {}
+
+    def _load(self) -> Dict:
+        if not self.index_file.exists():
+            return {}
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as ex:
+            logging.warning(f"Ignoring unreadable {self.index_file}: {ex}")
+            return {}
+
+    def _save(self) -> None:
+        with open(self.index_file, "w") as f:
+            json.dump(self.index, f, indent=2)
+
+    def key(self, camera: str, shape: Tuple[int, int], exposure: float, gain: float, temperature: Optional[float]) -> str:
+        """Returns the name of the set for the given settings
+
+        Parameters:
+        camera (str): The camera type
+        shape (Tuple[int, int]): The frame height and width, differs per binning
+        exposure (float): The exposure time in seconds
+        gain (float): The gain
+        temperature (float): The sensor temperature in degrees C, None if the camera does not report it
+
+        Returns:
+        str: The key of the set"""
+        if temperature is None:
+            band = "na"
+        else:
+            band = f"{int(round(temperature / self.temperature_step) * self.temperature_step):+d}C"
+        return f"{camera}_{shape[1]}x{shape[0]}_{exposure:g}s_g{gain:g}_{band}"
+
+    def build(
+        self,
+        frames: List[np.ndarray],
+        camera: str,
+        exposure: float,
+        gain: float,
+        temperature: Optional[float],
+        hot_sigma: float = 6.0,
+    ) -> str:
+        """Combines dark frames into a master dark and a hot pixel map and stores them
+
+        Parameters:
+        frames (List[np.ndarray]): Frames taken with the lens covered
+        camera (str): The camera type
+        exposure (float): The exposure time in seconds
+        gain (float): The gain
+        temperature (float): The sensor temperature in degrees C, None if unknown
+        hot_sigma (float): Pixels this many sigma above the dark level are hot
+
+        Returns:
+        str: The key of the new set"""
+        stack = np.stack(frames)
+        # the median rejects cosmic rays and the odd satellite in one of the frames
+        master = np.median(stack, axis=0).astype(frames[0].dtype)
+        level = np.median(master)
+        sigma = max(1.4826 * float(np.median(np.abs(master.astype(np.float32) - level))), 1.0)
+        hot_pixels = np.flatnonzero(master > level + hot_sigma * sigma)
+        key = self.key(camera, master.shape, exposure, gain, temperature)
+        dark = np.lib.format.open_memmap(
+            self.store_path / f"{key}.dark.npy", mode="w+", dtype=master.dtype, shape=master.shape
+        )
+        dark[:] = master
+        dark.flush()
+        np.save(self.store_path / f"{key}.hot.npy", hot_pixels)
+        self.index[key] = {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "frames": len(frames),
+            "level": float(level),
+            "hot_pixels": int(len(hot_pixels)),
+        }
+        self._save()
+        self.sets.pop(key, None)
+        logging.info(f"Calibration {key}: dark level {level:.1f}, {len(hot_pixels)} hot pixels")
+        return key
+
+    def lookup(self, camera: str, shape: Tuple[int, int], exposure: float, gain: float, temperature: Optional[float]) -> Optional[CalibrationSet]:
+        """Returns the set for the settings, opened once and then kept
+
+        Parameters:
+        camera (str): The camera type
+        shape (Tuple[int, int]): The frame height and width
+        exposure (float): The exposure time in seconds
+        gain (float): The gain
+        temperature (float): The sensor temperature in degrees C, None if unknown
+
+        Returns:
+        CalibrationSet: The set, None if no darks were built for these settings"""
+        key = self.key(camera, shape, exposure, gain, temperature)
+        if key not in self.sets:
+            calibration_set = None
+            if key in self.index:
+                try:
+                    dark = np.load(self.store_path / f"{key}.dark.npy", mmap_mode="r")
+                    calibration_set = CalibrationSet(dark, np.load(self.store_path / f"{key}.hot.npy"))
+                except (OSError, ValueError) as ex:
+                    logging.warning(f"Calibration {key} is unreadable: {ex}")
+            self.sets[key] = calibration_set
+        return self.sets[key]
+
+    def apply_frame(self, frame: CameraFrame) -> bool:
+        """Calibrates the frame in place when there is a set for its settings
+
+        Parameters:
+        frame (CameraFrame): The captured frame
+
+        Returns:
+        bool: True if the frame was calibrated"""
+        if frame is None or frame.data.ndim != 2:
+            return False
+        calibration_set = self.lookup(
+            frame.metadata.get("camera", ""), frame.data.shape, frame.exposure, frame.gain,
+            frame.metadata.get("temperature"),
+        )
+        if calibration_set is None or calibration_set.dark.dtype != frame.data.dtype:
+            return False
+        calibration_set.apply(frame.data)
+        frame.metadata["calibrated"] = True
+        return True
+
+
+def build_darks(calibration: Calibration, camera: CameraInterface, exposure_time: float, gain: float, count: int = 10) -> str:
+    """Captures a series of darks and stores the master dark, the lens must be covered
+
+    Parameters:
+    calibration (Calibration): The store
+    camera (CameraInterface): The camera, at the binning the frames will be taken with
+    exposure_time (float): The exposure time in microseconds
+    gain (float): The gain
+    count (int): The number of dark frames
+
+    Returns:
+    str: The key of the new set"""
+    frames = []
+    temperatures = []
+    for _ in range(count):
+        frame = camera.capture_array(exposure_time, gain, "dark", {"still": False})
+        # the camera reuses its buffer for the next capture
+        frames.append(frame.data.copy())
+        if frame.metadata.get("temperature") is not None:
+            temperatures.append(frame.metadata["temperature"])
+    temperature = float(np.median(temperatures)) if temperatures else None
+    return calibration.build(frames, frame.metadata.get("camera", ""), frame.exposure, frame.gain, temperature)
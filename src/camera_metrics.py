@@ -0,0 +1,120 @@
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+import logging
+import threading
+import time
+import numpy as np
+
+
+class CaptureTiming:
+    """The timing record of one capture, the seconds spent in each phase"""
+
+    def __init__(self, exposure: Optional[float]) -> None:
+        """Initializes the record
+
+        Parameters:
+        exposure (float): The requested exposure time in seconds, None for work outside a capture"""
+        self.started = time.time()
+        self.exposure = exposure
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Times the block as the named phase, a phase entered twice adds up"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start_time
+
+    def total(self) -> float:
+        """Returns the seconds spent in all phases"""
+        return sum(self.phases.values())
+
+    def __str__(self) -> str:
+        phases = " ".join(f"{name} {seconds * 1000:.1f}" for name, seconds in self.phases.items())
+        return f"exposure {self.exposure} s: {phases} ms"
+
+
+class CameraMetrics:
+    """Collects the timing records and the counters (dropped frames, timeouts, errors) of a camera"""
+
+    def __init__(self, history: int = 100) -> None:
+        """Initializes the metrics
+
+        Parameters:
+        history (int): Number of recent timing records kept"""
+        self.records: Deque[CaptureTiming] = deque(maxlen=history)
+        self.counters: Dict[str, int] = {}
+        # the capture and the stills writer record from different threads
+        self.lock = threading.Lock()
+
+    def begin(self, exposure: float) -> CaptureTiming:
+        """Starts the timing record of a capture
+
+        Parameters:
+        exposure (float): The requested exposure time in seconds
+
+        Returns:
+        CaptureTiming: The record, handed back to end when the capture is done"""
+        return CaptureTiming(exposure)
+
+    def end(self, timing: CaptureTiming) -> None:
+        """Stores a finished timing record
+
+        Parameters:
+        timing (CaptureTiming): The record"""
+        with self.lock:
+            self.records.append(timing)
+        logging.debug(f"Capture timing {timing}")
+
+    def count(self, name: str, increment: int = 1) -> None:
+        """Increments a counter like "dropped" or "timeouts"
+
+        Parameters:
+        name (str): The counter
+        increment (int): The amount to add"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def record(self, name: str, seconds: float) -> None:
+        """Stores a phase timed outside a capture, like the writing of a still
+
+        Parameters:
+        name (str): The phase
+        seconds (float): The time it took"""
+        timing = CaptureTiming(None)
+        timing.phases[name] = seconds
+        with self.lock:
+            self.records.append(timing)
+
+    def summary(self) -> Dict:
+        """Returns the counters and per phase statistics of the recent records
+
+        Returns:
+        Dict: "counters", "phases" with count, mean, median, p90 and max in seconds per phase,
+            and "last", the phases of the newest capture"""
+        with self.lock:
+            records = list(self.records)
+            counters = dict(self.counters)
+        times: Dict[str, list] = {}
+        for record in records:
+            for name, seconds in record.phases.items():
+                times.setdefault(name, []).append(seconds)
+        phases = {
+            name: {
+                "count": len(values),
+                "mean": float(np.mean(values)),
+                "median": float(np.median(values)),
+                "p90": float(np.percentile(values, 90)),
+                "max": float(np.max(values)),
+            }
+            for name, values in times.items()
+        }
+        captures = [record for record in records if record.exposure is not None]
+        return {
+            "counters": counters,
+            "phases": phases,
+            "last": dict(captures[-1].phases) if captures else {},
+        }
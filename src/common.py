@@ -1,8 +1,7 @@
-import subprocess
-import re
 from skyfield.api import load, Star, wgs84
 import math
 from pathlib import Path
+from wcs_transform import TanSipWcs
 
 version_string = "16_5"
 
@@ -16,34 +15,32 @@ class Common:
         self.pix_scale = pix_scale
         self.ts = load.timescale()
         self.version = version_string + version_suffix
+        self.wcs = None
+        self.wcs_mtime = None
 
     def get_version(self):
         return self.version
 
+    # returns the in memory transform of the last solve, capture.wcs is only parsed again when it changed
+    def get_wcs(self) -> TanSipWcs:
+        wcs_file = Path(self.images_path, "capture.wcs")
+        mtime = wcs_file.stat().st_mtime_ns
+        if self.wcs is None or mtime != self.wcs_mtime:
+            self.wcs = TanSipWcs.from_file(wcs_file)
+            self.wcs_mtime = mtime
+        return self.wcs
+
     # returns the RA & Dec (J2000) corresponding to an image x,y pixel
     def xy2rd(self, x, y):
-        result = subprocess.run(
-            [
-                "wcs-xy2rd",
-                "-w",
-                Path(self.images_path, "capture.wcs"),
-                "-x",
-                str(x),
-                "-y",
-                str(y),
-            ],
-            capture_output=True,
-            text=True,
-        )
-        result = str(result.stdout)
-        line = result.split("RA,Dec")[1]
-        ra, dec = re.findall("[-,+]?\d+\.\d+", line)
+        ra, dec = self.get_wcs().xy2rd(x, y)
         return (float(ra), float(dec))
 
     # converts an image pixel x,y to a delta x,y in degrees.
-    def pixel2dxdy(self, pix_x, pix_y):
-        deg_x = (float(pix_x) - 640) * self.pix_scale / 3600  # in degrees
-        deg_y = (480 - float(pix_y)) * self.pix_scale / 3600
+    # width, height and binning describe the frame, the defaults are the unbinned 1280 x 960 sensor
+    def pixel2dxdy(self, pix_x, pix_y, width=1280, height=960, binning=1):
+        scale = self.pix_scale * binning  # arcsec per frame pixel
+        deg_x = (float(pix_x) - width / 2) * scale / 3600  # in degrees
+        deg_y = (height / 2 - float(pix_y)) * scale / 3600
         # +ve if finder is left of Polaris
         dxstr = "{: .1f}".format(float(60 * deg_x))
         dystr = "{: .1f}".format(
@@ -51,9 +48,10 @@ class Common:
         )  # +ve if finder is looking below Polaris
         return (deg_x, deg_y, dxstr, dystr)
 
-    def dxdy2pixel(self, dx, dy):
-        pix_x = dx * 3600 / self.pix_scale + 640
-        pix_y = 480 - dy * 3600 / self.pix_scale
+    def dxdy2pixel(self, dx, dy, width=1280, height=960, binning=1):
+        scale = self.pix_scale * binning  # arcsec per frame pixel
+        pix_x = dx * 3600 / scale + width / 2
+        pix_y = height / 2 - dy * 3600 / scale
         # +ve if finder is left of Polaris
         dxstr = "{: .1f}".format(float(60 * dx))
         # +ve if finder is looking below Polaris
@@ -61,9 +59,14 @@ class Common:
         return (pix_x, pix_y, dxstr, dystr)
 
     # creates & returns a 'Skyfield star object' at the set offset and adjusted to Jnow
-    def applyOffset(self, nexus, offset):
-        x_offset, y_offset, dxstr, dystr = self.dxdy2pixel(offset[0], offset[1])
-        ra, dec = self.xy2rd(x_offset, y_offset)
+    # wcs is the solution to use, the last capture.wcs when not given, binning that of the solved frame
+    def applyOffset(self, nexus, offset, wcs=None, binning=1):
+        if wcs is None:
+            wcs = self.get_wcs()
+        width = wcs.width or 1280 // binning
+        height = wcs.height or 960 // binning
+        x_offset, y_offset, dxstr, dystr = self.dxdy2pixel(offset[0], offset[1], width, height, binning)
+        ra, dec = wcs.xy2rd(x_offset, y_offset)
         solved = Star(
             ra_hours=float(ra) / 15, dec_degrees=float(dec)
         )  # will set as J2000 as no epoch input
@@ -90,7 +93,7 @@ class Common:
         delta_alt = 60 * (delta_alt)  # in arcminutes
         return delta_az, delta_alt
 
-    def pick_camera(self, camera_type, handpad, images_path):
+    def pick_camera(self, camera_type, handpad, images_path, nexus=None):
         camera = None
         if "ASI" in camera_type:
             import ASICamera
@@ -104,4 +107,22 @@ class Common:
             import CameraDebug
 
             camera = CameraDebug.CameraDebug(images_path)
+        elif "SIM" in camera_type:
+            import CameraSimulated
+
+            # renders the sky where the (debug) Nexus points
+            camera = CameraSimulated.CameraSimulated(
+                handpad, images_path, nexus.get_radec if nexus is not None else None, pix_scale=self.pix_scale
+            )
         return camera
+
+    def configure_stills(self, camera, param):
+        # the format and quota of the stills archive, the test camera keeps no stills
+        archiver = getattr(camera, "archiver", None)
+        if archiver is not None:
+            archiver.configure(
+                param.get("Stills format", "jpg"),
+                int(param.get("Stills quality", "90")),
+                float(param.get("Stills quota MB", "0")),
+                float(param.get("Stills max days", "0")),
+            )
@@ -17,20 +17,27 @@ import subprocess
 import time
 import os
 import math
-from PIL import Image
 import psutil
 import re
 from skyfield.api import Star
 import numpy as np
 import threading
+import queue
 import select
+import atexit
 from pathlib import Path
-import fitsio
 import Nexus
+from nexus_async import NexusSync
 import Coordinates
 import Display
 import ASICamera
 from platesolve import PlateSolve
+from auto_exposure import AutoExposure
+from calibration import Calibration
+from stacking import capture_stack
+from nexus_poller import NexusPoller
+from live_capture import LiveCapture
+from pipeline import LiveSolvePipeline, put_latest
 from common import Common
 import utils
 
@@ -46,40 +53,106 @@ align_count = 0
 offset = 640, 480
 star_name = "no star"
 solve = False
+fail_reason = ""
+frame = None  # the last captured CameraFrame
 sync_count = 0
 pix_scale = 15
-platesolve = PlateSolve(pix_scale, images_path)
+calibration = Calibration(cwd_path / "calibration")
+stackers = {}  # the FrameStackers by frame size, their buffers are reused
+camera_lock = threading.Lock()  # the live solve thread and the buttons take turns on the camera
+live_solutions = queue.Queue(maxsize=1)  # the newest live solution, shown by the main loop
 common = Common(cwd_path=cwd_path, images_path=images_path, pix_scale=pix_scale, version_suffix="")
 version = common.get_version()
 
 def imgDisplay():  # displays the captured image on the Pi desktop.
+    if frame is None:
+        return
     for proc in psutil.process_iter():
         if proc.name() == "display":
             proc.kill()  # delete any previous image display
-    im = Image.open(images_path / "capture.jpg")
+    im = frame.to_image()
     im.show()
 
 
 def solveImage():
-    global offset_flag, solve, solvedPos, elapsed_time, star_name, star_name_offset, solved_radec, solved_altaz
+    global offset_flag, solve, solvedPos, elapsed_time, star_name, star_name_offset, solved_radec, solved_altaz, fail_reason
+    fail_reason = ""
+    if frame is None:
+        # the camera delivered no frame, there is nothing to solve
+        fail_reason = "no frame"
+        handpad.display("Not Solved", fail_reason, "")
+        solve = False
+        return
+    image = frame.data
+    verdict = platesolve.triage_frame(image, frame.binning)
+    if not verdict.ok:
+        print("Frame rejected:", verdict)
+        auto_expose(frame, verdict)
+        fail_reason = verdict.reason
+        handpad.display("Not Solved", fail_reason, "")
+        solve = False
+        return
     handpad.display("Started solving", "", "")
-    result, elapsed_time = platesolve.solve_image(offset_flag)
+    # the test images are not taken where the scope points and an unaligned Nexus reports a
+    # position that can be far off, solve those blind
+    radec_hint = mount_at(frame)[0] if param["Test mode"] != "1" and nexus.is_aligned() else None
+    # a job, so it preempts a live solve instead of racing it for the shared solve files
+    job = platesolve.submit(offset_flag, radec_hint, image, binning=frame.binning)
+    job.wait()
+    if job.state != "done":
+        handpad.display("Not Solved", job.state, "")
+        solve = False
+        return
+    result, elapsed_time = job.result, job.elapsed
     result = str(result.stdout)
+    auto_expose(frame, verdict, "solved" in result)
     if "solved" not in result:
         print("Bad Luck - Solve Failed")
         handpad.display("Not Solved", "", "")
         solve = False
         return
     if (offset_flag == True) and ("The star" in result):
-        table, h = fitsio.read(cwd_path / "capture.axy", header=True)
-        star_name_offset = table[0][0], table[0][1]
+        # the stars of this solve, platesolve.stars may already belong to a live solve
+        brightest = job.stars[0]
+        star_name_offset = brightest["X"], brightest["Y"]
         lines = result.split("\n")
         for line in lines:
             if line.startswith("  The star "):
                 star_name = line.split(" ")[4]
                 print("Solve-field Plot found: ", star_name)
                 break
-    solvedPos = common.applyOffset(nexus, offset)
+    set_solution(job.wcs, frame.binning, frame)
+
+
+def mount_at(exposed):
+    # the Nexus position (radec, altaz) halfway the exposure when the poller runs, else the last one read
+    snapshot = None
+    if poller is not None and exposed is not None:
+        snapshot = poller.snapshot_at(exposed.timestamp + exposed.exposure / 2)
+    if snapshot is None:
+        return nexus.get_radec(), nexus.get_altAz()
+    return snapshot.radec, snapshot.altaz
+
+
+def auto_expose(exposed, verdict, solved=None):
+    # in auto exposure mode the outcome of the frame sets the exposure and gain of the next one
+    if param.get("Auto exposure", "0") != "1":
+        return
+    exposure, gain = auto_exposure.observe(verdict, exposed.exposure, exposed.gain, solved)
+    if float(param["Exposure"]) == exposure and float(param["Gain"]) == gain:
+        return
+    param["Exposure"] = arr[1, 1][1] = exposure
+    param["Gain"] = arr[1, 2][1] = gain
+    show_summary()
+    if not live_solve.running:
+        # while live solving the settings are saved once it stops, not for every frame
+        save_param()
+
+
+def set_solution(wcs=None, binning=1, exposed=None):
+    # applies the offset to the solution (capture.wcs when no wcs is given) and updates the screens
+    global solve, solvedPos, solved_radec, solved_altaz
+    solvedPos = common.applyOffset(nexus, offset, wcs, binning)
     ra, dec, d = solvedPos.apparent().radec(coordinates.get_ts().now())
     solved_radec = ra.hours, dec.degrees
     solved_altaz = coordinates.conv_altaz(nexus, *(solved_radec))
@@ -88,12 +161,62 @@ def solveImage():
     arr[0, 2][1] = "   Dec " + coordinates.dd2dms(solved_radec[1])
     arr[0, 2][2] = "time: " + str(elapsed_time)[0:4] + " s"
     solve = True
-    deltaCalc()
+    deltaCalc(exposed)
+
+
+def take_frame(radec, extras):
+    # a calibrated frame, or the stack of "Stack frames" short frames to reach fainter stars
+    exposure_time = int(float(param["Exposure"]) * 1000000)
+    gain_value = int(float(param["Gain"]))
+    count = int(param.get("Stack frames", "1"))
+    with camera_lock:
+        if count > 1 and not extras.get("full_resolution"):
+            return capture_stack(camera, exposure_time, gain_value, radec, extras, count, stackers, calibration.apply_frame)
+        taken = camera.capture_array(exposure_time, gain_value, radec, extras)
+        if taken is None:
+            return None
+        if not taken.data.flags.owndata:
+            # a view on the capture buffer, the next capture of the other thread would overwrite it
+            taken.data = taken.data.copy()
+        # dark subtraction and hot pixel repair before the stars are extracted
+        calibration.apply_frame(taken)
+        return taken
+
+
+def live_capture():
+    # one exposure for the live solve loop, not archived as a still
+    return take_frame(nexus.get_short(), {"still": False})
+
+
+def show_live_solution(solution):
+    global elapsed_time
+    latency = "latency " + str(solution.latency)[0:4] + " s"
+    auto_expose(solution.frame, solution.verdict, solution.solved if solution.verdict.ok else None)
+    if not solution.solved:
+        handpad.display("Live: not solved", solution.reason, latency)
+        return
+    elapsed_time = solution.solve_time
+    set_solution(solution.wcs, solution.frame.binning, solution.frame)
+    arr[0, 2][2] = latency
+    handpad.display(arr[0, 2][0], arr[0, 2][1], latency)
+
+
+def toggle_live():
+    # long press on the home screen starts or stops the live solve loop
+    if live_solve.running:
+        live_solve.stop()
+        if param.get("Auto exposure", "0") == "1":
+            save_param()
+        print("Camera metrics:", camera.get_metrics())
+        handpad.display("Live solve", "stopped", str(live_solve.rate())[0:4] + " sol/s")
+    else:
+        live_solve.start()
+        handpad.display("Live solve", "started", "")
 
 
-def deltaCalc():
+def deltaCalc(exposed=None):
     global deltaAz, deltaAlt, solved_altaz, scopeAlt, elapsed_time
-    deltaAz, deltaAlt = common.deltaCalc(nexus.get_altAz(), solved_altaz, nexus.get_scope_alt(), deltaAz, deltaAlt)
+    deltaAz, deltaAlt = common.deltaCalc(mount_at(exposed)[1], solved_altaz, nexus.get_scope_alt(), deltaAz, deltaAlt)
     deltaXstr = "{: .2f}".format(float(deltaAz))
     deltaYstr = "{: .2f}".format(float(deltaAlt))
     arr[0, 3][0] = "Delta: x= " + deltaXstr
@@ -160,7 +283,8 @@ def measure_offset():
         return
     scope_x = star_name_offset[0]
     scope_y = star_name_offset[1]
-    d_x, d_y, dxstr, dystr = common.pixel2dxdy(scope_x, scope_y)
+    height, width = frame.data.shape[:2]
+    d_x, d_y, dxstr, dystr = common.pixel2dxdy(scope_x, scope_y, width, height, frame.binning)
     param["d_x"] = d_x
     param["d_y"] = d_y
     save_param()
@@ -201,28 +325,28 @@ def flip():
     time.sleep(0.1)
 
 
-def update_summary():
-    global param
+def show_summary():
     arr[1, 0][0] = "Ex:" + str(param["Exposure"]) + "  Gn:" + str(param["Gain"])
     arr[1, 0][1] = "Test mode:" + str(param["Test mode"])
+
+
+def update_summary():
+    global param
+    show_summary()
     save_param()
 
 
 def capture():
-    global param
+    global param, frame
     extras = {}
     if param["Test mode"] == "1":
         if offset_flag == False:
             extras['testimage'] = 'm13'
         else:
             extras['testimage'] = 'polaris'
-    radec = nexus.get_short()
-    camera.capture(
-        int(float(param["Exposure"]) * 1000000),
-        int(float(param["Gain"])),
-        radec,
-        extras
-    )
+    # the offset is measured on a full resolution frame
+    extras['full_resolution'] = offset_flag
+    frame = take_frame(nexus.get_short(), extras)
 
 
 def go_solve():
@@ -237,7 +361,7 @@ def go_solve():
     if solve == True:
         handpad.display("Solved", "", "")
     else:
-        handpad.display("Not Solved", "", "")
+        handpad.display("Not Solved", fail_reason, "")
         return
     x = 0
     y = 3
@@ -246,13 +370,12 @@ def go_solve():
 
 def goto():
     handpad.display("Attempting", "GoTo++", "")
-    goto_ra = nexus.get(":Gr#")
+    goto_ra, goto_dec = nexus.get_batch([":Gr#", ":Gd#"])
     if (
         goto_ra[0:2] == "00" and goto_ra[3:5] == "00"
     ):  # not a valid goto target set yet.
         print("no GoTo target")
         return
-    goto_dec = nexus.get(":Gd#")
     print("Target goto RA & Dec", goto_ra, goto_dec)
     align()
     if solve == False:
@@ -311,10 +434,30 @@ def reader():
 # time.sleep(1)
 handpad = Display.Handpad(version)
 coordinates = Coordinates.Coordinates()
-nexus = Nexus.Nexus(handpad, coordinates)
-nexus.read()
 param = dict()
 get_param()
+platesolve = PlateSolve(pix_scale, images_path, use_service=param.get("Solver service", "0") == "1")
+nexus = (
+    NexusSync(handpad, coordinates)
+    if param.get("Nexus async", "0") == "1"
+    else Nexus.Nexus(handpad, coordinates)
+)
+nexus.read()
+platesolve.race = param.get("Race solve", "0") == "1"
+atexit.register(platesolve.save_race_stats)
+platesolve.tracking = param.get("Track solve", "0") == "1"
+platesolve.triage.min_stars = int(param.get("Min stars", "5"))
+platesolve.scale_estimator.set_profile(param["Camera Type"])
+auto_exposure = AutoExposure(
+    cwd_path / "auto_exposure.json",
+    [float(e) for e in param["Exp_range"].split(",")],
+    [float(g) for g in param["Gain_range"].split(",")],
+    min_stars=platesolve.triage.min_stars,
+)
+poller = None
+if float(param.get("Nexus poll rate", "0")) > 0:
+    poller = NexusPoller(nexus, float(param["Nexus poll rate"]))
+    poller.start()
 
 handpad.display("ScopeDog eFinder", "Ready", "")
 # array determines what is displayed, computed and what each button does for each screen.
@@ -332,7 +475,7 @@ home = [
     "",
     "left_right(1)",
     "go_solve()",
-    "",
+    "toggle_live()",
 ]
 nex = [
     "Nex: RA ",
@@ -434,6 +577,17 @@ mode = [
     "go_solve()",
     "goto()",
 ]
+auto = [
+    "Auto exposure",
+    int(param.get("Auto exposure", "0")),
+    "",
+    "flip()",
+    "flip()",
+    "left_right(-1)",
+    "left_right(1)",
+    "go_solve()",
+    "goto()",
+]
 status = [
     "Nexus via " + nexus.get_nexus_link(),
     "Nex align " + str(nexus.is_aligned()),
@@ -449,7 +603,7 @@ status = [
 arr = np.array(
     [
         [home, nex, sol, delta, aligns, polar, reset],
-        [summary, exp, gn, mode, status, status, status],
+        [summary, exp, gn, mode, auto, status, status],
     ]
 )
 update_summary()
@@ -462,7 +616,22 @@ if nexus.is_aligned() == True:
     arr[0, 4][0] = "'Select' syncs"
 
 
-camera = common.pick_camera(param["Camera Type"], handpad, images_path)
+camera = common.pick_camera(param["Camera Type"], handpad, images_path, nexus)
+camera.set_binning(int(param.get("Binning", "1")))
+common.configure_stills(camera, param)
+if param.get("Live capture", "0") == "1":
+    # keep the camera streaming, a capture returns the newest frame at once
+    camera = LiveCapture(camera)
+live_solve = LiveSolvePipeline(
+    live_capture,
+    platesolve,
+    # the position the poller read during the exposure, else the last one read
+    radec_hint=lambda exposed: mount_at(exposed)[0] if param["Test mode"] != "1" else None,
+    # the pipeline thread only queues the solution, the main loop owns arr and the handpad
+    on_solution=lambda solution: put_latest(live_solutions, solution),
+)
+if param.get("Live solve", "0") == "1":
+    live_solve.start()
 
 handpad.display("ScopeDog eFinder", "v" + version, "")
 button = ""
@@ -473,17 +642,26 @@ scan.daemon = True
 scan.start()
 
 while True:  # next loop looks for button press and sets display option x,y
-    if button == "21":
-        exec(arr[x, y][7])
-    elif button == "20":
-        exec(arr[x, y][8])
-    elif button == "19":
-        exec(arr[x, y][4])
-    elif button == "17":
-        exec(arr[x, y][3])
-    elif button == "16":
-        exec(arr[x, y][5])
-    elif button == "18":
-        exec(arr[x, y][6])
+    try:
+        if button == "21":
+            exec(arr[x, y][7])
+        elif button == "20":
+            exec(arr[x, y][8])
+        elif button == "19":
+            exec(arr[x, y][4])
+        elif button == "17":
+            exec(arr[x, y][3])
+        elif button == "16":
+            exec(arr[x, y][5])
+        elif button == "18":
+            exec(arr[x, y][6])
+    except (TimeoutError, ConnectionError) as ex:
+        # the Nexus did not answer or its link failed, the next command reconnects
+        print("Nexus error:", ex)
+        handpad.display("Nexus error", "no reply" if isinstance(ex, TimeoutError) else "link failed", "")
     button = ""
+    try:
+        show_live_solution(live_solutions.get_nowait())
+    except queue.Empty:
+        pass
     time.sleep(0.1)
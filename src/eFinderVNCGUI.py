@@ -36,11 +36,18 @@ import fitsio
 from fitsio import FITS, FITSHDR
 import threading
 import Nexus
+from nexus_async import NexusSync
 import Coordinates
 import Display
 import logging
 import argparse
 from platesolve import PlateSolve
+from auto_exposure import AutoExposure
+from calibration import Calibration, build_darks
+from stacking import capture_stack
+from nexus_poller import NexusPoller
+from live_capture import LiveCapture
+from pipeline import LiveSolvePipeline
 from common import Common
 import utils
 
@@ -79,6 +86,15 @@ global solved_radec
 solved_radec = 0, 0
 usb = False
 pix_scale = 15
+solve_timeout = 30  # seconds, a solve taking longer is cancelled
+frame = None  # the last captured CameraFrame
+live_solve = None  # the LiveSolvePipeline while live solving
+live_shown = None  # the live solution on screen
+live_settings = {}  # the exposure (seconds) and gain of the live solve captures
+calibration = Calibration(cwd_path / "calibration")
+stackers = {}  # the FrameStackers by frame size, their buffers are reused
+camera_lock = threading.Lock()  # the live solve thread and the buttons take turns on the camera
+poller = None  # the NexusPoller when the Nexus is read in the background
 
 # GUI specific
 def setup_sidereal():
@@ -120,9 +136,19 @@ def sidereal():
     lbl_LST.after(1000, sidereal)
 
 
+def nexus_error(ex):
+    """Reports a Nexus that did not answer or a link that failed, the next command reconnects"""
+    logging.error(f"Nexus error: {ex}")
+    box_write("Nexus error: " + ("no reply" if isinstance(ex, TimeoutError) else "link failed"), True)
+
+
 def readNexus():
     """Read the AltAz from the Nexus DSC and put the correct numbers on the GUI."""
-    nexus.read_altAz(None)
+    try:
+        nexus.read_altAz(None)
+    except (TimeoutError, ConnectionError) as ex:
+        nexus_error(ex)
+        return
     nexus_radec = nexus.get_radec()
     nexus_altaz = nexus.get_altAz()
     tk.Label(
@@ -159,10 +185,11 @@ def readNexus():
     ).place(x=225, y=892)
 
 
-def capture():
-    global polaris, m31, radec, gain, exposure, platesolve, camera, camera_debug
+def capture(full_resolution=False):
+    global polaris, m31, radec, gain, exposure, platesolve, camera, camera_debug, frame
     use_camera = camera
-    extras = {}
+    # binned frames are enough to solve, the offset measurement and the zoomed display need every pixel
+    extras = {"full_resolution": full_resolution or zoom.get() == "1"}
     if polaris.get() == "1":
         extras["testimage"] = "polaris"
         use_camera = camera_debug
@@ -170,29 +197,77 @@ def capture():
         extras["testimage"] = "m31"
         use_camera = camera_debug
     radec = nexus.get_short()
-    use_camera.capture(
-        int(1000000 * float(exposure.get())), int(float(gain.get())), radec, extras
-    )
+    frame = take_frame(use_camera, int(1000000 * float(exposure.get())), int(float(gain.get())), radec, extras)
     image_show()
 
 
-def solveImage(is_offset=False):
+def darks():
+    """Builds the master dark for the current exposure and gain, the lens must be covered"""
+    box_write("cover the lens", True)
+    box_write("taking darks", True)
+    window.update()
+    try:
+        with camera_lock:
+            key = build_darks(calibration, camera, int(1000000 * float(exposure.get())), int(float(gain.get())))
+        box_write(f"{calibration.index[key]['hot_pixels']} hot pixels", True)
+    except Exception as ex:
+        logging.error(f"Building the darks failed: {ex}")
+        box_write("darks failed", True)
+
+
+def solveImage(is_offset=False, priority=0):
+    """Solves the captured image, returns False when a newer solve preempted this one"""
     global scopeAlt, solved_altaz, star_name, star_name_offset, solved, solved_radec
-    result, elapsed_time = platesolve.solve_image(is_offset)
+    if frame is None:
+        # the camera delivered no frame, there is nothing to solve
+        box_write("no frame", True)
+        handpad.display("Not Solved", "no frame", "")
+        solve_image_failed(b_g, f_g, "no frame", window)
+        solved = False
+        return True
+    image = frame.data
+    verdict = platesolve.triage_frame(image, frame.binning)
+    if not verdict.ok:
+        logging.info(f"Frame rejected: {verdict}")
+        auto_expose(frame, verdict)
+        box_write("Rejected: " + verdict.reason, True)
+        handpad.display("Not Solved", verdict.reason, "")
+        solve_image_failed(b_g, f_g, verdict.reason, window)
+        solved = False
+        return True
+    # the test images are not taken where the scope points and an unaligned Nexus reports a
+    # position that can be far off, solve those blind
+    test_image = polaris.get() == "1" or m31.get() == "1"
+    radec_hint = mount_at(frame)[0] if not test_image and nexus.is_aligned() else None
+    job = platesolve.submit(is_offset, radec_hint, image, priority, solve_timeout, binning=frame.binning)
+    # keep the GUI responsive while solving, a button pressed meanwhile preempts this solve
+    while not job.wait(0.05):
+        window.update()
+    if job.state == "cancelled":
+        box_write("solve preempted", False)
+        return False
+    if job.state != "done":
+        box_write("solve " + job.state, True)
+        solve_image_failed(b_g, f_g, job.state, window)
+        solved = False
+        return True
+    result, elapsed_time = job.result, job.elapsed
     elapsed_time_str = f"elapsed time {elapsed_time:.2f} sec"
 
     tk.Label(window, text=elapsed_time_str, width=20, anchor="e", bg=b_g, fg=f_g).place(
         x=315, y=936
     )
     result = str(result.stdout)
+    auto_expose(frame, verdict, "solved" in result)
     if "solved" not in result:
         solve_image_failed(b_g, f_g, elapsed_time, window)
         solved = False
-        return
+        return True
     if is_offset:
-        table, h = fitsio.read(images_path / "capture.axy", header=True)
-        star_name_offset = table[0][0], table[0][1]
-        logging.debug(f"(capture.axy gives) x,y {table[0][0]} {table[0][1]}")
+        # the stars of this solve, platesolve.stars may already belong to a live solve
+        brightest = job.stars[0]
+        star_name_offset = brightest["X"], brightest["Y"]
+        logging.debug(f"(brightest star) x,y {brightest['X']} {brightest['Y']}")
         if "The star" in result:
             lines = result.split("\n")
             for line in lines:
@@ -206,7 +281,8 @@ def solveImage(is_offset=False):
             box_write(" no named star", True)
             logging.info("No Named Star found")
             star_name = "Unknown"
-    solvedPos = common.applyOffset(nexus, offset)
+    # the solution parsed by the job, capture.wcs may already hold a newer live solve
+    solvedPos = common.applyOffset(nexus, offset, job.wcs, frame.binning)
     ra, dec, d = solvedPos.apparent().radec(ts.now())
     solved_radec = ra.hours, dec.degrees
     solved_altaz = coordinates.conv_altaz(nexus, *(solved_radec))
@@ -214,8 +290,93 @@ def solveImage(is_offset=False):
     solveImageGui(solved_radec, solved_altaz)
     solved = True
     box_write("solved", True)
-    deltaCalcGUI()
+    deltaCalcGUI(frame)
     readTarget()
+    return True
+
+
+def auto_expose(exposed, verdict, solved=None):
+    """In auto exposure mode the outcome of the frame sets the exposure and gain of the next one"""
+    if auto_exp.get() != "1":
+        return
+    next_exposure, next_gain = auto_exposure.observe(verdict, exposed.exposure, exposed.gain, solved)
+    exposure.set(next_exposure)
+    gain.set(next_gain)
+    live_settings["exposure"], live_settings["gain"] = next_exposure, next_gain
+
+
+def take_frame(use_camera, exposure_time, gain_value, radec, extras):
+    """Captures a calibrated frame, or the stack of "Stack frames" short frames to reach fainter stars"""
+    count = int(param.get("Stack frames", "1"))
+    with camera_lock:
+        if count > 1 and not extras.get("full_resolution"):
+            return capture_stack(use_camera, exposure_time, gain_value, radec, extras, count, stackers, calibration.apply_frame)
+        captured = use_camera.capture_array(exposure_time, gain_value, radec, extras)
+        if captured is None:
+            return None
+        if not captured.data.flags.owndata:
+            # a view on the capture buffer, the next capture of the other thread would overwrite it
+            captured.data = captured.data.copy()
+        # dark subtraction and hot pixel repair before the stars are extracted
+        calibration.apply_frame(captured)
+        return captured
+
+
+def toggle_live():
+    """Starts or stops the live solve loop, the settings are taken when it starts and
+    changed by auto exposure"""
+    global live_solve
+    if live.get() == "1":
+        live_settings["exposure"], live_settings["gain"] = float(exposure.get()), float(gain.get())
+        use_camera, extras, test_image = camera, {"still": False}, False
+        if polaris.get() == "1" or m31.get() == "1":
+            use_camera, test_image = camera_debug, True
+            extras["testimage"] = "polaris" if polaris.get() == "1" else "m31"
+        live_solve = LiveSolvePipeline(
+            lambda: take_frame(
+                use_camera, int(1000000 * live_settings["exposure"]), int(live_settings["gain"]), nexus.get_short(), extras
+            ),
+            platesolve,
+            radec_hint=None if test_image else lambda exposed: mount_at(exposed)[0],
+            solve_timeout=solve_timeout,
+        )
+        live_solve.start()
+        box_write("live solve started", True)
+        window.after(250, show_live)
+    elif live_solve is not None:
+        live_solve.stop()
+        box_write("live solve " + f"{live_solve.rate():.2f}" + "/s", True)
+        if auto_exp.get() == "1":
+            # keep the exposure and gain auto exposure settled on
+            save_param()
+
+
+def show_live():
+    """Shows the newest live solution, runs on the Tk thread every 250 ms while live solving"""
+    global frame, live_shown, scopeAlt, solved_altaz, solved, solved_radec
+    if live_solve is None or not live_solve.running:
+        return
+    solution = live_solve.latest
+    if solution is not None and solution is not live_shown:
+        live_shown = solution
+        frame = solution.frame
+        auto_expose(frame, solution.verdict, solution.solved if solution.verdict.ok else None)
+        image_show()
+        tk.Label(
+            window, text=f"latency {solution.latency:.2f} sec", width=20, anchor="e", bg=b_g, fg=f_g
+        ).place(x=315, y=936)
+        if solution.solved:
+            solvedPos = common.applyOffset(nexus, offset, solution.wcs, solution.frame.binning)
+            ra, dec, d = solvedPos.apparent().radec(ts.now())
+            solved_radec = ra.hours, dec.degrees
+            solved_altaz = coordinates.conv_altaz(nexus, *(solved_radec))
+            scopeAlt = solved_altaz[0] * math.pi / 180
+            solveImageGui(solved_radec, solved_altaz)
+            solved = True
+            deltaCalcGUI(frame)
+        else:
+            box_write("live: " + solution.reason, False)
+    window.after(250, show_live)
 
 
 def solve_image_failed(b_g, f_g, elapsed_time, window):
@@ -272,7 +433,9 @@ def solveImageGui(solved_radec, solved_altaz):
 
 def image_show():
     global manual_angle, img3, EPlength, scopeAlt
-    img2 = Image.open(images_path / "capture.jpg")
+    if frame is None:
+        return
+    img2 = frame.to_image()
     width, height = img2.size
     img2 = img2.resize((1014, 760), Resampling.LANCZOS)  # original is 1280 x 960
     width, height = img2.size
@@ -428,10 +591,20 @@ def zoom_at(img, x, y, zoom):
     return img.resize((w, h), Image.LANCZOS)
 
 
-def deltaCalcGUI():
+def mount_at(exposed):
+    """Returns the Nexus position (radec, altaz) halfway the exposure when the poller runs, else the last one read"""
+    snapshot = None
+    if poller is not None and exposed is not None:
+        snapshot = poller.snapshot_at(exposed.timestamp + exposed.exposure / 2)
+    if snapshot is None:
+        return nexus.get_radec(), nexus.get_altAz()
+    return snapshot.radec, snapshot.altaz
+
+
+def deltaCalcGUI(exposed=None):
     global deltaAz, deltaAlt, solved_altaz
     deltaAz, deltaAlt = common.deltaCalc(
-        nexus.get_altAz(), solved_altaz, nexus.get_scope_alt(), deltaAz, deltaAlt
+        mount_at(exposed)[1], solved_altaz, nexus.get_scope_alt(), deltaAz, deltaAlt
     )
     deltaAzstr = "{: .1f}".format(float(deltaAz)).ljust(8)[:8]
     deltaAltstr = "{: .1f}".format(float(deltaAlt)).ljust(8)[:8]
@@ -481,7 +654,8 @@ def align():  # sends the Nexus the solved RA & Dec (JNow) as an align or sync p
     global align_count, p, solved_radec
     # readNexus()
     capture()
-    solveImage()
+    if not solveImage(priority=1):
+        return False
     readNexus()
     if solved == False:
         return
@@ -527,9 +701,10 @@ def measure_offset():
     logging.debug("Starting measure_offset for {star_name=}")
     readNexus()
     logging.debug("Read nexus")
-    capture()
+    capture(full_resolution=True)
     logging.debug("Did capture")
-    solveImage(is_offset=True)
+    if not solveImage(is_offset=True, priority=1):
+        return
     logging.debug("Solved image")
     if solved == False:
         box_write("solve failed", True)
@@ -545,7 +720,8 @@ def measure_offset():
             x=115, y=470
         )
     box_write(star_name, True)
-    d_x, d_y, dxstr_new, dystr_new = common.pixel2dxdy(scope_x, scope_y)
+    height, width = frame.data.shape[:2]
+    d_x, d_y, dxstr_new, dystr_new = common.pixel2dxdy(scope_x, scope_y, width, height, frame.binning)
     logging.debug(
         f"Measured star with star name = {star_name} and {dxstr_new=} and {dystr_new}"
     )
@@ -620,14 +796,17 @@ def read_nexus_and_capture():
 def solve():
     readNexus()
     handpad.display("Solving image", "", "")
-    solveImage()
-    image_show()
+    if solveImage():
+        image_show()
 
 
 def readTarget():
     global goto_radec, goto_altaz, goto_ra, goto_dec, solved_altaz
-    goto_ra = nexus.get(":Gr#")
-    goto_dec = nexus.get(":Gd#")
+    try:
+        goto_ra, goto_dec = nexus.get_batch([":Gr#", ":Gd#"])
+    except (TimeoutError, ConnectionError) as ex:
+        nexus_error(ex)
+        return False
     if (
         goto_ra[0:2] == "00" and goto_ra[3:5] == "00"
     ):  # not a valid goto target set yet.
@@ -697,27 +876,35 @@ def readTarget():
 
 def goto():
     global goto_ra, goto_dec
-    readTarget()
-    align()  # local sync scope to true RA & Dec
-    if solved == False:
-        box_write("solve failed", True)
+    if readTarget() is False:
+        return
+    try:
+        if align() is False:  # local sync scope to true RA & Dec, False if preempted
+            return
+        if solved == False:
+            box_write("solve failed", True)
+            return
+        nexus.write(":Sr" + goto_ra + "#")
+        nexus.write(":Sd" + goto_dec + "#")
+        reply = nexus.get(":MS#")
+    except (TimeoutError, ConnectionError) as ex:
+        nexus_error(ex)
         return
-    nexus.write(":Sr" + goto_ra + "#")
-    nexus.write(":Sd" + goto_dec + "#")
-    reply = nexus.get(":MS#")
     time.sleep(0.1)
     box_write("moving scope", True)
 
 
 def move():
     global solved_altaz
-    solveImage()
+    if not solveImage():
+        return
     image_show()
     if solved == False:
         box_write("no solution yet", True)
         return
-    goto_ra = nexus.get(":Gr#").split(":")
-    goto_dec = re.split(r"[:*]", nexus.get(":Gd#"))
+    goto_ra, goto_dec = nexus.get_batch([":Gr#", ":Gd#"])
+    goto_ra = goto_ra.split(":")
+    goto_dec = re.split(r"[:*]", goto_dec)
     # not a valid goto target set yet.
     if goto_ra[0] == "00" and goto_ra[1] == "00":
         box_write("no GoTo target", True)
@@ -741,6 +928,11 @@ def move():
 
 def on_closing():
     save_param()
+    platesolve.save_race_stats()
+    logging.info(f"Camera metrics: {camera.get_metrics()}")
+    if poller is not None:
+        poller.stop()
+    nexus.close()
     handpad.display("Program closed", "via VNCGUI", "")
     sys.exit()
 
@@ -785,6 +977,7 @@ def save_param():
     global param, exposure, polaris, m31
     param["Exposure"] = exposure.get()
     param["Gain"] = gain.get()
+    param["Auto exposure"] = auto_exp.get()
     param["Test mode"] = polaris.get() or m31.get()
     with open(cwd_path / "eFinder.config", "w") as h:
         for key, value in param.items():
@@ -824,30 +1017,49 @@ def do_button(event):
 
 def main(realHandpad, realNexus, fakeCamera):
     # main code starts here
-    global nexus, ts, param, window, earth, test, handpad, coordinates, camera, camera_debug, polaris, m31, exposure, panel, zoom, rotate, auto_rotate, manual_rotate, gain, grat, EP, lock, flip, mirror, angle, go_to, pix_scale, platesolve, common, bright, hip, hd, abell, tycho2, ngc, version
+    global nexus, poller, ts, param, window, earth, test, handpad, coordinates, camera, camera_debug, polaris, m31, live, auto_exp, auto_exposure, exposure, panel, zoom, rotate, auto_rotate, manual_rotate, gain, grat, EP, lock, flip, mirror, angle, go_to, pix_scale, platesolve, common, bright, hip, hd, abell, tycho2, ngc, version
     common = Common(cwd_path, images_path, pix_scale, "_VNC")
     version = common.get_version()
     logging.info(f"Starting eFinder version {version}...")
     handpad = Display.Handpad(version) if realHandpad else HandpadDebug()
     coordinates = Coordinates.Coordinates()
-    nexus = (
-        Nexus.Nexus(handpad, coordinates)
-        if realNexus
-        else NexusDebug(handpad, coordinates)
-    )
-    platesolve = PlateSolve(pix_scale, images_path)
-    NexStr = nexus.get_nex_str()
     param = dict()
     get_param(cwd_path / "eFinder.config")
+    if not realNexus:
+        nexus = NexusDebug(handpad, coordinates)
+    elif param.get("Nexus async", "0") == "1":
+        nexus = NexusSync(handpad, coordinates)
+    else:
+        nexus = Nexus.Nexus(handpad, coordinates)
+    platesolve = PlateSolve(pix_scale, images_path, use_service=param.get("Solver service", "0") == "1")
+    NexStr = nexus.get_nex_str()
     logging.debug(f"{param=}")
+    platesolve.race = param.get("Race solve", "0") == "1"
+    platesolve.tracking = param.get("Track solve", "0") == "1"
+    platesolve.triage.min_stars = int(param.get("Min stars", "5"))
+    platesolve.scale_estimator.set_profile(param["Camera Type"])
+    auto_exposure = AutoExposure(
+        cwd_path / "auto_exposure.json",
+        [float(e) for e in expRange],
+        [float(g) for g in gainRange],
+        min_stars=platesolve.triage.min_stars,
+    )
 
     planets = load("de421.bsp")
     earth = planets["earth"]
     ts = load.timescale()
     nexus.read()
+    if float(param.get("Nexus poll rate", "0")) > 0:
+        poller = NexusPoller(nexus, float(param["Nexus poll rate"]))
+        poller.start()
     camera_type = param["Camera Type"] if not fakeCamera else "TEST"
     camera_debug = common.pick_camera("TEST", handpad, images_path)
-    camera = common.pick_camera(camera_type, handpad, images_path)
+    camera = common.pick_camera(camera_type, handpad, images_path, nexus)
+    camera.set_binning(int(param.get("Binning", "1")))
+    common.configure_stills(camera, param)
+    if param.get("Live capture", "0") == "1":
+        # keep the camera streaming, a capture returns the newest frame at once
+        camera = LiveCapture(camera)
 
     logging.debug(f"The chosen camera is {camera} with {dir(camera)=}")
     handpad.display(
@@ -957,6 +1169,33 @@ def main(realHandpad, realNexus, fakeCamera):
         fg=f_g,
         variable=m31,
     ).pack(padx=1, pady=1)
+    live = StringVar()
+    live.set("0")
+    tk.Checkbutton(
+        options_frame,
+        text="Live solve",
+        width=13,
+        anchor="w",
+        highlightbackground="black",
+        activebackground="red",
+        bg=b_g,
+        fg=f_g,
+        variable=live,
+        command=toggle_live,
+    ).pack(padx=1, pady=1)
+    auto_exp = StringVar()
+    auto_exp.set(param.get("Auto exposure", "0"))
+    tk.Checkbutton(
+        options_frame,
+        text="Auto exposure",
+        width=13,
+        anchor="w",
+        highlightbackground="black",
+        activebackground="red",
+        bg=b_g,
+        fg=f_g,
+        variable=auto_exp,
+    ).pack(padx=1, pady=1)
 
     box_write("ccd is " + camera.get_cam_type(), False)
     box_write("Nexus " + NexStr, True)
@@ -1086,6 +1325,18 @@ def main(realHandpad, realNexus, fakeCamera):
         width=8,
         command=reset_offset,
     ).pack(padx=1, pady=1)
+    tk.Button(
+        off_frame,
+        text="Build Darks",
+        activebackground="red",
+        highlightbackground="red",
+        bd=0,
+        bg=b_g,
+        fg=f_g,
+        height=1,
+        width=8,
+        command=darks,
+    ).pack(padx=1, pady=1)
     d_x, d_y, dxstr, dystr = common.pixel2dxdy(offset[0], offset[1])
 
     tk.Label(window, text="Offset:", bg=b_g, fg=f_g).place(x=10, y=400)
@@ -0,0 +1,135 @@
+import logging
+import time
+from typing import Optional
+import numpy as np
+from star_extractor import StarExtractor
+
+
+class TriageResult:
+    """The verdict on a frame, with the measurements it is based on"""
+
+    def __init__(
+        self, reason: str, star_count: int, background: float, saturation: float, fwhm: float, full_scale: float = 255.0
+    ) -> None:
+        """Initializes the verdict
+
+        Parameters:
+        reason (str): Why the frame can not be solved, empty if it looks solvable
+        star_count (int): The number of stars found
+        background (float): The median level of the frame
+        saturation (float): The fraction of saturated pixels
+        fwhm (float): The median FWHM of the brightest stars in pixels, 0 if not measured
+        full_scale (float): The saturation level of the frame"""
+        self.ok = reason == ""
+        self.reason = reason
+        self.star_count = star_count
+        self.background = background
+        self.saturation = saturation
+        self.fwhm = fwhm
+        self.full_scale = full_scale
+
+    def __str__(self) -> str:
+        verdict = "ok" if self.ok else self.reason
+        return (
+            f"{verdict}: {self.star_count} stars, background {self.background:.1f}, "
+            f"saturated {100 * self.saturation:.2f}%, fwhm {self.fwhm:.1f} px"
+        )
+
+
+class FrameTriage:
+    """Fast checks on a captured frame to reject the ones solve-field can not solve"""
+
+    def __init__(
+        self,
+        min_stars: int = 5,
+        max_saturation: float = 0.02,
+        max_background: float = 0.8,
+        max_fwhm: float = 10.0,
+        downsample: int = 4,
+    ) -> None:
+        """Initializes the checks
+
+        Parameters:
+        min_stars (int): Frames with fewer stars are rejected
+        max_saturation (float): Frames with a larger fraction of saturated pixels are rejected
+        max_background (float): Frames with a background above this fraction of full scale are rejected
+        max_fwhm (float): Frames with wider stars (pixels) are rejected as out of focus
+        downsample (int): The star count is taken on the frame binned by this factor, including the
+            binning on the sensor"""
+        self.min_stars = min_stars
+        self.max_saturation = max_saturation
+        self.max_background = max_background
+        self.max_fwhm = max_fwhm
+        # a coarse extraction is plenty to count the stars
+        self.downsample = downsample
+        self.extractor = StarExtractor(downsample=downsample, tile=16)
+
+    def assess(self, image: np.ndarray, binning: int = 1, full_scale: Optional[float] = None) -> TriageResult:
+        """Measures the frame and decides if it is worth solving
+
+        Parameters:
+        image (np.ndarray): The frame
+        binning (int): The binning on the sensor, a binned frame is binned less again to keep its faint stars
+        full_scale (float): The saturation level of the frame, by default the largest value of an
+            integer frame and 1.0 for a float frame, which is taken as normalised
+
+        Returns:
+        TriageResult: The verdict"""
+        start_time = time.time()
+        if full_scale is None:
+            # from the dtype of the frame, a colour frame is averaged to floats below
+            full_scale = float(np.iinfo(image.dtype).max) if image.dtype.kind in "ui" else 1.0
+        if image.ndim == 3:
+            image = image.mean(axis=2)
+        sample = image[::2, ::2]
+        background = float(np.median(sample))
+        saturation = float(np.count_nonzero(sample >= full_scale)) / sample.size
+        stars = self.extractor.extract(image, downsample=max(1, self.downsample // binning))
+        fwhm = self.fwhm(image, stars, full_scale)
+
+        reason = ""
+        if saturation > self.max_saturation:
+            reason = "saturated"
+        elif background > self.max_background * full_scale:
+            reason = "overexposed"
+        elif len(stars) < self.min_stars:
+            reason = "too few stars"
+        elif fwhm > self.max_fwhm:
+            reason = "out of focus"
+        result = TriageResult(reason, len(stars), background, saturation, fwhm, full_scale)
+        logging.info(f"Frame triage {result} in {time.time() - start_time:.3f} s")
+        return result
+
+    @staticmethod
+    def fwhm(image: np.ndarray, stars: np.ndarray, full_scale: float, count: int = 10, radius: int = 10) -> float:
+        """Estimates the FWHM from the area above half maximum of the brightest unsaturated stars
+
+        Parameters:
+        image (np.ndarray): The frame
+        stars (np.ndarray): The stars found in the frame
+        full_scale (float): The saturation level of the frame
+        count (int): The number of stars to measure
+        radius (int): Half the size of the box around each star
+
+        Returns:
+        float: The median FWHM in pixels, 0 when no star could be measured"""
+        h, w = image.shape
+        # FITS coordinates back to array indices, stars too close to the edge are skipped
+        x = np.rint(stars["X"] - 1).astype(np.int64)
+        y = np.rint(stars["Y"] - 1).astype(np.int64)
+        inside = (x >= radius) & (x < w - radius) & (y >= radius) & (y < h - radius)
+        x, y = x[inside][: 3 * count], y[inside][: 3 * count]
+        if len(x) == 0:
+            return 0.0
+        offsets = np.arange(-radius, radius + 1)
+        stamps = image[
+            y[:, None, None] + offsets[None, :, None], x[:, None, None] + offsets[None, None, :]
+        ].astype(np.float64)
+        stamps = stamps[stamps.max(axis=(1, 2)) < full_scale][:count]
+        if len(stamps) == 0:
+            return 0.0
+        stamps -= np.median(stamps, axis=(1, 2), keepdims=True)
+        # the area above half the peak of a round star is pi * (FWHM / 2) ** 2
+        half_maximum = stamps.max(axis=(1, 2), keepdims=True) / 2
+        area = np.count_nonzero(stamps >= half_maximum, axis=(1, 2))
+        return float(np.median(2 * np.sqrt(area / np.pi)))
@@ -0,0 +1,178 @@
+from typing import Dict, Optional, Tuple
+import logging
+import threading
+import time
+import numpy as np
+from CameraInterface import CameraInterface, CameraFrame
+
+
+class LiveCapture(CameraInterface):
+    """Keeps a camera streaming in a background thread. The frames go into a ring of preallocated
+    buffers, so capture_array returns the newest complete frame without waiting for an exposure.
+
+    The reader and the writer share no lock: the writer fills the slot after the newest one and
+    only then publishes it by replacing self.latest, a single assignment. A reader gets a copy of
+    the newest slot, the writer needs slots - 1 more frames before it gets back to that slot."""
+
+    def __init__(self, camera: CameraInterface, slots: int = 4) -> None:
+        """Initializes the live capture, streaming starts on the first capture or with start
+
+        Parameters:
+        camera (CameraInterface): The camera to stream from
+        slots (int): The number of frame buffers in the ring"""
+        self.camera = camera
+        self.slot_count = slots
+        self.buffers = []
+        self.frames = []
+        # (slot, timestamp, sequence number) of the newest complete frame
+        self.latest: Optional[Tuple[int, float, int]] = None
+        self.exposure_time = None
+        self.gain = None
+        self.running = False
+        self.thread = None
+        self.frames_read = 0
+        self.frames_missed = 0
+
+    def start(self, exposure_time: float, gain: float) -> None:
+        """Starts streaming with the given settings
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain"""
+        self.stop()
+        self.camera.start_live(exposure_time, gain)
+        self.exposure_time, self.gain = exposure_time, gain
+        shape, dtype = self.camera.live_frame_shape()
+        size = int(np.prod(shape)) * dtype.itemsize
+        if not self.frames or self.frames[0].shape != tuple(shape) or self.frames[0].dtype != dtype:
+            self.buffers = [bytearray(size) for _ in range(self.slot_count)]
+            self.frames = [np.frombuffer(buffer, dtype=dtype).reshape(shape) for buffer in self.buffers]
+        self.latest = None
+        self.running = True
+        self.thread = threading.Thread(target=self._stream)
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info(f"Live capture started, exposure {exposure_time / 1000000} s, gain {gain}")
+
+    def stop(self) -> None:
+        """Stops streaming"""
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join()
+        self.camera.stop_live()
+        logging.info(f"Live capture stopped, {self.frames_read} frames read, {self.frames_missed} missed")
+
+    def _stream(self) -> None:
+        exposure = self.exposure_time / 1000000
+        sequence = 0
+        while self.running:
+            latest = self.latest
+            slot = 0 if latest is None else (latest[0] + 1) % self.slot_count
+            if self.camera.read_live_frame(self.buffers[slot], 2 * exposure + 1):
+                sequence += 1
+                self.frames_read += 1
+                # the frame is complete, publish it
+                self.latest = (slot, time.time() - exposure, sequence)
+            else:
+                self.frames_missed += 1
+
+    def latest_frame(self, newer_than: float = 0.0, timeout: float = 0.0) -> Optional[Tuple[np.ndarray, float, int]]:
+        """Returns a view on the newest frame, valid until the writer comes back to its slot
+
+        Parameters:
+        newer_than (float): Only accept a frame whose exposure started after this time.time()
+        timeout (float): Seconds to wait for such a frame
+
+        Returns:
+        Tuple[np.ndarray, float, int]: The frame, the start of its exposure and its sequence number,
+            None if there is no such frame"""
+        deadline = time.time() + timeout
+        while True:
+            latest = self.latest
+            if latest is not None and latest[1] > newer_than:
+                slot, timestamp, sequence = latest
+                return self.frames[slot], timestamp, sequence
+            if time.time() >= deadline or not self.running:
+                return None
+            time.sleep(0.005)
+
+    def capture(self, exposure_time: float, gain: float, radec: str, extras: Dict) -> None:
+        """Writes the newest frame to capture.jpg
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str): The Ra and Dec"""
+        frame = self.capture_array(exposure_time, gain, radec, extras)
+        if frame is not None:
+            frame.save(self.camera.images_path / "capture.jpg")
+
+    def capture_array(self, exposure_time: float, gain: float, radec: str, extras: Dict) -> CameraFrame:
+        """Returns (a copy of) the newest streamed frame. Streaming is (re)started when the
+        settings change, only then the call waits for an exposure.
+
+        Parameters:
+        exposure_time (float): The exposure time in microseconds
+        gain (float): The gain
+        radec (str): The Ra and Dec, used to name the stills
+        extras (Dict): "fresh": True to wait for a frame exposed after this call,
+            "still": False to not archive the frame in the stills,
+            "full_resolution": True for a single unbinned exposure instead of a streamed frame
+
+        Returns:
+        CameraFrame: The frame, None if the camera delivers no frames"""
+        if extras.get("full_resolution") and getattr(self.camera, "binning", 1) != 1:
+            # a single unbinned exposure, streaming restarts binned on the next capture
+            self.stop()
+            return self.camera.capture_array(exposure_time, gain, radec, extras)
+        if not self.running or exposure_time != self.exposure_time or gain != self.gain:
+            self.start(exposure_time, gain)
+        exposure = exposure_time / 1000000
+        newer_than = time.time() if extras.get("fresh") else 0.0
+        latest = self.latest_frame(newer_than, 2 * exposure + 2)
+        if latest is None:
+            logging.warning("Live capture: no frame received")
+            return None
+        data, timestamp, sequence = latest
+        height, width = data.shape
+        binning = getattr(self.camera, "binning", 1)
+        frame = CameraFrame(
+            data.copy(), exposure, gain, timestamp,
+            getattr(self.camera, "sensor_size", (width * binning, height * binning)),
+            {
+                "radec": radec, "camera": self.camera.get_cam_type(), "sequence": sequence, "live": True,
+                "temperature": self.camera.get_temperature(),
+            },
+            binning,
+        )
+        archiver = getattr(self.camera, "archiver", None)
+        if archiver is not None and extras.get("still", True):
+            archiver.submit(frame, f"{time.strftime('%Y%m%d-%H%M%S')}_{radec}")
+        return frame
+
+    def set_binning(self, bins: int) -> None:
+        """Sets the binning of the streamed frames, streaming restarts on the next capture
+
+        Parameters:
+        bins (int): The binning factor, 1 for full resolution"""
+        self.stop()
+        self.camera.set_binning(bins)
+
+    def get_temperature(self) -> Optional[float]:
+        """Returns the sensor temperature of the streaming camera"""
+        return self.camera.get_temperature()
+
+    def get_metrics(self) -> Dict:
+        """Returns the metrics of the streaming camera plus the frames read and missed by the stream"""
+        metrics = self.camera.get_metrics() or {"counters": {}, "phases": {}, "last": {}}
+        metrics["counters"]["stream_read"] = self.frames_read
+        metrics["counters"]["stream_missed"] = self.frames_missed
+        return metrics
+
+    def get_cam_type(self) -> str:
+        """Return the type of the streaming camera
+
+        Returns:
+        str: The type of the camera"""
+        return self.camera.get_cam_type()
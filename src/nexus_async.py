@@ -0,0 +1,351 @@
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import concurrent.futures
+import logging
+import socket
+import threading
+import serial
+import Coordinates
+import Display
+from Nexus import Nexus
+from nexus_connection import COMMAND_TIMEOUTS, DEFAULT_TIMEOUT, REPLY_NONE, reply_kind, reply_length
+
+# The LX200 protocol has no request ids, the Nexus answers the commands in the order they came. The
+# client sends one request (a single command or a batch written in one burst) at a time from a
+# bounded queue, so the replies are matched to their request first in, first out; a caller that
+# finds the queue full waits for room. A request that times out closes the link, a late reply can
+# then not be taken for the reply of the next request.
+
+
+class AsyncNexusClient:
+    """An asyncio client for the Nexus DSC on the serial port or on its WiFi access point
+
+    Only the part of the NexusInterface that needs no observer location is here: the LX200 commands
+    (get, get_batch, write, close), the position (get_radec), the alignment (is_aligned) and the
+    GoTo and sync commands. read, read_altAz, poll, get_altAz and set_poller convert to altitude
+    and azimuth and keep the state of the mount, NexusSync provides them on top of this client."""
+
+    def __init__(self, queue_size: int = 8) -> None:
+        """Initializes the client, open_serial or open_tcp connects it
+
+        Parameters:
+        queue_size (int): Requests waiting to be sent, callers wait when it is full"""
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.opener: Optional[Callable] = None
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.send: Optional[Callable] = None
+        self.closer: Optional[Callable] = None
+        self.buffer = bytearray()
+        self.name = "none"
+        self.stats = {"requests": 0, "connects": 0, "failures": 0, "timeouts": 0}
+
+    async def open_tcp(self, host: str = "10.0.0.1", port: int = 4060, timeout: float = 2.0) -> None:
+        """Connects to the Nexus over WiFi, raises OSError when it can not be reached
+
+        Parameters:
+        host (str): The address of the Nexus
+        port (int): The LX200 port of the Nexus
+        timeout (float): Seconds to wait for the connection"""
+
+        async def opener():
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"no connection to {host}:{port}")
+            link = writer.get_extra_info("socket")
+            link.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            link.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+            async def send(data: bytes) -> None:
+                writer.write(data)
+                await writer.drain()
+
+            return reader, send, writer.close
+
+        self.name = "Wifi"
+        await self._open(opener)
+
+    async def open_serial(self, port: str = "/dev/ttyS0", baudrate: int = 9600) -> None:
+        """Connects to the Nexus on the serial port, raises OSError when the port can not be opened
+
+        Parameters:
+        port (str): The serial device
+        baudrate (int): The baud rate of the Nexus"""
+
+        async def opener():
+            loop = asyncio.get_running_loop()
+            link = serial.Serial(port, baudrate=baudrate, timeout=0)
+            reader = asyncio.StreamReader()
+
+            def readable() -> None:
+                # called by the event loop when the port has bytes
+                reader.feed_data(link.read(max(1, link.in_waiting)))
+
+            loop.add_reader(link.fileno(), readable)
+
+            async def send(data: bytes) -> None:
+                link.write(data)
+
+            def close() -> None:
+                loop.remove_reader(link.fileno())
+                link.close()
+
+            return reader, send, close
+
+        self.name = "USB"
+        await self._open(opener)
+
+    async def _open(self, opener: Callable) -> None:
+        self.opener = opener
+        await self._connect()
+        if self.worker is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.worker = asyncio.ensure_future(self._run())
+
+    async def _connect(self) -> None:
+        try:
+            self.reader, self.send, self.closer = await self.opener()
+        except serial.SerialException as ex:
+            raise ConnectionError(str(ex)) from ex
+        self.buffer.clear()
+        self.stats["connects"] += 1
+        if self.stats["connects"] > 1:
+            logging.info(f"Reconnected to the Nexus via {self.name}")
+
+    def _disconnect(self) -> None:
+        if self.closer is not None:
+            try:
+                self.closer()
+            except (OSError, serial.SerialException):
+                pass
+        self.reader = self.send = self.closer = None
+
+    async def _read_reply(self, kind: str) -> bytes:
+        while True:
+            length = reply_length(kind, self.buffer)
+            if length > 0:
+                reply = bytes(self.buffer[:length])
+                del self.buffer[:length]
+                return reply
+            data = await self.reader.read(256)
+            if not data:
+                raise ConnectionResetError("closed by the Nexus")
+            self.buffer += data
+
+    async def _exchange(self, commands: List[str]) -> List[str]:
+        if self.reader is None:
+            await self._connect()
+        await self.send("".join(commands).encode("ascii"))
+        replies = []
+        for kind in [reply_kind(txt) for txt in commands]:
+            reply = b"" if kind == REPLY_NONE else await self._read_reply(kind)
+            replies.append(reply.decode("ascii").strip("#"))
+        return replies
+
+    async def _run(self) -> None:
+        while True:
+            request = await self.queue.get()
+            if request is None:
+                return
+            commands, future, timeout = request
+            if future.cancelled():
+                continue
+            self.stats["requests"] += 1
+            error = None
+            try:
+                result = await asyncio.wait_for(self._exchange(commands), timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                self._disconnect()
+                error = TimeoutError(f"no complete reply from the Nexus to {''.join(commands)}")
+            except (OSError, serial.SerialException) as ex:
+                self.stats["failures"] += 1
+                logging.warning(f"Nexus {self.name} link failed on {''.join(commands)}: {ex}")
+                self._disconnect()
+                error = ConnectionError(f"Nexus {self.name} link failed: {ex}")
+            except Exception as ex:
+                # a garbled reply (not ASCII) or a bug, the worker must go on serving the queue
+                self.stats["failures"] += 1
+                logging.exception(f"Nexus {self.name} request {''.join(commands)} failed")
+                self._disconnect()
+                error = ex
+            if future.done():
+                # the caller gave up waiting
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    async def get_batch(self, commands: List[str], timeout: Optional[float] = None) -> List[str]:
+        """Sends the commands in one burst and returns their replies
+
+        Parameters:
+        commands (List[str]): The LX200 commands
+        timeout (float): Seconds to wait for all replies once sent, by default depending on the commands
+
+        Returns:
+        List[str]: The replies without the "#" terminator, "" for commands without a reply"""
+        if self.worker is None:
+            raise ConnectionError("not connected to the Nexus")
+        if timeout is None:
+            timeout = max(COMMAND_TIMEOUTS.get(txt.lstrip("#")[:3], DEFAULT_TIMEOUT) for txt in commands)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((commands, future, timeout))
+        return await future
+
+    async def get(self, txt: str, timeout: Optional[float] = None) -> str:
+        """Sends a command and returns its reply
+
+        Parameters:
+        txt (str): The LX200 command
+        timeout (float): Seconds to wait for the reply once sent
+
+        Returns:
+        str: The reply without the "#" terminator"""
+        return (await self.get_batch([txt], timeout))[0]
+
+    async def write(self, txt: str) -> None:
+        """Sends a command and reads past its reply (if any)
+
+        Parameters:
+        txt (str): The LX200 command"""
+        await self.get_batch([txt])
+
+    async def get_radec(self) -> Tuple[float, float]:
+        """Reads the RA and declination the telescope is pointing to in one burst
+
+        Returns:
+        Tuple[float, float]: The RA in hours and the declination in degrees"""
+        ra, dec = await self.get_batch([":GR#", ":GD#"])
+        return Nexus.parse_radec(ra, dec)
+
+    async def is_aligned(self) -> bool:
+        """Reads if the Nexus DSC is aligned
+
+        Returns:
+        bool: True if the Nexus DSC is aligned, False otherwise"""
+        return await self.get(":GW#") == "AT2"
+
+    async def goto(self, ra: str, dec: str) -> str:
+        """Sets the GoTo target and slews the mount to it, in one burst
+
+        Parameters:
+        ra (str): The RA as HH:MM:SS
+        dec (str): The declination as sDD*MM:SS
+
+        Returns:
+        str: "0" when the mount slews, else the reason why not"""
+        return (await self.get_batch([":Sr" + ra + "#", ":Sd" + dec + "#", ":MS#"]))[2]
+
+    async def sync(self, ra: str, dec: str) -> str:
+        """Syncs the Nexus DSC to a position, in one burst
+
+        Parameters:
+        ra (str): The RA as HH:MM:SS
+        dec (str): The declination as sDD*MM:SS
+
+        Returns:
+        str: The reply of the Nexus to :CM#"""
+        return (await self.get_batch([":Sr" + ra + "#", ":Sd" + dec + "#", ":CM#"]))[2]
+
+    async def close(self) -> None:
+        """Sends the queued requests and closes the link"""
+        if self.worker is not None:
+            await self.queue.put(None)
+            await self.worker
+            self.worker = None
+        self._disconnect()
+
+
+class NexusSync(Nexus):
+    """The Nexus with its I/O on an AsyncNexusClient, for the blocking callers: the client runs on
+    an event loop in a background thread and every call waits for its result. It has the whole
+    interface of the Nexus, only get, get_batch, write and close are its own."""
+
+    def __init__(self, handpad: Display, coordinates: Coordinates, queue_size: int = 8) -> None:
+        """Initializes the Nexus DSC
+
+        Parameters:
+        handpad (Display): The handpad that is connected to the eFinder
+        coordinates (Coordinates): The coordinates utility class to be used in the eFinder
+        queue_size (int): Requests waiting to be sent
+        """
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="nexus-async")
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = AsyncNexusClient(queue_size)
+        # a request may first wait in the queue behind the others
+        self.timeout = (queue_size + 1) * max(COMMAND_TIMEOUTS.values()) + 1.0
+        super().__init__(handpad, coordinates)
+
+    def run(self, coroutine):
+        """Runs a coroutine on the event loop of the client and waits for its result, raises
+        TimeoutError when there is none a little after the longest command timeout
+
+        Parameters:
+        coroutine: The coroutine, like client.get(":GR#")
+
+        Returns:
+        The result of the coroutine
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError("no result from the Nexus event loop")
+
+    def open_link(self, link: str) -> None:
+        """Opens the link to the Nexus DSC, raises OSError when it is not there
+
+        Parameters:
+        link (str): "USB" or "Wifi"
+        """
+        if link == "USB":
+            self.run(self.client.open_serial("/dev/ttyS0", 9600))
+        else:
+            self.run(self.client.open_tcp("10.0.0.1", 4060))
+        self.connection = self.client
+
+    def write(self, txt: str) -> None:
+        """Write a message to the Nexus DSC
+
+        Parameters:
+        txt (str): The text to send to the Nexus DSC
+        """
+        self.run(self.client.write(txt))
+        print("sent", txt, "to Nexus")
+
+    def get(self, txt: str) -> str:
+        """Receive a message from the Nexus DSC
+
+        Parameters:
+        txt (str): The string to send (to tell the Nexus DSC what you want to receive)
+
+        Returns:
+        str:  The requested information from the DSC
+        """
+        res = self.run(self.client.get(txt))
+        print("sent", txt, "got", res, "from Nexus")
+        return res
+
+    def get_batch(self, commands: List[str]) -> List[str]:
+        """Receive the replies to several commands sent in one burst
+
+        Parameters:
+        commands (List[str]): The strings to send
+
+        Returns:
+        List[str]: The replies, in the order of the commands
+        """
+        res = self.run(self.client.get_batch(commands))
+        print("sent", "".join(commands), "got", res, "from Nexus")
+        return res
+
+    def close(self) -> None:
+        """Closes the link to the Nexus DSC"""
+        self.run(self.client.close())
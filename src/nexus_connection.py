@@ -0,0 +1,329 @@
+from typing import List, Optional, Tuple
+import logging
+import socket
+import threading
+import time
+import serial
+
+# The link to the Nexus DSC stays open for the whole session and is shared by the GUI, the handpad
+# loop and the live solve threads: one command and its reply at a time, under the lock. A link that
+# fails is closed and opened again on the next command.
+#
+# A reply is read until it is complete, the kind of reply depends on the command: most end with
+# the "#" terminator, the set commands answer a single "1" or "0", the motion commands say nothing
+# and :MS# answers "0" or an error message that ends with "#". :P# answers "HIGH PRECISION" or
+# "LOW PRECISION", not every firmware sends a "#" after it: a "#" that comes late is dropped from
+# the start of the next reply.
+
+REPLY_NONE = "none"
+REPLY_CHAR = "char"
+REPLY_STRING = "string"
+REPLY_GOTO = "goto"
+REPLY_PRECISION = "precision"
+PRECISION_REPLIES = (b"HIGH PRECISION", b"LOW PRECISION")
+
+# seconds to wait for the reply, commands that make the Nexus work get longer
+DEFAULT_TIMEOUT = 1.0
+COMMAND_TIMEOUTS = {":CM": 3.0, ":MS": 3.0}
+
+
+def reply_kind(txt: str) -> str:
+    """Returns what the Nexus answers to a command
+
+    Parameters:
+    txt (str): The LX200 command, like ":GR#"
+
+    Returns:
+    str: REPLY_NONE, REPLY_CHAR, REPLY_STRING, REPLY_GOTO or REPLY_PRECISION"""
+    command = txt.lstrip("#")[:3]
+    if command == ":MS":
+        return REPLY_GOTO
+    if command == ":P#":
+        return REPLY_PRECISION
+    if command[:2] == ":S":
+        return REPLY_CHAR
+    if command[:2] in (":M", ":Q", ":R") or command == ":U#":
+        return REPLY_NONE
+    return REPLY_STRING
+
+
+def is_read(txt: str) -> bool:
+    """Returns True if the command only reads, so sending it twice does no harm
+
+    Parameters:
+    txt (str): The LX200 command
+
+    Returns:
+    bool: True for the :G commands and :P#"""
+    command = txt.lstrip("#")[:3]
+    return command[:2] == ":G" or command == ":P#"
+
+
+def reply_length(kind: str, data: bytes) -> int:
+    """Returns the length of the complete reply at the start of data
+
+    Parameters:
+    kind (str): The kind of reply
+    data (bytes): The bytes received so far
+
+    Returns:
+    int: The length of the reply including its terminator, 0 while it is incomplete"""
+    if kind == REPLY_NONE:
+        return 0
+    if kind == REPLY_CHAR or (kind == REPLY_GOTO and data[:1] == b"0"):
+        return 1 if data else 0
+    if kind == REPLY_PRECISION:
+        for text in PRECISION_REPLIES:
+            if data.startswith(text):
+                return len(text) + 1 if data[len(text):len(text) + 1] == b"#" else len(text)
+        if not any(text.startswith(bytes(data)) for text in PRECISION_REPLIES):
+            # not the expected text, read it up to the terminator
+            return data.find(b"#") + 1
+        return 0
+    return data.find(b"#") + 1
+
+
+def take_reply(kind: str, buffer: bytearray, skip_terminator: bool) -> Tuple[Optional[bytes], bool]:
+    """Removes the complete reply from the start of the buffer
+
+    Parameters:
+    kind (str): The kind of reply
+    buffer (bytearray): The bytes received so far, the reply is removed from it
+    skip_terminator (bool): True if the last reply was a :P# reply without "#", a "#" at the start is then dropped
+
+    Returns:
+    Tuple[Optional[bytes], bool]: The reply, None while it is incomplete, and skip_terminator for the next call"""
+    if skip_terminator and buffer:
+        if buffer[:1] == b"#":
+            del buffer[:1]
+        skip_terminator = False
+    length = reply_length(kind, buffer)
+    if length == 0:
+        return None, skip_terminator
+    reply = bytes(buffer[:length])
+    del buffer[:length]
+    return reply, kind == REPLY_PRECISION and not reply.endswith(b"#")
+
+
+class NexusConnection:
+    """A persistent link to the Nexus DSC, reopened when it fails"""
+
+    def __init__(self, name: str, retries: int = 1) -> None:
+        """Initializes the link, it is opened by the first command
+
+        Parameters:
+        name (str): The name of the link, "USB" or "Wifi"
+        retries (int): How often a failed read is sent again on a fresh link, commands that change
+            the Nexus or move the mount are never sent twice"""
+        self.name = name
+        self.retries = retries
+        self.link = None
+        # bytes received after the end of the last reply
+        self.buffer = bytearray()
+        self.skip_terminator = False
+        # reentrant, so a sequence of commands can hold it across write and query
+        self.lock = threading.RLock()
+        self.stats = {"commands": 0, "connects": 0, "failures": 0, "timeouts": 0}
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def _send(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def _read_some(self, timeout: float) -> bytes:
+        # the bytes that arrive within the timeout, b"" if none did
+        raise NotImplementedError
+
+    def _discard(self) -> None:
+        raise NotImplementedError
+
+    def connect(self) -> None:
+        """Opens the link if it is not open, raises OSError when the Nexus can not be reached"""
+        with self.lock:
+            if self.link is None:
+                self.link = self._open()
+                self.stats["connects"] += 1
+                if self.stats["connects"] > 1:
+                    logging.info(f"Reconnected to the Nexus via {self.name}")
+
+    def close(self) -> None:
+        """Closes the link, the next command opens it again"""
+        with self.lock:
+            if self.link is not None:
+                try:
+                    self._close()
+                except (OSError, serial.SerialException):
+                    pass
+                self.link = None
+            self.buffer.clear()
+            self.skip_terminator = False
+
+    def _read_reply(self, kind: str, deadline: float) -> bytes:
+        # returns as soon as the reply is complete, a reply still incomplete at the deadline is an error
+        while True:
+            reply, self.skip_terminator = take_reply(kind, self.buffer, self.skip_terminator)
+            if reply is not None:
+                return reply
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                partial = bytes(self.buffer)
+                self.buffer.clear()
+                raise TimeoutError(f"no complete reply from the Nexus, got {partial!r}")
+            self.buffer += self._read_some(remaining)
+
+    def _exchange(self, data: bytes, kinds: List[str], timeout: float, retries: int) -> List[bytes]:
+        with self.lock:
+            self.stats["commands"] += len(kinds)
+            for attempt in range(retries + 1):
+                try:
+                    self.connect()
+                    # replies left over from earlier commands are not ours
+                    self.buffer.clear()
+                    self._discard()
+                    self._send(data)
+                    # the replies come back in the order of the commands
+                    deadline = time.monotonic() + timeout
+                    return [b"" if kind == REPLY_NONE else self._read_reply(kind, deadline) for kind in kinds]
+                except TimeoutError:
+                    # the link is up but the Nexus did not answer in time, a late reply is discarded
+                    self.stats["timeouts"] += 1
+                    raise
+                except (OSError, serial.SerialException) as ex:
+                    self.stats["failures"] += 1
+                    logging.warning(f"Nexus {self.name} link failed on {data!r}: {ex}")
+                    self.close()
+                    if attempt == retries:
+                        raise ConnectionError(f"Nexus {self.name} link failed: {ex}") from ex
+        return []
+
+    def write(self, txt: str) -> None:
+        """Sends a command and reads past its reply (if any), so it can not be taken for the reply
+        of the next command
+
+        Parameters:
+        txt (str): The LX200 command"""
+        self.query(txt)
+
+    def query(self, txt: str, timeout: Optional[float] = None) -> str:
+        """Sends a command and returns its reply as soon as it is complete
+
+        Parameters:
+        txt (str): The LX200 command
+        timeout (float): Seconds to wait for the reply, by default depending on the command
+
+        Returns:
+        str: The reply without the "#" terminator, "" for commands without a reply"""
+        return self.query_batch([txt], timeout)[0]
+
+    def query_batch(self, commands: List[str], timeout: Optional[float] = None) -> List[str]:
+        """Sends the commands in one burst and splits the replies, so they take one round trip
+        instead of one per command
+
+        Parameters:
+        commands (List[str]): The LX200 commands
+        timeout (float): Seconds to wait for all replies, by default depending on the commands
+
+        Returns:
+        List[str]: The replies without the "#" terminator, "" for commands without a reply"""
+        if timeout is None:
+            timeout = max(COMMAND_TIMEOUTS.get(txt.lstrip("#")[:3], DEFAULT_TIMEOUT) for txt in commands)
+        # a set, sync or GoTo may have reached the Nexus before the link failed
+        retries = self.retries if all(is_read(txt) for txt in commands) else 0
+        replies = self._exchange(
+            "".join(commands).encode("ascii"), [reply_kind(txt) for txt in commands], timeout, retries
+        )
+        return [reply.decode("ascii").strip("#") for reply in replies]
+
+
+class SerialConnection(NexusConnection):
+    """The Nexus DSC on the serial port"""
+
+    def __init__(self, port: str = "/dev/ttyS0", baudrate: int = 9600, retries: int = 1) -> None:
+        """Initializes the link, the port is opened at once so a missing Nexus shows up here
+
+        Parameters:
+        port (str): The serial device
+        baudrate (int): The baud rate of the Nexus
+        retries (int): How often a failed read is sent again on a reopened port"""
+        super().__init__("USB", retries)
+        self.port = port
+        self.baudrate = baudrate
+        self.connect()
+
+    def _open(self):
+        # reads return after this many seconds, the reply deadline is checked between them
+        return serial.Serial(self.port, baudrate=self.baudrate, timeout=0.02)
+
+    def _close(self) -> None:
+        self.link.close()
+
+    def _send(self, data: bytes) -> None:
+        self.link.write(data)
+
+    def _read_some(self, timeout: float) -> bytes:
+        return self.link.read(max(1, self.link.in_waiting))
+
+    def _discard(self) -> None:
+        self.link.reset_input_buffer()
+
+
+class TcpConnection(NexusConnection):
+    """The Nexus DSC on its WiFi access point, one TCP connection kept open with keepalive"""
+
+    def __init__(self, host: str = "10.0.0.1", port: int = 4060, timeout: float = 2.0, retries: int = 1) -> None:
+        """Initializes the link, the connection is made at once so a missing Nexus shows up here
+
+        Parameters:
+        host (str): The address of the Nexus
+        port (int): The LX200 port of the Nexus
+        timeout (float): Seconds to wait for the connection
+        retries (int): How often a failed read is sent again on a new connection"""
+        super().__init__("Wifi", retries)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect()
+
+    def _open(self):
+        link = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        # short commands go out at once instead of waiting for more data (Nagle)
+        link.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        link.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # notice a Nexus that went away (switched off, out of WiFi range) within about half a minute
+        for option, value in (("TCP_KEEPIDLE", 10), ("TCP_KEEPINTVL", 5), ("TCP_KEEPCNT", 3)):
+            if hasattr(socket, option):
+                link.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        return link
+
+    def _close(self) -> None:
+        self.link.close()
+
+    def _send(self, data: bytes) -> None:
+        self.link.settimeout(self.timeout)
+        self.link.sendall(data)
+
+    def _read_some(self, timeout: float) -> bytes:
+        self.link.settimeout(timeout)
+        try:
+            data = self.link.recv(256)
+        except socket.timeout:
+            return b""
+        if not data:
+            raise ConnectionResetError("closed by the Nexus")
+        return data
+
+    def _discard(self) -> None:
+        self.link.setblocking(False)
+        try:
+            while True:
+                data = self.link.recv(256)
+                if not data:
+                    raise ConnectionResetError("closed by the Nexus")
+        except BlockingIOError:
+            pass
+        finally:
+            self.link.settimeout(self.timeout)
@@ -0,0 +1,103 @@
+from bisect import bisect_left
+from collections import deque, namedtuple
+from typing import Deque, Optional
+import logging
+import threading
+import time
+
+# The mount state at one moment: timestamp (seconds, time.time() halfway the read), radec (RA hours,
+# Dec degrees), altaz (degrees), aligned, target (the GoTo target RA and Dec, None if none is set)
+# and short (the RA and Dec for file names). Snapshots are never changed once published.
+NexusSnapshot = namedtuple("NexusSnapshot", ["timestamp", "radec", "altaz", "aligned", "target", "short"])
+
+
+class NexusPoller:
+    """Reads the Nexus in a background thread at a fixed rate and keeps the recent snapshots, so
+    the GUI and handpad get the mount state without waiting on the link, and a solve can be paired
+    with the mount position at the time of its exposure"""
+
+    def __init__(self, nexus, rate: float = 2.0, history: int = 120) -> None:
+        """Initializes the poller
+
+        Parameters:
+        nexus (NexusInterface): The Nexus, read with poll()
+        rate (float): Reads per second
+        history (int): Number of recent snapshots kept"""
+        self.nexus = nexus
+        self.interval = 1.0 / rate
+        self.snapshots: Deque[NexusSnapshot] = deque(maxlen=history)
+        self.snapshot: Optional[NexusSnapshot] = None
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.failures = 0
+
+    def start(self) -> None:
+        """Starts polling, the Nexus then answers read_altAz from the snapshots"""
+        if self.running:
+            return
+        self.running = True
+        self.nexus.set_poller(self)
+        self.thread = threading.Thread(target=self._run, name="nexus-poller")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stops polling, the Nexus is read on demand again"""
+        self.running = False
+        self.nexus.set_poller(None)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        next_time = time.monotonic()
+        while self.running:
+            try:
+                self.publish(self.nexus.poll())
+            except (OSError, ValueError, IndexError) as ex:
+                # a link failure or a garbled reply, the next read tries again
+                self.failures += 1
+                logging.warning(f"Nexus poll failed: {ex}")
+            next_time = max(next_time + self.interval, time.monotonic())
+            time.sleep(next_time - time.monotonic())
+
+    def publish(self, snapshot: NexusSnapshot) -> None:
+        """Makes a snapshot the latest one
+
+        Parameters:
+        snapshot (NexusSnapshot): The mount state"""
+        with self.lock:
+            self.snapshots.append(snapshot)
+            self.snapshot = snapshot
+
+    def latest(self, max_age: Optional[float] = None) -> Optional[NexusSnapshot]:
+        """Returns the newest snapshot
+
+        Parameters:
+        max_age (float): Snapshots older than this many seconds are not returned, by default two poll intervals
+
+        Returns:
+        NexusSnapshot: The snapshot, None if there is no recent one"""
+        snapshot = self.snapshot
+        if max_age is None:
+            max_age = 2 * self.interval
+        if snapshot is None or time.time() - snapshot.timestamp > max_age:
+            return None
+        return snapshot
+
+    def snapshot_at(self, timestamp: float) -> Optional[NexusSnapshot]:
+        """Returns the snapshot closest in time, to pair a frame with the mount position during its exposure
+
+        Parameters:
+        timestamp (float): The time, like CameraFrame.timestamp
+
+        Returns:
+        NexusSnapshot: The snapshot, None if there are none"""
+        with self.lock:
+            snapshots = list(self.snapshots)
+        if not snapshots:
+            return None
+        index = bisect_left([snapshot.timestamp for snapshot in snapshots], timestamp)
+        candidates = snapshots[max(index - 1, 0):index + 1]
+        return min(candidates, key=lambda snapshot: abs(snapshot.timestamp - timestamp))
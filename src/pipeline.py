@@ -0,0 +1,216 @@
+from typing import Callable, Dict, Optional
+import logging
+import queue
+import threading
+import time
+from CameraInterface import CameraFrame
+from frame_triage import TriageResult
+from platesolve import PlateSolve
+from wcs_transform import TanSipWcs
+
+
+class LiveSolution:
+    """The outcome of solving one frame of the live solve loop"""
+
+    def __init__(
+        self,
+        frame: CameraFrame,
+        solved: bool,
+        reason: str,
+        solve_time: float,
+        wcs: Optional[TanSipWcs],
+        verdict: Optional[TriageResult] = None,
+    ) -> None:
+        """Initializes the solution
+
+        Parameters:
+        frame (CameraFrame): The frame that was solved
+        solved (bool): True if the frame was solved
+        reason (str): Why it was not solved, empty when solved
+        solve_time (float): Seconds spent on triage and solving
+        wcs (TanSipWcs): The solution, None when not solved
+        verdict (TriageResult): The triage of the frame"""
+        self.frame = frame
+        self.solved = solved
+        self.reason = reason
+        self.solve_time = solve_time
+        self.wcs = wcs
+        self.verdict = verdict
+        self.completed = time.time()
+        # from the start of the exposure to the solution
+        self.latency = self.completed - frame.timestamp
+        self.radec_hint = frame.metadata.get("radec_hint")
+
+
+def put_latest(stage_queue: queue.Queue, item) -> int:
+    """Puts the item in a bounded queue, the oldest items are dropped when it is full
+
+    Parameters:
+    stage_queue (queue.Queue): The queue between two stages
+    item: The new item
+
+    Returns:
+    int: The number of items dropped"""
+    dropped = 0
+    while True:
+        try:
+            stage_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                stage_queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class LiveSolvePipeline:
+    """Continuous capture and solve, each stage in its own thread so the next exposure runs while
+    the previous frame is solved. The stages are connected by bounded queues that drop the
+    oldest frame when the next stage falls behind, so the solver always works on the newest one.
+
+    capture -> frames queue -> triage + solve -> solutions queue -> on_solution"""
+
+    def __init__(
+        self,
+        capture: Callable[[], Optional[CameraFrame]],
+        platesolve: PlateSolve,
+        radec_hint: Optional[Callable[[CameraFrame], tuple]] = None,
+        on_solution: Optional[Callable[[LiveSolution], None]] = None,
+        queue_size: int = 1,
+        solve_timeout: float = 30,
+    ) -> None:
+        """Initializes the pipeline
+
+        Parameters:
+        capture (Callable[[], CameraFrame]): Takes an exposure and returns the frame, None on failure
+        platesolve (PlateSolve): The solver
+        radec_hint (Callable[[CameraFrame], Tuple[float, float]]): Returns the RA (hours) and Dec the
+            scope reported during the exposure of the frame, None to solve it blind
+        on_solution (Callable[[LiveSolution], None]): Called in the output thread for every solution
+        queue_size (int): Frames waiting between two stages, 1 keeps only the newest
+        solve_timeout (float): Seconds after which a solve is given up"""
+        self.capture = capture
+        self.platesolve = platesolve
+        self.radec_hint = radec_hint
+        self.on_solution = on_solution
+        self.solve_timeout = solve_timeout
+        self.frames: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.solutions: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.latest: Optional[LiveSolution] = None
+        self.running = False
+        self.threads = []
+        self.stats: Dict[str, int] = {}
+        # the stage threads count into stats while other threads read them
+        self.lock = threading.Lock()
+        self.started = 0.0
+
+    def start(self) -> None:
+        """Starts the stage threads"""
+        if self.running:
+            return
+        self.running = True
+        self.started = time.time()
+        with self.lock:
+            self.stats = {"captured": 0, "dropped": 0, "solved": 0, "failed": 0}
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name="live-capture"),
+            threading.Thread(target=self._solve_loop, name="live-solve"),
+            threading.Thread(target=self._output_loop, name="live-output"),
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        logging.info("Live solve started")
+
+    def stop(self) -> None:
+        """Stops the stage threads, the running solve is cancelled"""
+        if not self.running:
+            return
+        self.running = False
+        job = self.platesolve.running_job
+        if job is not None and job.priority < 0:
+            job.cancel()
+        for thread in self.threads:
+            thread.join()
+        logging.info(f"Live solve stopped, {self.snapshot()} {self.rate():.2f} solutions/s")
+
+    def snapshot(self) -> Dict[str, int]:
+        """Returns a copy of the counters of captured, dropped, solved and failed frames"""
+        with self.lock:
+            return dict(self.stats)
+
+    def rate(self) -> float:
+        """Returns the number of solutions per second since the start"""
+        elapsed = time.time() - self.started
+        return self.snapshot().get("solved", 0) / elapsed if elapsed > 0 else 0.0
+
+    def _count(self, counter: str, count: int = 1) -> None:
+        with self.lock:
+            self.stats[counter] += count
+
+    def _capture_loop(self) -> None:
+        while self.running:
+            try:
+                frame = self.capture()
+            except Exception as ex:
+                logging.error(f"Live capture failed: {ex}")
+                frame = None
+            if frame is None:
+                time.sleep(0.5)
+                continue
+            if not frame.data.flags.owndata:
+                # a view on the capture buffer of the camera, the next exposure would overwrite it while solving
+                frame.data = frame.data.copy()
+            frame.metadata["radec_hint"] = self.radec_hint(frame) if self.radec_hint is not None else None
+            self._count("captured")
+            self._count("dropped", put_latest(self.frames, frame))
+
+    def _get(self, stage_queue: queue.Queue):
+        while self.running:
+            try:
+                return stage_queue.get(timeout=0.2)
+            except queue.Empty:
+                pass
+        return None
+
+    def _solve_loop(self) -> None:
+        while self.running:
+            frame = self._get(self.frames)
+            if frame is None:
+                return
+            start_time = time.time()
+            verdict = self.platesolve.triage_frame(frame.data, frame.binning)
+            if not verdict.ok:
+                solution = LiveSolution(frame, False, verdict.reason, time.time() - start_time, None, verdict)
+            else:
+                # a lower priority than any solve started by a button, those preempt the live loop
+                job = self.platesolve.submit(
+                    False, frame.metadata["radec_hint"], frame.data, priority=-1, timeout=self.solve_timeout,
+                    binning=frame.binning,
+                )
+                job.wait()
+                if job.state == "cancelled":
+                    continue
+                # parsed by the job itself, capture.wcs may already hold the solve of a button
+                wcs = job.wcs if job.solved() else None
+                reason = "" if wcs is not None else ("not solved" if job.state == "done" else job.state)
+                solution = LiveSolution(frame, wcs is not None, reason, time.time() - start_time, wcs, verdict)
+            self._count("solved" if solution.solved else "failed")
+            self.latest = solution
+            self._count("dropped", put_latest(self.solutions, solution))
+
+    def _output_loop(self) -> None:
+        while self.running:
+            solution = self._get(self.solutions)
+            if solution is None:
+                return
+            logging.debug(
+                f"Live solution solved={solution.solved} solve {solution.solve_time:.2f} s "
+                f"latency {solution.latency:.2f} s"
+            )
+            if self.on_solution is not None:
+                try:
+                    self.on_solution(solution)
+                except Exception:
+                    logging.exception("Live solution handler failed")
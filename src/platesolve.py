@@ -2,12 +2,160 @@ from pathlib import Path
 import time
 import subprocess
 import logging
+import json
+import math
+import os
+import shutil
+import signal
+import threading
+import itertools
+import numpy as np
+from PIL import Image
+from solver_service import SolverClient, write_wcs
+from star_extractor import StarExtractor
+from star_matcher import estimate_shift, match_stars, fit_similarity
+from wcs_transform import TanSipWcs
+from scale_estimator import ScaleEstimator
+from frame_triage import FrameTriage, TriageResult
+
+
+class SolveStrategy:
+    """One set of extraction and solve-field settings, several strategies race each other in solve_race"""
+
+    def __init__(self, name: str, downsample: int = 2, sigma: float = 5.0, scale_margin: float = 0.1, hint_radius=None) -> None:
+        """Initializes the strategy
+
+        Parameters:
+        name (str): The name used in the logs and the win statistics
+        downsample (int): Binning factor used by the star extractor
+        sigma (float): Detection threshold of the star extractor
+        scale_margin (float): The pixel scale search window, 0.1 is +-10%
+        hint_radius (float): Search radius in degrees around the Nexus position, None for a blind solve"""
+        self.name = name
+        self.extractor = StarExtractor(sigma=sigma, downsample=downsample)
+        self.scale_margin = scale_margin
+        self.hint_radius = hint_radius
+
+
+class SolveCancelled(Exception):
+    """Raised inside a solve when its job was cancelled, preempted or timed out"""
+
+
+class SolveJob:
+    """Handle on a solve running in the background, returned by PlateSolve.submit"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, priority: int = 0, timeout=None, callback=None) -> None:
+        """Initializes the job
+
+        Parameters:
+        priority (int): A running job is only preempted by a job of the same or a higher priority
+        timeout (float): Seconds after which the job is cancelled, None to wait forever
+        callback (Callable[[SolveJob], None]): Called from the solver thread when the job ends"""
+        self.id = f"{os.getpid()}-{next(self._ids)}"
+        self.priority = priority
+        self.timeout = timeout
+        self.callback = callback
+        self.state = "queued"  # queued, running, done, cancelled, timeout or failed
+        self.result = None
+        # the parsed solution and the extracted stars, the shared capture.wcs and PlateSolve.stars
+        # may already belong to a newer solve
+        self.wcs = None
+        self.stars = None
+        self.elapsed = 0.0
+        self.error = None
+        self.created = time.time()
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+        self._cancel_hook = None
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self.cancel, args=("timeout",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """Stops the job, a running solve-field is killed
+
+        Parameters:
+        reason (str): The final state of the job, cancelled or timeout"""
+        with self._lock:
+            if self.finished.is_set() or self.cancelled.is_set():
+                return
+            self.state = reason
+            self.cancelled.set()
+            hook = self._cancel_hook
+        if hook is not None:
+            hook()
+
+    def set_cancel_hook(self, hook) -> None:
+        """Sets the function that kills what the job is waiting on, it is called at once when
+        the job is already cancelled
+
+        Parameters:
+        hook (Callable[[], None]): The function, None to clear it"""
+        with self._lock:
+            self._cancel_hook = hook
+            call_now = hook is not None and self.cancelled.is_set()
+        if call_now:
+            hook()
+
+    def check(self) -> None:
+        """Raises SolveCancelled when the job should stop"""
+        if self.cancelled.is_set():
+            raise SolveCancelled(f"solve job {self.id} {self.state}")
+
+    def done(self) -> bool:
+        """Returns True when the job has ended, in any state"""
+        return self.finished.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        """Waits for the job to end
+
+        Parameters:
+        timeout (float): Seconds to wait, None to wait until it ends
+
+        Returns:
+        bool: True if the job has ended"""
+        return self.finished.wait(timeout)
+
+    def solved(self) -> bool:
+        """Returns True if the job ended with a solution"""
+        return self.state == "done" and PlateSolve.is_solved(self.result)
+
+    def _finish(self, state: str) -> None:
+        with self._lock:
+            if not self.cancelled.is_set():
+                self.state = state
+            self._cancel_hook = None
+        if self._timer is not None:
+            self._timer.cancel()
+        self.finished.set()
+        if self.callback is not None:
+            self.callback(self)
+
+
+DEFAULT_STRATEGIES = [
+    SolveStrategy("hint2", hint_radius=2),
+    SolveStrategy("hint5_narrow", scale_margin=0.05, hint_radius=5),
+    SolveStrategy("hint15_full_res", downsample=1, hint_radius=15),
+    SolveStrategy("blind"),
+    SolveStrategy("blind_bin4", downsample=4),
+    SolveStrategy("blind_deep", sigma=3.0),
+]
 
 
 class PlateSolve:
-    def __init__(self, pix_scale, images_path: Path=Path('/dev/shm/images'), cwd_path: Path=Path.cwd()) -> None:
+    def __init__(self, pix_scale, images_path: Path=Path('/dev/shm/images'), cwd_path: Path=Path.cwd(), use_service: bool=False) -> None:
         self.cwd_path: Path = cwd_path 
         self.images_path: Path = images_path
+        self.pix_scale = pix_scale
+        # the scale window narrows once the measured pixel scale is stable, see update_scale_window
+        self.scale_estimator = ScaleEstimator(self.cwd_path / "pixel_scale.json", pix_scale)
+        # the solver service keeps the index files loaded between solves
+        self.service = SolverClient(self.images_path / "solver.sock") if use_service else None
         self.scale_low = str(pix_scale * 0.9)
         self.scale_high = str(pix_scale * 1.1)
         self.limitOptions = [
@@ -44,25 +192,602 @@ class PlateSolve:
             "--rdls", "none"  # Don't generate the point list
             # "--temp-axy" # We can't specify not to create the axy list, but we can write it to temp dir
         ]
+        # search radii in degrees around the position hint, tried in order before a blind solve.
+        # The Nexus reports JNow and the indexes are J2000, the smallest radius allows for that
+        self.hint_radii = [2, 5, 15]
+        # seconds for all attempts of one solve together, what one solve-field run had before the ladder
+        self.solve_budget = 10
         self.cmd = ["solve-field"]
         self.captureFile = self.images_path / "capture.jpg"
         self.options = (
             self.limitOptions + self.optimizedOptions +
             self.scaleOptions + self.fileOptions + [self.captureFile]
         )
+        # stars are extracted here, solve-field only gets the star list
+        self.extractor = StarExtractor(downsample=2)
+        self.xylistFile = self.images_path / "capture.xy"
+        self.stars = None
+        # the solution of the last solve_image, None when it failed
+        self.wcs = None
+        # seconds spent per stage in the last solve_image: load, extraction, tracking, xylist, solve_field, wcs
+        self.timings = {}
+        self.triage = FrameTriage()
+        # racing several strategies, one solve-field per core, the first solution wins
+        self.race = False
+        self.race_size = os.cpu_count() or 4
+        self.strategies = DEFAULT_STRATEGIES
+        self.race_path = self.images_path / "race"
+        self.race_stats_file = self.cwd_path / "solve_stats.json"
+        self.race_stats = self.load_race_stats()
+        # the statistics are saved when the ranking of the strategies changes, every
+        # race_save_interval races and by save_race_stats at shutdown
+        self.race_save_interval = 50
+        self.unsaved_races = 0
+        # tracking: follow the field from frame to frame by matching stars against the last solution
+        self.tracking = False
+        self.track_reference = None
+        self.tracked_frames = 0
+        self.max_tracked_frames = 30  # a full solve now and then stops errors from adding up
+        self.min_track_matches = 8
+        self.max_track_rms = 1.5  # pixels
+        self.track_binning = 1
+        # on sensor binning of the frame being solved: the extraction downsamples less and the
+        # pixel scale is binning times larger, the scale estimator learns the unbinned scale
+        self.binning = 1
+        self.downsample = 2
+        # background jobs, see submit: one solve at a time, the newest frame preempts older ones
+        self.job_lock = threading.Lock()
+        self.solve_lock = threading.Lock()
+        self.running_job = None
+        self.pending_job = None
+        self.current_job = None
+        self.temp_path = self.images_path / "tmp"
         pass
 
-    def solve_image(self, offset_flag):
+    def xylist_options(self, width, height):
+        """Returns the solve-field options to solve the star list instead of the image
+
+        Parameters:
+        width (int): The width of the frame in pixels
+        height (int): The height of the frame in pixels
+
+        Returns:
+        List[str]: The solve-field options"""
+        return (
+            self.limitOptions + self.optimizedOptions[2:] +  # no --downsample, there is no image
+            self.scaleOptions + self.fileOptions +
+            ["--width", str(width), "--height", str(height), self.xylistFile]
+        )
+
+    def load_capture(self) -> np.ndarray:
+        """Returns the last captured image as a greyscale array"""
+        return np.asarray(Image.open(self.captureFile).convert("L"))
+
+    def _time_stage(self, stage: str, stage_start: float) -> float:
+        """Adds the time since stage_start to the stage in self.timings, returns the start of the next stage"""
+        now = time.time()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - stage_start
+        return now
+
+    def triage_frame(self, image=None, binning: int = 1) -> TriageResult:
+        """Quick check if the frame is worth solving, takes milliseconds instead of the solve-field cpu limit
+
+        Parameters:
+        image (np.ndarray): The frame to check, capture.jpg is read when not given
+        binning (int): The binning of the frame on the sensor
+
+        Returns:
+        TriageResult: The verdict, its reason can be shown on the handpad"""
+        if image is None:
+            image = self.load_capture()
+        return self.triage.assess(image, binning)
+
+    def submit(self, offset_flag, radec_hint=None, image=None, priority: int = 0, timeout=None, callback=None, binning: int = 1) -> SolveJob:
+        """Starts solve_image in the background and returns at once.
+
+        Only the newest frame is worth solving: a job still waiting for its turn is cancelled,
+        and the running job is preempted (its solve-field killed) unless it has a higher priority.
+
+        Parameters:
+        offset_flag (bool): See solve_image
+        radec_hint (Tuple[float, float]): See solve_image
+        image (np.ndarray): See solve_image
+        priority (int): A running job is only preempted by a job of the same or a higher priority
+        timeout (float): Seconds after which the job is cancelled, None to wait forever
+        callback (Callable[[SolveJob], None]): Called from the solver thread when the job ends
+        binning (int): See solve_image
+
+        Returns:
+        SolveJob: The handle to wait on or cancel"""
+        job = SolveJob(priority, timeout, callback)
+        with self.job_lock:
+            if self.pending_job is not None:
+                self.pending_job.cancel()
+            if self.running_job is not None and self.running_job.priority <= priority:
+                logging.info(f"Solve job {self.running_job.id} preempted by {job.id}")
+                self.running_job.cancel()
+            self.pending_job = job
+        worker = threading.Thread(target=self._run_job, args=(job, offset_flag, radec_hint, image, binning))
+        worker.daemon = True
+        worker.start()
+        return job
+
+    def _run_job(self, job: SolveJob, offset_flag, radec_hint, image, binning) -> None:
+        # the files in images_path are shared, so the solves take turns
+        with self.solve_lock:
+            with self.job_lock:
+                if self.pending_job is job:
+                    self.pending_job = None
+                if job.cancelled.is_set():
+                    job._finish(job.state)
+                    return
+                self.running_job = job
+                job.state = "running"
+            self.current_job = job
+            try:
+                job.result, job.elapsed = self.solve_image(offset_flag, radec_hint, image, binning)
+                job.wcs, job.stars = self.wcs, self.stars
+                job._finish("done")
+            except SolveCancelled:
+                logging.info(f"Solve job {job.id} {job.state} after {time.time() - job.created:.2f} s")
+                job._finish(job.state)
+            except Exception as ex:
+                logging.exception(f"Solve job {job.id} failed")
+                job.error = ex
+                job._finish("failed")
+            finally:
+                self.current_job = None
+                with self.job_lock:
+                    self.running_job = None
+
+    def _check_cancelled(self) -> None:
+        if self.current_job is not None:
+            self.current_job.check()
+
+    def solve_image(self, offset_flag, radec_hint=None, image=None, binning: int = 1):
+        """Plate solve the captured image
+
+        The stars are extracted with the StarExtractor and solve-field (or the solver service) runs on
+        the star list. The extracted stars, brightest first, are kept in self.stars.
+        Only when the stars need to be named (offset_flag) solve-field gets the image itself.
+
+        Parameters:
+        offset_flag (bool): True if solve-field should name the bright stars in the image
+        radec_hint (Tuple[float, float]): Optional RA (hours) and Dec (degrees) the scope reports.
+            When given, the search starts close to it and widens along hint_radii before a blind solve.
+            All attempts together get solve_budget seconds, each one what the earlier ones left
+        image (np.ndarray): The frame to solve, capture.jpg is read when not given.
+            In offset mode a given frame is written to capture.jpg for solve-field
+        binning (int): The on sensor binning of the frame
+
+        Returns:
+        Tuple[CompletedProcess, float]: The solve-field result and the total elapsed time"""
         # global solved, scopeAlt, star_name, star_name_offset, solved_radec, solved_altaz
+        self.binning = binning
+        # binned frames keep their own measurements, their centroids differ a little
+        self.scale_estimator.set_binning(binning)
+        self.wcs = None
+        if self.race and not offset_flag:
+            return self.solve_race(radec_hint, image)
         name_that_star = ([]) if (offset_flag == True) else (["--no-plots"])
         # "--temp-axy" We can't specify not to create the axy list, but we can write it to /tmp
         start_time = time.time()
-        result = subprocess.run(
-            self.cmd + name_that_star + self.options, capture_output=True, text=True
-        )
+        self.timings = {}
+        self.update_scale_window()
+        stage_start = time.time()
+        in_memory = image is not None
+        if image is None:
+            image = self.load_capture()
+            stage_start = self._time_stage("load", stage_start)
+        self.stars = self.extractor.extract(image, self.binned_downsample(self.extractor.downsample))
+        stage_start = self._time_stage("extraction", stage_start)
+        height, width = image.shape[:2]
+        if (
+            self.tracking and not offset_flag and self.track_reference is not None
+            and self.track_binning == binning
+        ):
+            result = self.solve_track(image.shape)
+            stage_start = self._time_stage("tracking", stage_start)
+            if result is not None:
+                elapsed_time = time.time() - start_time
+                logging.debug(f"Platesolve by tracking, elapsed time is {elapsed_time:.2f}")
+                return result, elapsed_time
+        if offset_flag:
+            # naming the stars needs the image itself, the only time a frame is encoded for solving
+            if in_memory:
+                Image.fromarray(image).save(self.captureFile)
+            options = self.options
+        else:
+            self.extractor.write_xylist(self.stars, self.xylistFile, width, height)
+            options = self.xylist_options(width, height)
+            stage_start = self._time_stage("xylist", stage_start)
+        attempts = []
+        if radec_hint is not None:
+            attempts = list(self.hint_radii)
+        attempts.append(None)  # the last attempt is always blind
+        deadline = time.time() + self.solve_budget
+        # naming the stars needs the plots of solve-field
+        use_service = self.service is not None and not offset_flag
+        for radius in attempts:
+            remaining = deadline - time.time()
+            if remaining < 1:
+                logging.info(f"Platesolve budget of {self.solve_budget} s used up before radius={radius or 'blind'}")
+                break
+            self._check_cancelled()
+            cpulimit = math.ceil(remaining)
+            hint_options = [] if radius is None else self.hint_options(radec_hint, radius)
+            attempt_start = time.time()
+            result = None
+            if use_service:
+                hint = None if radius is None else (radec_hint[0] * 15 % 360, radec_hint[1], radius)
+                result = self.solve_in_service(hint, cpulimit, width, height)
+            if result is None:
+                result = self._run_solve_field(name_that_star + hint_options + self.with_cpulimit(options, cpulimit))
+            stage_start = self._time_stage("solve_field", stage_start)
+            self.timings["attempts"] = self.timings.get("attempts", 0) + 1
+            solved = self.is_solved(result)
+            logging.info(
+                f"Platesolve attempt radius={radius or 'blind'} solved={solved} "
+                f"time={time.time() - attempt_start:.2f}"
+            )
+            if solved:
+                self.on_solved()
+                self._time_stage("wcs", stage_start)
+                break
+        if not solved:
+            self.scale_estimator.record_failure()
         elapsed_time = time.time() - start_time
         logging.debug(f"platesolve result is: {result}")
-        logging.debug(f"platesolve command is: {self.cmd + name_that_star + self.options}")  
+        logging.debug(f"platesolve command is: {self.cmd + name_that_star + hint_options + options}")
         logging.debug(f"Platesolve elapsed time is {elapsed_time:.2f}")
         return result, elapsed_time
 
+    def solve_race(self, radec_hint=None, image=None):
+        """Solve the frame with several strategies at the same time, one process per strategy.
+        The first solution wins, the other processes are killed and the winner's wcs becomes capture.wcs.
+
+        Parameters:
+        radec_hint (Tuple[float, float]): Optional RA (hours) and Dec (degrees), needed by the hinted strategies
+        image (np.ndarray): The frame to solve, capture.jpg is read when not given
+
+        Returns:
+        Tuple[CompletedProcess, float]: The winning (or last failing) solve-field result and the elapsed time"""
+        start_time = time.time()
+        self.timings = {}
+        stage_start = time.time()
+        if image is None:
+            image = self.load_capture()
+            stage_start = self._time_stage("load", stage_start)
+        height, width = image.shape[:2]
+        strategies = self.pick_strategies(radec_hint is not None)
+        stars_per_extractor = {}
+        running = {}
+        for strategy in strategies:
+            strategy_path = self.race_path / strategy.name
+            os.makedirs(strategy_path, exist_ok=True)
+            downsample = self.binned_downsample(strategy.extractor.downsample)
+            key = (downsample, strategy.extractor.sigma)
+            if key not in stars_per_extractor:
+                stars_per_extractor[key] = strategy.extractor.extract(image, downsample)
+                stage_start = self._time_stage("extraction", stage_start)
+            xylist_file = strategy_path / "capture.xy"
+            strategy.extractor.write_xylist(stars_per_extractor[key], xylist_file, width, height)
+            hint_options = [] if strategy.hint_radius is None else self.hint_options(radec_hint, strategy.hint_radius)
+            args = (
+                ["--no-plots", "--temp-dir", strategy_path] + hint_options + self.limitOptions + self.optimizedOptions[2:] +
+                self.scale_options(strategy.scale_margin) + ["--dir", strategy_path] + self.fileOptions[2:] +
+                ["--width", str(width), "--height", str(height), xylist_file]
+            )
+            with open(strategy_path / "solve.log", "w") as log:
+                process = subprocess.Popen(
+                    self.cmd + args, stdout=log, stderr=subprocess.STDOUT, text=True, start_new_session=True
+                )
+            running[strategy.name] = (strategy, process, args)
+
+        winner = None
+        result = None
+        while running and winner is None:
+            if self.current_job is not None and self.current_job.cancelled.is_set():
+                self._kill_race(running)
+                self._remove_race_temp(strategies)
+                self.current_job.check()
+            time.sleep(0.02)
+            for name, (strategy, process, args) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                del running[name]
+                output = (self.race_path / name / "solve.log").read_text()
+                result = subprocess.CompletedProcess(self.cmd + args, process.returncode, output, "")
+                if self.is_solved(result) and (self.race_path / name / "capture.wcs").exists():
+                    winner = strategy
+                    break
+        self._kill_race(running)
+        self._remove_race_temp(strategies)
+        stage_start = self._time_stage("solve_field", stage_start)
+        elapsed_time = time.time() - start_time
+
+        if winner is not None:
+            shutil.copyfile(self.race_path / winner.name / "capture.wcs", self.images_path / "capture.wcs")
+            self.stars = stars_per_extractor[(self.binned_downsample(winner.extractor.downsample), winner.extractor.sigma)]
+            self.on_solved()
+            self._time_stage("wcs", stage_start)
+        else:
+            self.stars = next(iter(stars_per_extractor.values()))
+            self.scale_estimator.record_failure()
+        self.record_race(strategies, winner, elapsed_time)
+        logging.info(
+            f"Platesolve race of {[s.name for s in strategies]} won by "
+            f"{winner.name if winner else 'nobody'} in {elapsed_time:.2f} s"
+        )
+        return result, elapsed_time
+
+    @staticmethod
+    def _kill_race(running) -> None:
+        """Kills the process groups of the strategies still running"""
+        for name, (strategy, process, args) in running.items():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+        running.clear()
+
+    def _remove_race_temp(self, strategies) -> None:
+        """Removes the temp files the killed solve-field processes left behind"""
+        for strategy in strategies:
+            for temp_file in (self.race_path / strategy.name).glob("tmp.*"):
+                temp_file.unlink(missing_ok=True)
+
+    def binned_downsample(self, downsample: int) -> int:
+        """Returns the downsample factor that gives the same resolution on a frame binned on the sensor"""
+        return max(1, downsample // self.binning)
+
+    def update_scale_window(self) -> None:
+        """Sets the solve-field scale options to the window the scale estimator advises"""
+        scale = self.scale_estimator.estimate() * self.binning
+        self.optimizedOptions[1] = str(self.binned_downsample(self.downsample))
+        margin = self.scale_estimator.margin()
+        self.scale_low = str(scale * (1 - margin))
+        self.scale_high = str(scale * (1 + margin))
+        self.scaleOptions[3] = self.scale_low
+        self.scaleOptions[5] = self.scale_high
+        self.options = (
+            self.limitOptions + self.optimizedOptions +
+            self.scaleOptions + self.fileOptions + [self.captureFile]
+        )
+
+    def on_solved(self) -> None:
+        """Reads the new capture.wcs once, to learn the pixel scale and to start tracking from it"""
+        try:
+            wcs = TanSipWcs.from_file(self.images_path / "capture.wcs")
+        except (OSError, KeyError) as ex:
+            logging.warning(f"Could not read the solution: {ex}")
+            self.track_reference = None
+            return
+        self.wcs = wcs
+        self.scale_estimator.record(wcs.pixel_scale() / self.binning)
+        self.tracked_frames = 0
+        self.set_track_reference(wcs)
+
+    def set_track_reference(self, wcs: TanSipWcs) -> None:
+        """Remembers the stars of the solved frame and their sky positions for tracking
+
+        Parameters:
+        wcs (TanSipWcs): The solution of the frame"""
+        positions = np.column_stack([self.stars["X"], self.stars["Y"]]).astype(np.float64)
+        ra, dec = wcs.xy2rd(positions[:, 0], positions[:, 1])
+        self.track_reference = (positions, ra, dec, wcs)
+        self.track_binning = self.binning
+
+    def solve_track(self, shape):
+        """Solves the frame by matching its stars with the previous solution instead of running solve-field.
+        The fitted WCS is written to capture.wcs.
+
+        Parameters:
+        shape (Tuple[int, int]): The shape of the frame
+
+        Returns:
+        CompletedProcess: A solve-field like result, None if the field could not be tracked"""
+        if self.tracked_frames >= self.max_tracked_frames:
+            return None
+        reference, reference_ra, reference_dec, reference_wcs = self.track_reference
+        positions = np.column_stack([self.stars["X"], self.stars["Y"]]).astype(np.float64)
+        shift = estimate_shift(reference[:50], positions[:50])
+        if shift is None:
+            logging.info("Tracking lost: no common shift")
+            return None
+        reference_index, new_index = match_stars(reference + shift, positions)
+        for tolerance in (2.0, 1.5):
+            if len(new_index) < self.min_track_matches:
+                break
+            # refine with rotation and scale, then match again
+            matrix, offset = fit_similarity(reference[reference_index], positions[new_index])
+            reference_index, new_index = match_stars(reference @ matrix.T + offset, positions, tolerance)
+        if len(new_index) < self.min_track_matches:
+            logging.info(f"Tracking lost: only {len(new_index)} stars matched")
+            return None
+        # the centre of the new frame as seen in the reference frame gives the new pointing
+        matrix, offset = fit_similarity(positions[new_index], reference[reference_index])
+        height, width = shape[:2]
+        centre = np.array([(width + 1) / 2, (height + 1) / 2])
+        crval = reference_wcs.xy2rd(*(centre @ matrix.T + offset))
+        wcs = TanSipWcs.fit(
+            positions[new_index, 0], positions[new_index, 1],
+            reference_ra[reference_index], reference_dec[reference_index],
+            (float(crval[0]), float(crval[1])), centre, width, height,
+        )
+        x, y = wcs.rd2xy(reference_ra[reference_index], reference_dec[reference_index])
+        rms = float(np.sqrt(np.mean((x - positions[new_index, 0]) ** 2 + (y - positions[new_index, 1]) ** 2)))
+        if rms > self.max_track_rms:
+            logging.info(f"Tracking lost: fit rms {rms:.2f} px")
+            return None
+        wcs.write(self.images_path / "capture.wcs")
+        self.wcs = wcs
+        self.set_track_reference(wcs)
+        self.tracked_frames += 1
+        return subprocess.CompletedProcess(
+            ["track"], 0, f"Field 1: solved by tracking {len(new_index)} stars, rms {rms:.2f} px\n", ""
+        )
+
+    def pick_strategies(self, have_hint: bool):
+        """Returns the strategies for the next race, the ones that won most often first
+
+        Parameters:
+        have_hint (bool): True if the hinted strategies can be used
+
+        Returns:
+        List[SolveStrategy]: At most race_size strategies"""
+        candidates = [s for s in self.strategies if have_hint or s.hint_radius is None]
+
+        def win_rate(strategy):
+            stats = self.race_stats.get(strategy.name, {"runs": 0, "wins": 0})
+            # a strategy that never ran gets the benefit of the doubt
+            return (stats["wins"] + 1) / (stats["runs"] + 2)
+
+        return sorted(candidates, key=win_rate, reverse=True)[: self.race_size]
+
+    def load_race_stats(self):
+        """Returns the per strategy win statistics of previous races"""
+        if not self.race_stats_file.exists():
+            return {}
+        try:
+            with open(self.race_stats_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as ex:
+            logging.warning(f"Ignoring unreadable {self.race_stats_file}: {ex}")
+            return {}
+
+    def record_race(self, strategies, winner, elapsed_time) -> None:
+        """Updates the win statistics, saves them when the ranking changed or after race_save_interval races"""
+        ranking = self.pick_strategies(True)
+        for strategy in strategies:
+            stats = self.race_stats.setdefault(strategy.name, {"runs": 0, "wins": 0, "win_time": 0.0})
+            stats["runs"] += 1
+            if strategy is winner:
+                stats["wins"] += 1
+                stats["win_time"] += elapsed_time
+        self.unsaved_races += 1
+        if self.pick_strategies(True) != ranking or self.unsaved_races >= self.race_save_interval:
+            self.save_race_stats()
+
+    def save_race_stats(self) -> None:
+        """Writes the win statistics of the races not saved yet to solve_stats.json"""
+        if self.unsaved_races == 0:
+            return
+        with open(self.race_stats_file, "w") as f:
+            json.dump(self.race_stats, f, indent=2)
+        self.unsaved_races = 0
+
+    def scale_options(self, margin):
+        """Returns the solve-field options for a pixel scale window
+
+        Parameters:
+        margin (float): The relative width of the window, 0.1 searches +-10% around the estimated scale
+
+        Returns:
+        List[str]: The solve-field options"""
+        scale = self.scale_estimator.estimate() * self.binning
+        return [
+            "--scale-units", "arcsecperpix",
+            "--scale-low", str(scale * (1 - margin)),
+            "--scale-high", str(scale * (1 + margin)),
+        ]
+
+    def hint_options(self, radec_hint, radius):
+        """Returns the solve-field options to only search around the given position
+
+        Parameters:
+        radec_hint (Tuple[float, float]): RA (hours) and Dec (degrees)
+        radius (float): Search radius in degrees
+
+        Returns:
+        List[str]: The solve-field options"""
+        ra, dec = radec_hint
+        return ["--ra", f"{ra * 15:.4f}", "--dec", f"{dec:.4f}", "--radius", str(radius)]
+
+    @staticmethod
+    def with_cpulimit(options, cpulimit):
+        """Returns a copy of the solve-field options with another --cpulimit
+
+        Parameters:
+        options (List[str]): The solve-field options, holding --cpulimit
+        cpulimit (int): The seconds solve-field may use
+
+        Returns:
+        List[str]: The solve-field options"""
+        options = list(options)
+        options[options.index("--cpulimit") + 1] = str(cpulimit)
+        return options
+
+    @staticmethod
+    def is_solved(result) -> bool:
+        """Returns True if the solve-field output reports a solution"""
+        return "solved" in str(result.stdout)
+
+    def solve_in_service(self, hint, cpulimit, width, height):
+        """Solves the extracted stars in the solver service, the solution is written to capture.wcs
+        like solve-field does
+
+        Parameters:
+        hint (Tuple[float, float, float]): RA, Dec and search radius in degrees, None for a blind solve
+        cpulimit (int): The seconds the service may use
+        width (int): The width of the frame in pixels
+        height (int): The height of the frame in pixels
+
+        Returns:
+        CompletedProcess: A solve-field like result, None when the service could not solve"""
+        job = self.current_job
+        try:
+            if job is not None:
+                job.set_cancel_hook(lambda: self.service.cancel(job.id))
+            solution, _ = self.service.solve(
+                np.column_stack([self.stars["X"], self.stars["Y"]]),
+                (float(self.scale_low), float(self.scale_high)), hint, cpulimit, job.id if job is not None else None,
+            )
+        except RuntimeError as ex:
+            logging.error(f"Solver service unavailable, solving locally: {ex}")
+            return None
+        finally:
+            if job is not None:
+                job.set_cancel_hook(None)
+        # a cancelled job was killed in the service, that is not a failed solve
+        self._check_cancelled()
+        if solution is None:
+            return subprocess.CompletedProcess(["solver-service"], 0, "Field 1 did not solve\n", "")
+        write_wcs(solution["header"], self.images_path / "capture.wcs", width, height)
+        return subprocess.CompletedProcess(
+            ["solver-service"], 0,
+            f"Field 1: solved with index {solution['index']}, log-odds {solution['log_odds']:.1f}\n", "",
+        )
+
+    def _run_solve_field(self, args):
+        """Runs solve-field. A cancelled job kills it, its temp files are removed and SolveCancelled
+        is raised"""
+        job = self.current_job
+        temp_path = self.temp_path / (job.id if job is not None else "solve")
+        os.makedirs(temp_path, exist_ok=True)
+        args = ["--temp-dir", temp_path] + args
+        try:
+            process = subprocess.Popen(
+                self.cmd + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True
+            )
+            if job is not None:
+                job.set_cancel_hook(lambda: self._kill(process))
+            stdout, stderr = process.communicate()
+            return self._checked(subprocess.CompletedProcess(self.cmd + args, process.returncode, stdout, stderr))
+        finally:
+            if job is not None:
+                job.set_cancel_hook(None)
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def _checked(self, result):
+        """Returns the result, unless the job was cancelled while solve-field ran"""
+        self._check_cancelled()
+        return result
+
+    @staticmethod
+    def _kill(process) -> None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
@@ -98,13 +98,30 @@ class qhyccd():
             self.imgdata = (ctypes.c_uint8 * roi_w * roi_h)()
             self.sdk.SetQHYCCDResolution(self.cam, x0, y0, self.roi_w, self.roi_h)
 
+    """ Set camera binning, the ROI becomes the whole sensor at that binning """
+    def SetBin(self, wbin, hbin):
+        self.sdk.SetQHYCCDBinMode(self.cam, wbin, hbin)
+        self.SetROI(0, 0, self.w.value // wbin, self.h.value // hbin)
+
+    """ Current sensor temperature in degrees C """
+    def GetTemperature(self):
+        return self.sdk.GetQHYCCDParam(self.cam, CONTROL_ID.CONTROL_CURTEMP)
+
     """ Exposure and return single frame """
     def GetSingleFrame(self):
-        ret = self.sdk.ExpQHYCCDSingleFrame(self.cam)
-        ret = self.sdk.GetQHYCCDSingleFrame(
+        ret = self.ExpSingleFrame()
+        ret = self.ReadSingleFrame()
+        return np.asarray(self.imgdata) #.reshape([self.roi_h.value, self.roi_w.value])
+
+    """ Start the exposure of a single frame, return the SDK result (0 is success) """
+    def ExpSingleFrame(self):
+        return self.sdk.ExpQHYCCDSingleFrame(self.cam)
+
+    """ Wait for the exposed frame and read it into imgdata, return the SDK result (0 is success) """
+    def ReadSingleFrame(self):
+        return self.sdk.GetQHYCCDSingleFrame(
             self.cam, byref(self.roi_w), byref(self.roi_h), byref(self.bpp),
             byref(self.channels), self.imgdata)
-        return np.asarray(self.imgdata) #.reshape([self.roi_h.value, self.roi_w.value])
    
 
     def BeginLive(self):
@@ -118,6 +135,13 @@ class qhyccd():
                 byref(self.bpp), byref(self.channels), self.imgdata)
         return np.asarray(self.imgdata)
 
+    def GetLiveFrameInto(self, buffer):
+        """ Copy the next live image into a preallocated buffer, return True if a frame was ready """
+        data = (ctypes.c_uint8 * len(buffer)).from_buffer(buffer)
+        ret = self.sdk.GetQHYCCDLiveFrame(self.cam, byref(self.roi_w), byref(self.roi_h),
+                byref(self.bpp), byref(self.channels), data)
+        return ret == 0
+
     def StopLive(self):
         """ Stop live mode, change to single frame """
         self.sdk.StopQHYCCDLive(self.cam)
@@ -0,0 +1,133 @@
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import json
+import logging
+import numpy as np
+
+
+class ScaleEstimator:
+    """Learns the pixel scale from the solved frames and narrows the solve-field scale window once it is stable"""
+
+    def __init__(
+        self,
+        store_file: Path,
+        default_scale: float,
+        camera: str = "default",
+        history: int = 20,
+        min_solves: int = 5,
+        wide_margin: float = 0.1,
+        narrow_margin: float = 0.02,
+        max_failures: int = 3,
+        tolerance: float = 0.002,
+    ) -> None:
+        """Initializes the estimator
+
+        Parameters:
+        store_file (Path): The json file the measured scales are kept in between sessions
+        default_scale (float): The nominal pixel scale (arcsec per unbinned pixel) to use until enough solves are measured
+        camera (str): The camera type the measurements belong to
+        history (int): Number of recent measurements used for the estimate
+        min_solves (int): Number of measurements needed before the window is narrowed
+        wide_margin (float): The relative width of the window while learning, 0.1 is +-10%
+        narrow_margin (float): The smallest relative width of the window
+        max_failures (int): Consecutive failed solves after which the window is widened again
+        tolerance (float): The store file is written when the estimate or the window moves by more than this (relative)"""
+        self.store_file = store_file
+        self.default_scale = default_scale
+        self.camera = camera
+        self.binning = 1
+        self.history = history
+        self.min_solves = min_solves
+        self.wide_margin = wide_margin
+        self.narrow_margin = narrow_margin
+        self.max_failures = max_failures
+        self.tolerance = tolerance
+        self.store = self._load()
+        # the estimate and margin of every profile as last written to the store file
+        self.saved: Dict[str, Tuple[float, float]] = {}
+
+    @property
+    def profile(self) -> str:
+        """The key of the measurements: the camera, its binning and the nominal scale, which
+        changes with the lens"""
+        return f"{self.camera} bin{self.binning} {self.default_scale:g}"
+
+    def _load(self) -> Dict:
+        if not self.store_file.exists():
+            return {}
+        try:
+            with open(self.store_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as ex:
+            logging.warning(f"Ignoring unreadable {self.store_file}: {ex}")
+            return {}
+
+    def _save(self) -> None:
+        # the measurements are kept in memory, the file only follows when the window would change
+        state = self._state(self._entry())
+        saved = self.saved[self.profile]
+        if saved != state and (
+            abs(state[0] - saved[0]) > self.tolerance * saved[0] or abs(state[1] - saved[1]) > self.tolerance
+        ):
+            self.saved[self.profile] = state
+            with open(self.store_file, "w") as f:
+                json.dump(self.store, f, indent=2)
+
+    def _entry(self) -> Dict:
+        entry = self.store.setdefault(self.profile, {"scales": [], "failures": 0})
+        if self.profile not in self.saved:
+            # as read from the store file
+            self.saved[self.profile] = self._state(entry)
+        return entry
+
+    def _state(self, entry: Dict) -> Tuple[float, float]:
+        # the estimate and the margin from the measurements of a profile
+        scales = np.array(entry["scales"])
+        if len(scales) == 0:
+            return self.default_scale, self.wide_margin
+        median = float(np.median(scales))
+        if len(scales) < self.min_solves or entry["failures"] >= self.max_failures:
+            return median, self.wide_margin
+        spread = 1.4826 * np.median(np.abs(scales - median)) / median
+        # keep a few sigma of measured spread, never tighter than narrow_margin
+        return median, float(np.clip(5 * spread, self.narrow_margin, self.wide_margin))
+
+    def set_profile(self, camera: str, binning: Optional[int] = None) -> None:
+        """Switch to the measurements of another camera
+
+        Parameters:
+        camera (str): The camera type
+        binning (int): The on sensor binning, unchanged if not given"""
+        self.camera = camera
+        if binning is not None:
+            self.set_binning(binning)
+
+    def set_binning(self, binning: int) -> None:
+        """Switch to the measurements of frames binned on the sensor, the scales stay per unbinned pixel
+
+        Parameters:
+        binning (int): The binning factor"""
+        self.binning = binning
+
+    def record(self, scale: float) -> None:
+        """Adds the scale measured on a solved frame
+
+        Parameters:
+        scale (float): The measured pixel scale in arcsec per unbinned pixel"""
+        entry = self._entry()
+        entry["scales"] = (entry["scales"] + [scale])[-self.history :]
+        entry["failures"] = 0
+        self._save()
+
+    def record_failure(self) -> None:
+        """Counts a failed solve, repeated failures widen the window again"""
+        self._entry()["failures"] += 1
+        self._save()
+
+    def estimate(self) -> float:
+        """Returns the best estimate of the pixel scale in arcsec per unbinned pixel"""
+        return self._state(self._entry())[0]
+
+    def margin(self) -> float:
+        """Returns the relative half width of the scale window to search"""
+        return self._state(self._entry())[1]
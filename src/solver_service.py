@@ -0,0 +1,466 @@
+#!/usr/bin/python3
+
+# Long running plate solve service for the eFinder.
+# Every solve-field run is a new process that reads its config and loads all index files again
+# before it starts matching, more than a second on a Pi. The service loads the index files once,
+# into a resident astrometry.net engine (the astrometry Python package), and solves the star lists
+# it is sent over a local unix socket against them. Each job runs in a child process forked from
+# the service: the child shares the loaded indexes, and a job that is cancelled or runs out of time
+# is killed without losing them.
+
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import fitsio
+import numpy as np
+
+AUTHKEY = b"efinder-solver"
+DEFAULT_INDEX_PATH = Path("/usr/local/astrometry/data")
+
+
+class AstrometryEngine:
+    """The astrometry.net solver of the astrometry package, with the index files loaded"""
+
+    def __init__(self, index_files: List[Path]) -> None:
+        """Loads the index files, takes a while for a full set
+
+        Parameters:
+        index_files (List[Path]): The astrometry index files"""
+        import astrometry
+
+        self.astrometry = astrometry
+        self.solver = astrometry.Solver(index_files)
+
+    def solve(self, stars: np.ndarray, scale: Tuple[float, float], hint=None) -> Optional[Dict]:
+        """Solves a star list
+
+        Parameters:
+        stars (np.ndarray): The x, y pixel positions of the stars, brightest first
+        scale (Tuple[float, float]): The lowest and highest pixel scale in arcsec per pixel
+        hint (Tuple[float, float, float]): RA, Dec and search radius in degrees, None for a blind solve
+
+        Returns:
+        Dict: The WCS header, log-odds and index file of the best match, None when not solved"""
+        size_hint = self.astrometry.SizeHint(lower_arcsec_per_pixel=scale[0], upper_arcsec_per_pixel=scale[1])
+        position_hint = None
+        if hint is not None:
+            position_hint = self.astrometry.PositionHint(ra_deg=hint[0], dec_deg=hint[1], radius_deg=hint[2])
+        solution = self.solver.solve(
+            stars=stars.tolist(),
+            size_hint=size_hint,
+            position_hint=position_hint,
+            solution_parameters=self.astrometry.SolutionParameters(),
+        )
+        if not solution.has_match():
+            return None
+        match = solution.best_match()
+        return {
+            "header": {key: value for key, (value, comment) in match.wcs_fields.items()},
+            "log_odds": match.logodds,
+            "index": match.index_path.name,
+        }
+
+
+def check_message(message) -> Optional[str]:
+    """Returns what is wrong with a message sent to the service, None when it can be handled
+
+    Parameters:
+    message: The message as received
+
+    Returns:
+    str: The problem, None if the message is valid"""
+    if not isinstance(message, dict):
+        return "not a message"
+    kind = message.get("type")
+    if kind in ("ping", "shutdown"):
+        return None
+    if kind == "cancel":
+        return None if isinstance(message.get("job"), str) else "cancel without a job id"
+    if kind != "solve":
+        return f"unknown message type {kind!r}"
+    try:
+        stars = np.asarray(message.get("stars"), dtype=np.float64)
+        scale = [float(value) for value in message.get("scale")]
+        cpulimit = float(message.get("cpulimit", 0))
+        hint = message.get("hint")
+        hint = None if hint is None else [float(value) for value in hint]
+    except (TypeError, ValueError):
+        return "stars, scale, hint and cpulimit must be numbers"
+    if stars.ndim != 2 or stars.shape[1] != 2 or not np.all(np.isfinite(stars)):
+        return "stars must be a list of x, y positions"
+    if len(scale) != 2 or not 0 < scale[0] <= scale[1]:
+        return "scale must be a lowest and a highest pixel scale"
+    if hint is not None and (len(hint) != 3 or not -90 <= hint[1] <= 90 or not hint[2] > 0):
+        return "hint must be RA, Dec and a search radius"
+    if not math.isfinite(cpulimit) or cpulimit <= 0:
+        return "cpulimit must be a positive number of seconds"
+    if message.get("job") is not None and not isinstance(message["job"], str):
+        return "the job id must be a string"
+    return None
+
+
+def write_wcs(header: Dict, wcs_file: Path, width: int = 0, height: int = 0) -> None:
+    """Writes a WCS header to a FITS file, like the capture.wcs of solve-field
+
+    Parameters:
+    header (Dict): The WCS keywords and their values
+    wcs_file (Path): The file to write
+    width (int): The width of the frame, written as IMAGEW when the header has none
+    height (int): The height of the frame, written as IMAGEH when the header has none"""
+    header = dict(header)
+    if width and height:
+        header.setdefault("IMAGEW", width)
+        header.setdefault("IMAGEH", height)
+    with fitsio.FITS(str(wcs_file), "rw", clobber=True) as fits:
+        fits.write(None, header=[{"name": key, "value": value} for key, value in header.items()])
+
+
+class SolverServer:
+    """The server side of the solver service, runs in its own process"""
+
+    def __init__(
+        self, socket_path: Path, index_path: Path = DEFAULT_INDEX_PATH, engine_factory: Optional[Callable] = None
+    ) -> None:
+        """Initializes the solver server
+
+        Parameters:
+        socket_path (Path): The unix socket to listen on
+        index_path (Path): The directory holding the astrometry index files
+        engine_factory (Callable[[List[Path]], object]): Builds the engine from the index files,
+            AstrometryEngine by default"""
+        self.socket_path = socket_path
+        self.index_path = index_path
+        self.engine_factory = engine_factory or AstrometryEngine
+        self.engine = None
+        # loading, ready or why the engine could not be loaded
+        self.engine_state = "loading"
+        self.jobs_done = 0
+        # the children solving a job, by job id, so they can be cancelled
+        self.running: Dict[str, multiprocessing.Process] = {}
+        self.lock = threading.Lock()
+        self.context = multiprocessing.get_context("fork")
+
+    def load_engine(self) -> None:
+        """Loads the index files into the engine, the engine is kept for the lifetime of the server"""
+        start_time = time.time()
+        try:
+            index_files = sorted(self.index_path.glob("*.fits"))
+            if not index_files:
+                raise FileNotFoundError(f"no index files in {self.index_path}")
+            self.engine = self.engine_factory(index_files)
+        except Exception as ex:
+            logging.error(f"Solver engine could not be loaded: {ex}")
+            self.engine_state = f"failed: {ex}"
+            return
+        self.engine_state = "ready"
+        logging.info(f"Loaded {len(index_files)} index files in {time.time() - start_time:.2f} s")
+
+    def serve_forever(self) -> None:
+        """Accept connections until a shutdown message is received"""
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        with Listener(str(self.socket_path), family="AF_UNIX", authkey=AUTHKEY) as listener:
+            logging.info(f"Solver service listening on {self.socket_path}")
+            # loading a full index set takes a while on a Pi, pings are answered meanwhile
+            loader = threading.Thread(target=self.load_engine, name="engine-load")
+            loader.daemon = True
+            loader.start()
+            while True:
+                conn = listener.accept()
+                handler = threading.Thread(target=self._handle, args=(conn,))
+                handler.daemon = True
+                handler.start()
+
+    def _handle(self, conn) -> None:
+        with conn:
+            try:
+                message = conn.recv()
+            except Exception as ex:
+                # a closed connection or a message that can not be unpickled
+                logging.warning(f"Solver service could not read a message: {ex}")
+                return
+            problem = check_message(message)
+            if problem is not None:
+                logging.warning(f"Solver service rejected a message: {problem}")
+                conn.send({"type": "error", "error": problem})
+            elif message["type"] == "ping":
+                conn.send({"type": "pong", "pid": os.getpid(), "jobs": self.jobs_done, "engine": self.engine_state})
+            elif message["type"] == "solve":
+                conn.send(self._solve(message))
+            elif message["type"] == "cancel":
+                conn.send({"type": "cancelled", "found": self._cancel(message["job"])})
+            elif message["type"] == "shutdown":
+                conn.send({"type": "bye"})
+                self.socket_path.unlink()
+                os._exit(0)
+
+    def _solve(self, message: Dict) -> Dict:
+        if self.engine is None:
+            return {"type": "unavailable", "engine": self.engine_state}
+        start_time = time.time()
+        stars = np.asarray(message["stars"], dtype=np.float64)
+        hint = message.get("hint")
+        job = message.get("job")
+        receiver, sender = self.context.Pipe(duplex=False)
+        worker = self.context.Process(
+            target=self._solve_job, args=(sender, stars, tuple(message["scale"]), hint), daemon=True
+        )
+        worker.start()
+        sender.close()
+        if job is not None:
+            with self.lock:
+                self.running[job] = worker
+        try:
+            if receiver.poll(float(message["cpulimit"])):
+                status, solution = receiver.recv()
+            else:
+                status, solution = "timeout", None
+        except EOFError:
+            # the child was killed by a cancel, or crashed
+            status, solution = "killed", None
+        finally:
+            if job is not None:
+                with self.lock:
+                    self.running.pop(job, None)
+            worker.kill()
+            worker.join()
+            receiver.close()
+        self.jobs_done += 1
+        if status == "error":
+            logging.error(f"Solver engine failed: {solution}")
+            solution = None
+        return {"type": "result", "status": status, "solution": solution, "elapsed": time.time() - start_time}
+
+    def _solve_job(self, sender, stars: np.ndarray, scale: Tuple[float, float], hint) -> None:
+        # runs in the forked child, with the engine of the parent
+        try:
+            solution = self.engine.solve(stars, scale, hint)
+            sender.send(("solved" if solution is not None else "unsolved", solution))
+        except Exception as ex:
+            sender.send(("error", repr(ex)))
+        finally:
+            sender.close()
+
+    def _cancel(self, job: str) -> bool:
+        with self.lock:
+            worker = self.running.get(job)
+        if worker is None:
+            return False
+        worker.kill()
+        return True
+
+
+class SolverClient:
+    """Starts, watches and talks to the solver service"""
+
+    def __init__(
+        self,
+        socket_path: Path,
+        index_path: Path = DEFAULT_INDEX_PATH,
+        start_timeout: float = 30,
+        health_interval: float = 10,
+        retry_interval: float = 60,
+    ) -> None:
+        """Initializes the solver client, the service is started on first use
+
+        Parameters:
+        socket_path (Path): The unix socket the service listens on
+        index_path (Path): The directory holding the astrometry index files
+        start_timeout (float): Seconds to wait for a (re)started service to answer
+        health_interval (float): Seconds between two health checks of the watchdog
+        retry_interval (float): Seconds before a service that failed to start is tried again,
+            doubled after every failure up to ten times this"""
+        self.socket_path = socket_path
+        self.index_path = index_path
+        self.start_timeout = start_timeout
+        self.health_interval = health_interval
+        self.retry_interval = retry_interval
+        self.backoff = retry_interval
+        self.retry_after = 0.0
+        self.process = None
+        # set once the service answered a ping, solves do not ping it again
+        self.connected = False
+        self.lock = threading.Lock()
+        self.watchdog = None
+
+    def _request(self, message: Dict, timeout: float = None) -> Dict:
+        with Client(str(self.socket_path), family="AF_UNIX", authkey=AUTHKEY) as conn:
+            conn.send(message)
+            if timeout is not None and not conn.poll(timeout):
+                raise TimeoutError(f"solver service did not answer within {timeout} s")
+            return conn.recv()
+
+    def is_healthy(self, timeout: float = 2) -> bool:
+        """Checks if the service answers a ping
+
+        Parameters:
+        timeout (float): Seconds to wait for the answer
+
+        Returns:
+        bool: True if the service answered"""
+        if self.process is not None and self.process.poll() is not None:
+            return False
+        try:
+            return self._request({"type": "ping"}, timeout)["type"] == "pong"
+        except (OSError, EOFError, TimeoutError):
+            return False
+
+    def start(self) -> None:
+        """Starts the service process and waits until it answers, after a failed start the
+        service is not started again for a while, raises RuntimeError meanwhile"""
+        if time.time() < self.retry_after:
+            raise RuntimeError(f"solver service failed to start, next try in {self.retry_after - time.time():.0f} s")
+        self.stop()
+        logging.info("Starting solver service")
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                str(Path(__file__).resolve()),
+                "--socket",
+                str(self.socket_path),
+                "--index-path",
+                str(self.index_path),
+            ],
+            start_new_session=True,
+        )
+        deadline = time.time() + self.start_timeout
+        while time.time() < deadline:
+            if self.is_healthy(timeout=1):
+                self.backoff = self.retry_interval
+                self.connected = True
+                self._start_watchdog()
+                return
+            time.sleep(0.1)
+        self._back_off()
+        raise RuntimeError("solver service did not start")
+
+    def _back_off(self) -> None:
+        self.stop()
+        self.retry_after = time.time() + self.backoff
+        self.backoff = min(2 * self.backoff, 10 * self.retry_interval)
+
+    def ensure_running(self) -> None:
+        """Connects to the service, (re)starts it when it does not answer"""
+        with self.lock:
+            if self.is_healthy():
+                self.connected = True
+            else:
+                self.connected = False
+                self.start()
+
+    def _start_watchdog(self) -> None:
+        if self.watchdog is not None and self.watchdog.is_alive():
+            return
+        self.watchdog = threading.Thread(target=self._watch)
+        self.watchdog.daemon = True
+        self.watchdog.start()
+
+    def _watch(self) -> None:
+        # ends with stop(), also after a failed start: the next solve tries again once the back off is over
+        while self.process is not None:
+            time.sleep(self.health_interval)
+            try:
+                self.ensure_running()
+            except RuntimeError as ex:
+                logging.error(f"Solver service restart failed: {ex}")
+
+    def solve(self, stars, scale: Tuple[float, float], hint=None, cpulimit: float = 10, job: Optional[str] = None):
+        """Solves a star list in the service, raises RuntimeError when the service can not solve it
+
+        Parameters:
+        stars (np.ndarray): The x, y pixel positions of the stars (FITS convention), brightest first
+        scale (Tuple[float, float]): The lowest and highest pixel scale in arcsec per pixel
+        hint (Tuple[float, float, float]): RA, Dec and search radius in degrees, None for a blind solve
+        cpulimit (float): Seconds after which the job is given up
+        job (str): Optional id under which the solve can be cancelled
+
+        Returns:
+        Tuple[Dict, float]: The solution (WCS header, log-odds and index file), None when not solved,
+            and the elapsed time"""
+        if not self.connected:
+            self.ensure_running()
+        message = {
+            "type": "solve",
+            "stars": np.asarray(stars, dtype=np.float64)[:, :2].tolist(),
+            "scale": [float(scale[0]), float(scale[1])],
+            "hint": None if hint is None else [float(value) for value in hint],
+            "cpulimit": float(cpulimit),
+            "job": job,
+        }
+        try:
+            reply = self._request(message)
+        except (OSError, EOFError):
+            logging.warning("Solver service connection lost, restarting")
+            self.connected = False
+            with self.lock:
+                self.start()
+            reply = self._request(message)
+        if reply["type"] == "unavailable":
+            if reply["engine"] != "loading":
+                # no index files or a broken engine, starting it again later may help
+                with self.lock:
+                    self._back_off()
+            raise RuntimeError(f"solver engine {reply['engine']}")
+        if reply["type"] != "result":
+            raise RuntimeError(f"solver service refused the job: {reply.get('error')}")
+        if reply["status"] == "timeout":
+            logging.info(f"Solver service gave up after {cpulimit} s")
+        return reply["solution"], reply["elapsed"]
+
+    def cancel(self, job: str) -> bool:
+        """Kills the child solving a job, its solve call returns without a solution
+
+        Parameters:
+        job (str): The id the solve was started with
+
+        Returns:
+        bool: True if the job was running"""
+        try:
+            return self._request({"type": "cancel", "job": job}, timeout=2)["found"]
+        except (OSError, EOFError, TimeoutError):
+            return False
+
+    def stop(self) -> None:
+        """Stops the service process if it is running"""
+        process, self.process = self.process, None
+        self.connected = False
+        if process is None or process.poll() is not None:
+            return
+        try:
+            self._request({"type": "shutdown"}, timeout=2)
+        except (OSError, EOFError, TimeoutError):
+            pass
+        try:
+            process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s: %(levelname)s %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="eFinder solver service")
+    parser.add_argument(
+        "--socket",
+        help="The unix socket to listen on",
+        default="/dev/shm/images/solver.sock",
+        required=False,
+    )
+    parser.add_argument(
+        "--index-path",
+        help="The directory holding the astrometry index files",
+        default=str(DEFAULT_INDEX_PATH),
+        required=False,
+    )
+    args = parser.parse_args()
+    SolverServer(Path(args.socket), Path(args.index_path)).serve_forever()
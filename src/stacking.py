@@ -0,0 +1,185 @@
+from typing import Callable, Dict, Optional, Tuple
+import logging
+import time
+import numpy as np
+from CameraInterface import CameraInterface, CameraFrame
+
+
+def phase_correlation_peak(correlation: np.ndarray) -> Tuple[float, float]:
+    """Returns the position of the correlation peak with sub pixel precision, as a signed (dy, dx) shift
+
+    Parameters:
+    correlation (np.ndarray): The (real) inverse transform of the normalised cross power spectrum
+
+    Returns:
+    Tuple[float, float]: The shift in the rows and the columns"""
+    h, w = correlation.shape
+    y, x = np.unravel_index(int(np.argmax(correlation)), correlation.shape)
+    shift = []
+    for position, size, before, peak, after in (
+        (y, h, correlation[(y - 1) % h, x], correlation[y, x], correlation[(y + 1) % h, x]),
+        (x, w, correlation[y, (x - 1) % w], correlation[y, x], correlation[y, (x + 1) % w]),
+    ):
+        # a parabola through the peak and its neighbours
+        denominator = before - 2 * peak + after
+        offset = 0.5 * (before - after) / denominator if denominator != 0 else 0.0
+        position = position + offset
+        shift.append(position - size if position > size / 2 else position)
+    return shift[0], shift[1]
+
+
+class FrameStacker:
+    """Registers short exposures on the first one and adds them up, so a stack of N frames shows
+    the faint stars of an N times longer exposure without its trailing. The frames are aligned by
+    phase correlation of a binned copy, the sums go into preallocated buffers."""
+
+    def __init__(self, shape: Tuple[int, int], dtype: np.dtype, register_binning: int = 2, max_shift: float = 0.25) -> None:
+        """Initializes the stacker for frames of one size
+
+        Parameters:
+        shape (Tuple[int, int]): The height and width of the frames
+        dtype (np.dtype): The dtype of the frames, the stack has the same
+        register_binning (int): The frames are binned this much to measure the shift, faster and less noisy
+        max_shift (float): Frames shifted more than this fraction of the frame are skipped"""
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.register_binning = register_binning
+        self.max_shift = max_shift
+        self.full_scale = float(np.iinfo(self.dtype).max) if self.dtype.kind in "ui" else 1.0
+        self.sum = np.zeros(shape, dtype=np.float32)
+        self.coverage = np.zeros(shape, dtype=np.float32)
+        self.work = np.zeros(shape, dtype=np.float32)
+        self.output = np.zeros(shape, dtype=self.dtype)
+        self.reference = None
+        self.count = 0
+
+    def reset(self) -> None:
+        """Starts a new stack"""
+        self.sum.fill(0)
+        self.coverage.fill(0)
+        self.reference = None
+        self.count = 0
+
+    def _spectrum(self, data: np.ndarray) -> np.ndarray:
+        b = self.register_binning
+        h, w = (self.shape[0] // b) * b, (self.shape[1] // b) * b
+        small = data[:h, :w].reshape(h // b, b, w // b, b).mean(axis=(1, 3), dtype=np.float32)
+        # only the stars: the noise of the background would correlate with nothing and bury the peak
+        sample = small[::4, ::4]
+        background = float(np.median(sample))
+        sigma = 1.4826 * float(np.median(np.abs(sample - background)))
+        small -= background + 3 * max(sigma, 0.5)
+        np.maximum(small, 0, out=small)
+        return np.fft.rfft2(small)
+
+    def shift(self, data: np.ndarray) -> Tuple[int, int]:
+        """Measures how far the frame moved against the first frame of the stack
+
+        Parameters:
+        data (np.ndarray): The frame
+
+        Returns:
+        Tuple[int, int]: The shift (dy, dx) in pixels that aligns the frame on the first one"""
+        spectrum = self._spectrum(data)
+        cross = self.reference * np.conj(spectrum)
+        cross /= np.maximum(np.abs(cross), 1e-12)
+        size = (self.shape[0] // self.register_binning, self.shape[1] // self.register_binning)
+        dy, dx = phase_correlation_peak(np.fft.irfft2(cross, s=size))
+        return int(round(dy * self.register_binning)), int(round(dx * self.register_binning))
+
+    def add(self, data: np.ndarray) -> bool:
+        """Aligns the frame and adds it to the stack
+
+        Parameters:
+        data (np.ndarray): The frame, not kept
+
+        Returns:
+        bool: False if the frame moved too far and was skipped"""
+        if self.reference is None:
+            self.reference = self._spectrum(data)
+            dy = dx = 0
+        else:
+            dy, dx = self.shift(data)
+            if abs(dy) > self.max_shift * self.shape[0] or abs(dx) > self.max_shift * self.shape[1]:
+                logging.info(f"Stacking: skipped a frame shifted {dx}, {dy} px")
+                return False
+        h, w = self.shape
+        # frame pixel (y, x) lands on stack pixel (y + dy, x + dx), only the overlap is added
+        target = (slice(max(dy, 0), h + min(dy, 0)), slice(max(dx, 0), w + min(dx, 0)))
+        source = (slice(max(-dy, 0), h + min(-dy, 0)), slice(max(-dx, 0), w + min(-dx, 0)))
+        self.sum[target] += data[source]
+        self.coverage[target] += 1
+        self.count += 1
+        return True
+
+    def result(self) -> np.ndarray:
+        """Returns the stack in the dtype of the frames: the background is kept at the level of one
+        frame while the stars add up, so faint stars rise above the noise. The array is reused by
+        the next stack.
+
+        Returns:
+        np.ndarray: The stacked frame"""
+        # scale the partly covered edges to the full count, then take off the extra backgrounds
+        np.maximum(self.coverage, 1, out=self.work)
+        stack = np.divide(self.sum, self.work, out=self.work)
+        stack *= self.count
+        background = float(np.median(stack[::4, ::4]))
+        stack -= background * (self.count - 1) / max(self.count, 1)
+        np.clip(stack, 0, self.full_scale, out=stack)
+        self.output[:] = stack
+        return self.output
+
+
+def capture_stack(
+    camera: CameraInterface,
+    exposure_time: float,
+    gain: float,
+    radec: str,
+    extras: Dict,
+    count: int,
+    stackers: Dict[Tuple, FrameStacker],
+    prepare: Optional[Callable[[CameraFrame], object]] = None,
+) -> CameraFrame:
+    """Captures count short frames and returns their stack
+
+    Parameters:
+    camera (CameraInterface): The camera
+    exposure_time (float): The exposure time of each frame in microseconds
+    gain (float): The gain
+    radec (str): The Ra and Dec, used to name the still
+    extras (Dict): Passed to the camera, "still": False to not archive the stack
+    count (int): The number of frames
+    stackers (Dict[Tuple, FrameStacker]): The stackers by frame shape and dtype, reused between calls
+    prepare (Callable[[CameraFrame], object]): Called on every frame before it is added, like the calibration
+
+    Returns:
+    CameraFrame: The stack, exposure is the exposure of one frame and metadata["stacked"] the number of frames"""
+    start_time = time.time()
+    frame_extras = dict(extras, still=False, fresh=True)
+    first = None
+    stacker = None
+    for _ in range(count):
+        frame = camera.capture_array(exposure_time, gain, radec, frame_extras)
+        if frame is None:
+            continue
+        if prepare is not None:
+            prepare(frame)
+        if stacker is None:
+            key = (frame.data.shape, frame.data.dtype.str)
+            if key not in stackers:
+                stackers[key] = FrameStacker(frame.data.shape, frame.data.dtype)
+            stacker = stackers[key]
+            stacker.reset()
+            first = frame
+        stacker.add(frame.data)
+    if first is None:
+        return None
+    stacked = CameraFrame(
+        stacker.result().copy(), first.exposure, first.gain, first.timestamp, first.sensor_size,
+        dict(first.metadata, stacked=stacker.count), first.binning,
+    )
+    logging.info(f"Stacked {stacker.count} of {count} frames in {time.time() - start_time:.2f} s")
+    archiver = getattr(camera, "archiver", None) or getattr(getattr(camera, "camera", None), "archiver", None)
+    if archiver is not None and extras.get("still", True):
+        archiver.submit(stacked, f"{time.strftime('%Y%m%d-%H%M%S')}_{radec}_stack{stacker.count}")
+    return stacked
@@ -0,0 +1,191 @@
+from pathlib import Path
+import logging
+import numpy as np
+from numpy.lib import recfunctions
+import fitsio
+
+STAR_DTYPE = [
+    ("X", "f4"),
+    ("Y", "f4"),
+    ("FLUX", "f4"),
+    ("BACKGROUND", "f4"),
+    ("PEAK", "f4"),
+    ("NPIX", "i4"),
+]
+
+
+class StarExtractor:
+    """Finds the stars in a frame, a NumPy replacement for the image2xy step of solve-field"""
+
+    def __init__(
+        self,
+        sigma: float = 5.0,
+        downsample: int = 2,
+        tile: int = 32,
+        min_pixels: int = 2,
+        max_pixels: int = 400,
+        max_stars: int = 300,
+    ) -> None:
+        """Initializes the extractor
+
+        Parameters:
+        sigma (float): Detection threshold in times the background noise
+        downsample (int): Bin the frame by this factor before detection, like solve-field --downsample
+        tile (int): Size of the tiles (in binned pixels) used to estimate the background
+        min_pixels (int): Blobs with fewer pixels are rejected as noise or hot pixels
+        max_pixels (int): Blobs with more pixels are rejected as not being a star
+        max_stars (int): Only the brightest stars are kept"""
+        self.sigma = sigma
+        self.downsample = downsample
+        self.tile = tile
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.max_stars = max_stars
+        self.background_level = 0.0
+        self.noise = 0.0
+
+    def extract(self, image: np.ndarray, downsample: int = None) -> np.ndarray:
+        """Finds the stars in the image
+
+        Parameters:
+        image (np.ndarray): The frame, 2D (mono) or 3D (colour)
+        downsample (int): Overrides the downsample factor for this frame, for frames binned on the sensor
+
+        Returns:
+        np.ndarray: The stars (STAR_DTYPE) sorted on flux, brightest first.
+            X and Y are FITS pixel coordinates (1-indexed) of the frame as given"""
+        d = self.downsample if downsample is None else downsample
+        data = self._prepare(image, d)
+        background = self._background(data)
+        residual = data - background
+        # median absolute deviation of a subsample is a robust noise estimate
+        sample = residual[::4, ::4]
+        self.noise = float(1.4826 * np.median(np.abs(sample - np.median(sample)))) or 1.0
+        self.background_level = float(np.median(background))
+
+        mask = residual > self.sigma * self.noise
+        run_rows, run_starts, run_ends = self._runs(mask)
+        if len(run_rows) == 0:
+            return np.zeros(0, dtype=STAR_DTYPE)
+        labels = self._label_runs(run_rows, run_starts, run_ends)
+        stars = self._measure(residual, background, run_rows, run_starts, run_ends, labels)
+        keep = (stars["NPIX"] >= self.min_pixels) & (stars["NPIX"] <= self.max_pixels)
+        stars = stars[keep]
+        stars = stars[np.argsort(-stars["FLUX"])][: self.max_stars]
+        # back to full resolution FITS coordinates
+        stars["X"] = (stars["X"] + 0.5) * d + 0.5
+        stars["Y"] = (stars["Y"] + 0.5) * d + 0.5
+        logging.debug(
+            f"Extracted {len(stars)} stars, background {self.background_level:.1f} noise {self.noise:.2f}"
+        )
+        return stars
+
+    def _prepare(self, image: np.ndarray, d: int) -> np.ndarray:
+        data = np.asarray(image, dtype=np.float32)
+        if data.ndim == 3:
+            data = data.mean(axis=2)
+        if d > 1:
+            h, w = (data.shape[0] // d) * d, (data.shape[1] // d) * d
+            data = data[:h, :w].reshape(h // d, d, w // d, d).mean(axis=(1, 3))
+        return data
+
+    def _background(self, data: np.ndarray) -> np.ndarray:
+        t = self.tile
+        h, w = data.shape
+        ny, nx = max(h // t, 1), max(w // t, 1)
+        th, tw = h // ny, w // nx
+        tiles = data[: ny * th, : nx * tw].reshape(ny, th, nx, tw)
+        medians = np.median(tiles, axis=(1, 3))
+        background = np.repeat(np.repeat(medians, th, axis=0), tw, axis=1)
+        # the last rows and columns that do not fill a whole tile use the nearest tile
+        return np.pad(background, ((0, h - ny * th), (0, w - nx * tw)), mode="edge")
+
+    @staticmethod
+    def _runs(mask: np.ndarray):
+        """Returns the row, first column and last column + 1 of every horizontal run in the mask"""
+        padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = mask
+        edges = np.diff(padded, axis=1)
+        start_rows, starts = np.nonzero(edges == 1)
+        end_rows, ends = np.nonzero(edges == -1)
+        return start_rows, starts, ends
+
+    @staticmethod
+    def _label_runs(rows: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Connects the runs that touch (8-connected) on consecutive rows, returns a label per run"""
+        # runs are ordered by row then column, so (row, column) keys are sorted and the runs of
+        # the next row that touch run i are one slice: from the first that ends at or after its
+        # start to the last that starts at or before its end
+        width = np.int64(ends.max()) + 2
+        rows = rows.astype(np.int64)
+        first = np.searchsorted(rows * width + ends, (rows + 1) * width + starts, side="left")
+        last = np.searchsorted(rows * width + starts, (rows + 1) * width + ends, side="right")
+        counts = np.maximum(last - first, 0)
+        upper = np.repeat(np.arange(len(rows)), counts)
+        # the index of every touching run of the next row
+        lower = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        # every run takes the smallest label of the runs it touches, then the label of its label,
+        # until nothing changes; the label of a blob is the index of its first run
+        labels = np.arange(len(rows))
+        while True:
+            smallest = np.minimum(labels[upper], labels[lower])
+            previous = labels.copy()
+            np.minimum.at(labels, upper, smallest)
+            np.minimum.at(labels, lower, smallest)
+            labels = labels[labels]
+            if np.array_equal(labels, previous):
+                break
+        return np.unique(labels, return_inverse=True)[1]
+
+    @staticmethod
+    def _measure(residual, background, rows, starts, ends, labels) -> np.ndarray:
+        """Flux weighted centroid, flux, peak and size of every labelled blob"""
+        h, w = residual.shape
+        flux = np.clip(residual, 0, None)
+        xs = np.arange(w, dtype=np.float64)
+        zero = np.zeros((h, 1))
+        cum_flux = np.hstack([zero, np.cumsum(flux, axis=1, dtype=np.float64)])
+        cum_x = np.hstack([zero, np.cumsum(flux * xs, axis=1, dtype=np.float64)])
+        cum_bg = np.hstack([zero, np.cumsum(background, axis=1, dtype=np.float64)])
+        run_flux = cum_flux[rows, ends] - cum_flux[rows, starts]
+        run_x = cum_x[rows, ends] - cum_x[rows, starts]
+        run_bg = cum_bg[rows, ends] - cum_bg[rows, starts]
+        run_npix = ends - starts
+        # runs are contiguous in the flattened frame, so reduceat gives the peak of each run
+        bounds = np.empty(2 * len(rows), dtype=np.int64)
+        bounds[0::2] = rows * w + starts
+        bounds[1::2] = rows * w + ends
+        flat = np.append(residual.ravel(), 0)
+        run_peak = np.maximum.reduceat(flat, bounds)[0::2]
+
+        n = labels.max() + 1
+        total_flux = np.bincount(labels, run_flux, n)
+        npix = np.bincount(labels, run_npix, n)
+        stars = np.zeros(n, dtype=STAR_DTYPE)
+        safe_flux = np.where(total_flux > 0, total_flux, 1)
+        stars["X"] = np.bincount(labels, run_x, n) / safe_flux
+        stars["Y"] = np.bincount(labels, run_flux * rows, n) / safe_flux
+        stars["FLUX"] = total_flux
+        stars["BACKGROUND"] = np.bincount(labels, run_bg, n) / npix
+        stars["NPIX"] = npix
+        peak = np.full(n, -np.inf)
+        np.maximum.at(peak, labels, run_peak)
+        stars["PEAK"] = peak
+        return stars[total_flux > 0]
+
+    @staticmethod
+    def write_xylist(stars: np.ndarray, path: Path, width: int, height: int) -> None:
+        """Writes the stars as an xylist that solve-field accepts instead of an image
+
+        Parameters:
+        stars (np.ndarray): The stars as returned by extract
+        path (Path): The file to write
+        width (int): The width of the frame in pixels
+        height (int): The height of the frame in pixels"""
+        header = [
+            {"name": "IMAGEW", "value": width},
+            {"name": "IMAGEH", "value": height},
+        ]
+        xylist = recfunctions.repack_fields(stars[["X", "Y", "FLUX", "BACKGROUND"]])
+        fitsio.write(str(path), xylist, header=header, clobber=True)
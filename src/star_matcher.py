@@ -0,0 +1,78 @@
+from typing import Optional, Tuple
+import numpy as np
+
+# Matching of star lists between two frames of (almost) the same field.
+# Positions are (n, 2) arrays of x, y pixel coordinates.
+
+
+def estimate_shift(
+    reference: np.ndarray, positions: np.ndarray, bin_size: float = 4.0, max_shift: float = 300.0
+) -> Optional[np.ndarray]:
+    """Estimates the translation from the reference stars to the new stars by letting every pair vote
+
+    Parameters:
+    reference (np.ndarray): The star positions in the reference frame
+    positions (np.ndarray): The star positions in the new frame
+    bin_size (float): The size in pixels of a voting bin
+    max_shift (float): Larger translations are not considered
+
+    Returns:
+    np.ndarray: The dx, dy that moves the reference onto the new frame, None if there is no clear peak"""
+    if len(reference) == 0 or len(positions) == 0:
+        return None
+    differences = (positions[:, None, :] - reference[None, :, :]).reshape(-1, 2)
+    differences = differences[np.all(np.abs(differences) < max_shift, axis=1)]
+    if len(differences) == 0:
+        return None
+    bins = np.floor(differences / bin_size).astype(np.int64)
+    keys, counts = np.unique(bins, axis=0, return_counts=True)
+    best = np.argmax(counts)
+    if counts[best] < 3:
+        return None
+    # average the votes of the winning bin and its neighbours for a sub-bin estimate
+    near = np.all(np.abs(bins - keys[best]) <= 1, axis=1)
+    return differences[near].mean(axis=0)
+
+
+def match_stars(
+    predicted: np.ndarray, positions: np.ndarray, tolerance: float = 3.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairs every new star with the closest predicted reference star
+
+    Parameters:
+    predicted (np.ndarray): Reference star positions transformed into the new frame
+    positions (np.ndarray): The star positions in the new frame
+    tolerance (float): Maximum distance in pixels of a pair
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: Indices into predicted and positions of the matched pairs"""
+    distances = np.hypot(
+        positions[:, None, 0] - predicted[None, :, 0], positions[:, None, 1] - predicted[None, :, 1]
+    )
+    nearest = np.argmin(distances, axis=1)
+    new_index = np.nonzero(distances[np.arange(len(positions)), nearest] < tolerance)[0]
+    reference_index = nearest[new_index]
+    # a reference star claimed by two new stars is ambiguous, drop both
+    unique, counts = np.unique(reference_index, return_counts=True)
+    keep = np.isin(reference_index, unique[counts == 1])
+    return reference_index[keep], new_index[keep]
+
+
+def fit_similarity(source: np.ndarray, target: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Least squares rotation, scale and translation that maps source onto target
+
+    Parameters:
+    source (np.ndarray): The positions to transform
+    target (np.ndarray): The positions they should land on
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: The 2x2 matrix and the offset, target = source @ matrix.T + offset"""
+    source_mean = source.mean(axis=0)
+    target_mean = target.mean(axis=0)
+    s = source - source_mean
+    t = target - target_mean
+    norm = np.sum(s**2)
+    a = np.sum(s[:, 0] * t[:, 0] + s[:, 1] * t[:, 1]) / norm
+    b = np.sum(s[:, 0] * t[:, 1] - s[:, 1] * t[:, 0]) / norm
+    matrix = np.array([[a, -b], [b, a]])
+    return matrix, target_mean - source_mean @ matrix.T
@@ -0,0 +1,222 @@
+from collections import deque
+import io
+from pathlib import Path
+from typing import Deque, Dict, Tuple
+import logging
+import os
+import queue
+import threading
+import time
+import fitsio
+import numpy as np
+from PIL import Image
+from CameraInterface import CameraFrame
+
+FORMATS = ("jpg", "npy", "fits")
+# the stills written by the archiver, one file name per line, only these are ever deleted
+INDEX_NAME = ".archived"
+
+
+class StillsArchiver:
+    """Writes the captured frames to the stills directory in a background thread, so a capture
+    never waits for the SD card. The queue is bounded: when the writer falls behind new frames are
+    dropped. When the stills it wrote exceed their size or age quota the oldest are deleted, other
+    files in the directory are left alone."""
+
+    def __init__(
+        self,
+        stills_path: Path,
+        fmt: str = "jpg",
+        quality: int = 90,
+        queue_size: int = 4,
+        max_mb: float = 0,
+        max_days: float = 0,
+        metrics=None,
+    ) -> None:
+        """Initializes the archiver, the writer thread starts with the first frame
+
+        Parameters:
+        stills_path (Path): The directory the stills are written to
+        fmt (str): jpg, npy (the raw pixels) or fits (raw pixels plus the exposure in the header)
+        quality (int): The JPEG quality, 1 to 95
+        queue_size (int): Frames waiting to be written, more are dropped
+        max_mb (float): The size quota of the archived stills in megabytes, 0 for no limit
+        max_days (float): Stills older than this many days are deleted, 0 for no limit
+        metrics (CameraMetrics): The camera metrics the encode and write times and the drops are added to"""
+        self.stills_path = stills_path
+        self.metrics = metrics
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.configure(fmt, quality, max_mb, max_days)
+        # (modification time, size, path) of the stills, oldest first
+        self.files: Deque[Tuple[float, int, Path]] = deque()
+        self.total_bytes = 0
+        self.stats: Dict[str, int] = {"written": 0, "dropped": 0, "evicted": 0, "failed": 0}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def configure(self, fmt: str, quality: int, max_mb: float, max_days: float) -> None:
+        """Changes the format and the quota, applies to the next frame
+
+        Parameters:
+        fmt (str): jpg, npy or fits
+        quality (int): The JPEG quality, 1 to 95
+        max_mb (float): The size quota in megabytes, 0 for no limit
+        max_days (float): The age quota in days, 0 for no limit"""
+        if fmt not in FORMATS:
+            logging.warning(f"Unknown stills format {fmt}, using jpg")
+            fmt = "jpg"
+        self.fmt = fmt
+        self.quality = int(quality)
+        self.max_bytes = int(max_mb * 1000000)
+        self.max_age = max_days * 86400
+
+    def submit(self, frame: CameraFrame, name: str) -> bool:
+        """Queues a copy of the frame for writing, returns at once
+
+        Parameters:
+        frame (CameraFrame): The captured frame, its data may be a view on a camera buffer
+        name (str): The file name without the suffix
+
+        Returns:
+        bool: False if the frame was dropped because the queue is full"""
+        self._start()
+        still = CameraFrame(
+            frame.data.copy(), frame.exposure, frame.gain, frame.timestamp, frame.sensor_size,
+            dict(frame.metadata), frame.binning,
+        )
+        try:
+            self.queue.put_nowait((still, name))
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            if self.metrics is not None:
+                self.metrics.count("stills_dropped")
+            logging.debug(f"Stills queue full, dropped {name}")
+            return False
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._writer, name="stills-writer")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def stop(self) -> None:
+        """Writes the queued frames and stops the writer"""
+        with self.lock:
+            if self.thread is None:
+                return
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _writer(self) -> None:
+        self._scan()
+        self._evict()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            still, name = item
+            try:
+                path = self.write(still, self.stills_path / f"{name}.{self.fmt}")
+                size = path.stat().st_size
+                with open(self.stills_path / INDEX_NAME, "a") as f:
+                    f.write(path.name + "\n")
+                self.files.append((time.time(), size, path))
+                self.total_bytes += size
+                self.stats["written"] += 1
+            except Exception as ex:
+                self.stats["failed"] += 1
+                logging.error(f"Could not write still {name}: {ex}")
+            self._evict()
+
+    def write(self, frame: CameraFrame, path: Path) -> Path:
+        """Encodes the frame in the format given by the suffix of the path
+
+        Parameters:
+        frame (CameraFrame): The frame
+        path (Path): The file to write, .jpg, .npy or .fits
+
+        Returns:
+        Path: The file written"""
+        data = frame.data
+        start_time = time.perf_counter()
+        if path.suffix == ".fits":
+            header = [
+                {"name": "EXPTIME", "value": frame.exposure, "comment": "exposure time in seconds"},
+                {"name": "GAIN", "value": frame.gain},
+                {"name": "XBINNING", "value": frame.binning},
+                {"name": "YBINNING", "value": frame.binning},
+                {"name": "DATE-OBS", "value": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(frame.timestamp))},
+                {"name": "INSTRUME", "value": str(frame.metadata.get("camera", ""))},
+                {"name": "OBJECT", "value": str(frame.metadata.get("radec", ""))},
+            ]
+            if frame.metadata.get("temperature") is not None:
+                header.append({"name": "CCD-TEMP", "value": frame.metadata["temperature"]})
+            fitsio.write(str(path), data, header=header, clobber=True)
+            self._record("still_write", start_time)
+            return path
+        encoded = io.BytesIO()
+        if path.suffix == ".npy":
+            np.save(encoded, data)
+        else:
+            if data.dtype == np.uint16:
+                # JPEG holds 8 bits, keep the most significant ones
+                data = (data >> 8).astype(np.uint8)
+            Image.fromarray(data).save(encoded, format="JPEG", quality=self.quality)
+        self._record("still_encode", start_time)
+        start_time = time.perf_counter()
+        with open(path, "wb") as f:
+            f.write(encoded.getbuffer())
+        self._record("still_write", start_time)
+        return path
+
+    def _record(self, phase: str, start_time: float) -> None:
+        if self.metrics is not None:
+            self.metrics.record(phase, time.perf_counter() - start_time)
+
+    def _scan(self) -> None:
+        # the stills the archiver wrote in earlier sessions count towards the quota
+        files = []
+        try:
+            names = (self.stills_path / INDEX_NAME).read_text().split()
+        except OSError:
+            names = []
+        for name in set(names):
+            path = self.stills_path / name
+            try:
+                stat = path.stat()
+            except OSError:
+                # deleted by the user
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        self.files = deque(files)
+        self.total_bytes = sum(size for _, size, _ in files)
+        self._save_index()
+
+    def _save_index(self) -> None:
+        try:
+            with open(self.stills_path / INDEX_NAME, "w") as f:
+                f.writelines(path.name + "\n" for _, _, path in self.files)
+        except OSError as ex:
+            logging.warning(f"Could not write the stills index: {ex}")
+
+    def _evict(self) -> None:
+        oldest_allowed = time.time() - self.max_age if self.max_age > 0 else None
+        evicted = False
+        while self.files and (
+            (self.max_bytes > 0 and self.total_bytes > self.max_bytes)
+            or (oldest_allowed is not None and self.files[0][0] < oldest_allowed)
+        ):
+            _, size, path = self.files.popleft()
+            self.total_bytes -= size
+            evicted = True
+            try:
+                os.remove(path)
+                self.stats["evicted"] += 1
+            except OSError as ex:
+                logging.warning(f"Could not delete still {path}: {ex}")
+        if evicted:
+            self._save_index()
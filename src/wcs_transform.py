@@ -0,0 +1,168 @@
+from pathlib import Path
+from typing import Dict, Tuple
+import numpy as np
+import fitsio
+
+
+class TanSipWcs:
+    """In memory TAN (+ SIP distortion) WCS as written by solve-field, converts pixels to sky
+    and back for whole arrays of points at once. Pixel coordinates follow the FITS convention
+    (1-indexed), like the wcs-xy2rd and wcs-rd2xy tools."""
+
+    def __init__(self, header: Dict) -> None:
+        """Initializes the transform from a FITS header
+
+        Parameters:
+        header (Dict): The WCS header, any mapping of keyword to value"""
+        self.crval = np.array([float(header["CRVAL1"]), float(header["CRVAL2"])])
+        self.crpix = np.array([float(header["CRPIX1"]), float(header["CRPIX2"])])
+        self.cd = np.array(
+            [
+                [float(header["CD1_1"]), float(header["CD1_2"])],
+                [float(header["CD2_1"]), float(header["CD2_2"])],
+            ]
+        )
+        self.cd_inv = np.linalg.inv(self.cd)
+        self.width = int(header.get("IMAGEW", 0))
+        self.height = int(header.get("IMAGEH", 0))
+        self.a = self._sip_terms(header, "A")
+        self.b = self._sip_terms(header, "B")
+        self.ap = self._sip_terms(header, "AP")
+        self.bp = self._sip_terms(header, "BP")
+
+    @classmethod
+    def from_file(cls, wcs_file: Path) -> "TanSipWcs":
+        """Reads the WCS from a file like capture.wcs
+
+        Parameters:
+        wcs_file (Path): The WCS file
+
+        Returns:
+        TanSipWcs: The transform"""
+        header = fitsio.read_header(str(wcs_file))
+        return cls({key: header[key] for key in header.keys()})
+
+    @staticmethod
+    def _sip_terms(header: Dict, name: str):
+        order = int(header.get(f"{name}_ORDER", 0))
+        terms = []
+        for p in range(order + 1):
+            for q in range(order + 1 - p):
+                coefficient = float(header.get(f"{name}_{p}_{q}", 0.0))
+                if coefficient != 0.0:
+                    terms.append((p, q, coefficient))
+        return terms
+
+    @staticmethod
+    def _polynomial(terms, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        result = np.zeros_like(u)
+        for p, q, coefficient in terms:
+            result += coefficient * u**p * v**q
+        return result
+
+    def xy2rd(self, x, y) -> Tuple[np.ndarray, np.ndarray]:
+        """Converts pixel positions to RA and Dec (J2000)
+
+        Parameters:
+        x (float or np.ndarray): The x pixel coordinate(s)
+        y (float or np.ndarray): The y pixel coordinate(s)
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: RA and Dec in degrees"""
+        u = np.asarray(x, dtype=np.float64) - self.crpix[0]
+        v = np.asarray(y, dtype=np.float64) - self.crpix[1]
+        if self.a or self.b:
+            u, v = u + self._polynomial(self.a, u, v), v + self._polynomial(self.b, u, v)
+        xi = np.radians(self.cd[0, 0] * u + self.cd[0, 1] * v)
+        eta = np.radians(self.cd[1, 0] * u + self.cd[1, 1] * v)
+        ra0, dec0 = np.radians(self.crval)
+        denominator = np.cos(dec0) - eta * np.sin(dec0)
+        ra = ra0 + np.arctan2(xi, denominator)
+        dec = np.arctan2(np.sin(dec0) + eta * np.cos(dec0), np.hypot(xi, denominator))
+        return np.degrees(ra) % 360, np.degrees(dec)
+
+    def rd2xy(self, ra, dec) -> Tuple[np.ndarray, np.ndarray]:
+        """Converts RA and Dec (J2000) to pixel positions
+
+        Parameters:
+        ra (float or np.ndarray): RA in degrees
+        dec (float or np.ndarray): Dec in degrees
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: The x and y pixel coordinates"""
+        ra = np.radians(np.asarray(ra, dtype=np.float64))
+        dec = np.radians(np.asarray(dec, dtype=np.float64))
+        ra0, dec0 = np.radians(self.crval)
+        cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(ra - ra0)
+        xi = np.degrees(np.cos(dec) * np.sin(ra - ra0) / cos_c)
+        eta = np.degrees(
+            (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(ra - ra0)) / cos_c
+        )
+        u = self.cd_inv[0, 0] * xi + self.cd_inv[0, 1] * eta
+        v = self.cd_inv[1, 0] * xi + self.cd_inv[1, 1] * eta
+        if self.ap or self.bp:
+            u, v = u + self._polynomial(self.ap, u, v), v + self._polynomial(self.bp, u, v)
+        elif self.a or self.b:
+            # no inverse polynomial in the header, invert the forward one by iteration
+            u0, v0 = u, v
+            for _ in range(10):
+                u, v = u0 - self._polynomial(self.a, u, v), v0 - self._polynomial(self.b, u, v)
+        return u + self.crpix[0], v + self.crpix[1]
+
+    def pixel_scale(self) -> float:
+        """Returns the pixel scale in arcsec per pixel"""
+        return float(np.sqrt(abs(np.linalg.det(self.cd))) * 3600)
+
+    def to_header(self) -> Dict:
+        """Returns the TAN part of the transform as FITS header keywords, SIP terms are not included"""
+        return {
+            "CTYPE1": "RA---TAN",
+            "CTYPE2": "DEC--TAN",
+            "CRVAL1": float(self.crval[0]),
+            "CRVAL2": float(self.crval[1]),
+            "CRPIX1": float(self.crpix[0]),
+            "CRPIX2": float(self.crpix[1]),
+            "CD1_1": float(self.cd[0, 0]),
+            "CD1_2": float(self.cd[0, 1]),
+            "CD2_1": float(self.cd[1, 0]),
+            "CD2_2": float(self.cd[1, 1]),
+            "IMAGEW": self.width,
+            "IMAGEH": self.height,
+        }
+
+    def write(self, wcs_file: Path) -> None:
+        """Writes the transform as a header only FITS file, like the capture.wcs of solve-field
+
+        Parameters:
+        wcs_file (Path): The file to write"""
+        header = [{"name": key, "value": value} for key, value in self.to_header().items()]
+        with fitsio.FITS(str(wcs_file), "rw", clobber=True) as f:
+            f.write(None, header=header)
+
+    @classmethod
+    def fit(cls, x, y, ra, dec, crval, crpix, width: int = 0, height: int = 0) -> "TanSipWcs":
+        """Fits a TAN transform through stars with known pixel and sky positions
+
+        Parameters:
+        x (np.ndarray): The x pixel coordinates of the stars
+        y (np.ndarray): The y pixel coordinates of the stars
+        ra (np.ndarray): The RA of the stars in degrees
+        dec (np.ndarray): The Dec of the stars in degrees
+        crval (Tuple[float, float]): RA and Dec of the reference point, close to the field centre
+        crpix (Tuple[float, float]): Pixel coordinates of the reference point
+        width (int): The width of the frame in pixels
+        height (int): The height of the frame in pixels
+
+        Returns:
+        TanSipWcs: The fitted transform"""
+        header = {"CRVAL1": crval[0], "CRVAL2": crval[1], "CRPIX1": crpix[0], "CRPIX2": crpix[1],
+                  "CD1_1": 1.0, "CD1_2": 0.0, "CD2_1": 0.0, "CD2_2": 1.0,
+                  "IMAGEW": width, "IMAGEH": height}
+        # with a unit CD matrix rd2xy gives the intermediate world coordinates (degrees) around crpix
+        unit = cls(header)
+        xi, eta = unit.rd2xy(ra, dec)
+        design = np.column_stack([np.asarray(x) - crpix[0], np.asarray(y) - crpix[1]])
+        cd_row1 = np.linalg.lstsq(design, xi - crpix[0], rcond=None)[0]
+        cd_row2 = np.linalg.lstsq(design, eta - crpix[1], rcond=None)[0]
+        header.update({"CD1_1": cd_row1[0], "CD1_2": cd_row1[1], "CD2_1": cd_row2[0], "CD2_2": cd_row2[1]})
+        return cls(header)
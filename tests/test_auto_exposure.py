@@ -0,0 +1,47 @@
+from auto_exposure import AutoExposure, exposure_ladder
+from frame_triage import TriageResult
+
+EXPOSURES = [0.1, 0.5, 1, 5, 10]
+GAINS = [1, 2, 5, 25, 50]
+
+
+def verdict(stars, reason="", background=20.0):
+    if not reason and stars < 5:
+        reason = "too few stars"
+    return TriageResult(reason, stars, background, 0.0, 2.0)
+
+
+def test_ladder_grows_in_signal_and_never_shortens_the_exposure():
+    ladder = exposure_ladder(EXPOSURES, GAINS)
+    signals = [exposure * gain for exposure, gain in ladder]
+    assert signals == sorted(signals)
+    exposures = [exposure for exposure, _ in ladder]
+    assert exposures == sorted(exposures)
+    assert ladder[0] == (0.1, 1)
+    assert ladder[-1] == (10, 50)
+
+
+def test_steps_up_on_too_few_stars_and_down_when_saturated(tmp_path):
+    auto = AutoExposure(tmp_path / "auto_exposure.json", EXPOSURES, GAINS)
+    ladder = auto.ladder
+    middle = ladder.index((1, 50))
+    assert ladder.index(auto.observe(verdict(3), 1, 50)) == middle + 1
+    # far below the minimum jumps two steps
+    assert ladder.index(auto.observe(verdict(1), 1, 50)) == middle + 2
+    assert ladder.index(auto.observe(verdict(30, "saturated"), 1, 50)) == middle - 2
+    assert auto.observe(verdict(20), 1, 50) == (1, 50)
+    # stars to spare tries a shorter step
+    assert ladder.index(auto.observe(verdict(60), 1, 50)) == middle - 1
+
+
+def test_learned_step_is_used_again_under_the_same_sky(tmp_path):
+    store_file = tmp_path / "auto_exposure.json"
+    auto = AutoExposure(store_file, EXPOSURES, GAINS)
+    for _ in range(3):
+        auto.observe(verdict(20), 0.5, 25, solved=True)
+    condition = auto.sky_condition(verdict(20), 0.5, 25)
+    learned = AutoExposure(store_file, EXPOSURES, GAINS)
+    assert learned.ladder[learned.learned_step(condition)] == (0.5, 25)
+    # a frame of another sky brightness, then one at another step under the learned sky
+    learned.observe(verdict(20, background=200.0), 0.5, 25)
+    assert learned.observe(verdict(8, background=80.0), 1, 50) == (0.5, 25)
@@ -0,0 +1,62 @@
+import json
+import sys
+import numpy as np
+from benchmark import Benchmark, compare, report, synthesize
+from test_platesolve import FAKE_SOLVE_FIELD, FRAME
+
+
+def make_benchmark(tmp_path, frames):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    np.save(corpus / "frame.npy", FRAME)
+    (corpus / "manifest.json").write_text(json.dumps({"pix_scale": 15, "frames": frames}))
+    script = tmp_path / "solve-field.py"
+    script.write_text(FAKE_SOLVE_FIELD)
+    # the fake solve-field solves the blind attempts at the centre 10.68, 41.27
+    (tmp_path / "solve-field.py.json").write_text(json.dumps({"solves": ["blind"], "sleep": {}}))
+    benchmark = Benchmark(corpus, tmp_path / "work")
+    benchmark.platesolve.cmd = [sys.executable, str(script)]
+    return benchmark
+
+
+def test_a_corpus_is_solved_and_measured(tmp_path):
+    benchmark = make_benchmark(
+        tmp_path,
+        [
+            {"file": "frame.npy", "ra": 10.68, "dec": 41.27},
+            {"file": "frame.npy", "ra": 10.68, "dec": 41.27, "hint": True},
+            {"file": "frame.npy", "ra": 10.68, "dec": 41.27, "synthetic": {"shift": [15, -10], "seed": 1}},
+        ],
+    )
+    results = benchmark.run()
+    assert [frame["solved"] for frame in results["frames"]] == [True, True, True]
+    assert results["frames"][0]["error_arcsec"] < 1
+    # the known position moved with the shift, 15 arcsec per pixel
+    assert abs(results["frames"][2]["error_arcsec"] - 15 * np.hypot(15, 10)) < 1
+    assert results["frames"][0]["timings"]["attempts"] == 1
+    assert results["frames"][1]["timings"]["attempts"] == 4
+    summary = results["summary"]
+    assert summary["success_rate"] == 1.0
+    assert {"extraction", "xylist", "solve_field", "wcs"} <= set(summary["stages"])
+    assert compare(summary, summary) == []
+    assert "success_rate" in report(summary, summary)
+
+
+def test_regressions_against_a_baseline():
+    baseline = {"success_rate": 1.0, "median_time": 1.0, "p90_time": 2.0, "median_error_arcsec": 4.0,
+                "stages": {"solve_field": 0.8, "extraction": 0.001}}
+    summary = {"success_rate": 0.8, "median_time": 1.1, "p90_time": 3.0, "median_error_arcsec": 10.0,
+               "stages": {"solve_field": 0.8, "extraction": 0.005}}
+    regressions = compare(summary, baseline)
+    assert len(regressions) == 3
+    assert regressions[0].startswith("success rate")
+    assert regressions[1].startswith("p90_time")
+    assert regressions[2].startswith("median error")
+
+
+def test_synthetic_frames_keep_shape_and_dtype():
+    image = np.full((480, 640), 20, dtype=np.uint8)
+    image[240, 320] = 200
+    frame = synthesize(image, {"shift": [15, -10], "noise": 6, "hot_pixels": 50, "seed": 1})
+    assert frame.shape == image.shape and frame.dtype == image.dtype
+    assert np.count_nonzero(frame == 255) >= 40
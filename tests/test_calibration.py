@@ -0,0 +1,53 @@
+import time
+import numpy as np
+from CameraInterface import CameraFrame
+from calibration import Calibration
+
+
+def darks(count=5, shape=(48, 64), level=10, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = [np.clip(rng.normal(level, 1, shape), 0, 255).astype(np.uint8) for _ in range(count)]
+    for frame in frames:
+        frame[5, 7] = 200
+        frame[30, 0] = 150
+    return frames
+
+
+def frame_of(data, temperature=None):
+    return CameraFrame(data, 1.0, 50, time.time(), (64, 48), {"camera": "ASI", "temperature": temperature})
+
+
+def test_dark_is_subtracted_and_hot_pixels_repaired(tmp_path):
+    calibration = Calibration(tmp_path)
+    calibration.build(darks(), "ASI", 1.0, 50, 20.0)
+    data = np.full((48, 64), 50, dtype=np.uint8)
+    data[5, 7] = 255
+    data[30, 0] = 255
+    data[0, 0] = 3
+    frame = frame_of(data, 21.0)
+    assert calibration.apply_frame(frame)
+    assert frame.metadata["calibrated"]
+    assert abs(int(np.median(frame.data)) - 40) <= 1
+    # hot pixels take the mean of their neighbours, at the edge both are the right neighbour
+    assert frame.data[5, 7] == (int(frame.data[5, 6]) + int(frame.data[5, 8])) // 2
+    assert frame.data[30, 0] == frame.data[30, 1]
+    # clipped at zero instead of wrapping around
+    assert frame.data[0, 0] == 0
+
+
+def test_sets_are_per_settings_and_temperature(tmp_path):
+    calibration = Calibration(tmp_path)
+    calibration.build(darks(), "ASI", 1.0, 50, 20.0)
+    assert calibration.lookup("ASI", (48, 64), 1.0, 50, 22.0) is not None
+    assert calibration.lookup("ASI", (48, 64), 1.0, 50, 27.6) is None
+    assert calibration.lookup("ASI", (24, 32), 1.0, 50, 20.0) is None
+    assert calibration.lookup("ASI", (48, 64), 2.0, 50, 20.0) is None
+    assert not calibration.apply_frame(frame_of(np.zeros((48, 64), dtype=np.uint16), 20.0))
+
+
+def test_sets_survive_a_restart(tmp_path):
+    key = Calibration(tmp_path).build(darks(), "ASI", 1.0, 50, None)
+    reopened = Calibration(tmp_path)
+    assert key in reopened.index
+    calibration_set = reopened.lookup("ASI", (48, 64), 1.0, 50, None)
+    assert set(calibration_set.hot_pixels) == {5 * 64 + 7, 30 * 64}
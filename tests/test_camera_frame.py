@@ -0,0 +1,30 @@
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from CameraDebug import CameraDebug
+from CameraInterface import CameraFrame
+
+PACKAGE_PATH = Path(__file__).resolve().parent.parent
+
+
+def test_test_images_are_decoded_once(tmp_path):
+    camera = CameraDebug(None, tmp_path, PACKAGE_PATH)
+    frame = camera.capture_array(500000, 20, "radec", {"testimage": "m31"})
+    assert frame.data.shape == (960, 1280)
+    assert frame.exposure == 0.5 and frame.gain == 20
+    assert frame.sensor_size == (1280, 960)
+    assert frame.metadata["testimage"] == "m31"
+    again = camera.capture_array(500000, 20, "radec", {"testimage": "m31"})
+    assert len(camera.test_images) == 1
+    # a copy of the cached image, calibrating a frame in place leaves the cache intact
+    assert again.data is not frame.data and np.array_equal(again.data, frame.data)
+    # nothing is written to the images directory
+    assert not any(tmp_path.iterdir())
+
+
+def test_a_frame_is_saved_and_shown_without_a_file(tmp_path):
+    data = np.arange(48, dtype=np.uint8).reshape(6, 8)
+    frame = CameraFrame(data, 1.0, 10, 0.0, (8, 6))
+    assert np.array_equal(np.asarray(frame.to_image()), data)
+    frame.save(tmp_path / "frame.png")
+    assert np.array_equal(np.asarray(Image.open(tmp_path / "frame.png")), data)
@@ -0,0 +1,34 @@
+import pytest
+from camera_metrics import CameraMetrics
+
+
+def test_phases_and_counters():
+    metrics = CameraMetrics(history=10)
+    for _ in range(3):
+        timing = metrics.begin(0.5)
+        with timing.phase("exposure"):
+            pass
+        with timing.phase("readout"):
+            pass
+        with timing.phase("readout"):
+            pass
+        metrics.end(timing)
+    metrics.count("captures", 3)
+    metrics.count("timeouts")
+    metrics.record("still_write", 0.25)
+    summary = metrics.summary()
+    assert summary["counters"] == {"captures": 3, "timeouts": 1}
+    assert summary["phases"]["exposure"]["count"] == 3
+    assert summary["phases"]["still_write"]["max"] == pytest.approx(0.25)
+    # the newest capture, not the still written after it
+    assert set(summary["last"]) == {"exposure", "readout"}
+
+
+def test_history_is_bounded():
+    metrics = CameraMetrics(history=5)
+    for seconds in range(10):
+        metrics.record("encode", seconds)
+    phase = metrics.summary()["phases"]["encode"]
+    assert phase["count"] == 5
+    assert phase["mean"] == pytest.approx(7)
+    assert metrics.summary()["last"] == {}
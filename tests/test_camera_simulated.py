@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from CameraSimulated import CameraSimulated
+from frame_triage import FrameTriage
+from star_extractor import StarExtractor
+
+
+@pytest.fixture(scope="module")
+def camera(tmp_path_factory):
+    return CameraSimulated(images_path=tmp_path_factory.mktemp("images"), catalog_file=tmp_path_factory.mktemp("none") / "hip.fits")
+
+
+def test_frames_are_deterministic_per_seed(camera):
+    first = camera.render(80.0, 40.0, 1.0, 50, seed=1)
+    assert np.array_equal(first, camera.render(80.0, 40.0, 1.0, 50, seed=1))
+    second = camera.render(80.0, 40.0, 1.0, 50, seed=2)
+    # fresh noise in every frame, not a shifted copy of a noise bank
+    difference = first.astype(np.int16) - second
+    assert np.count_nonzero(difference) > 0.5 * difference.size
+
+
+def test_stars_are_where_the_wcs_puts_them(camera):
+    frame = camera.capture_array(1000000, 50, "radec", {"radec": (80.0 / 15, 40.0), "seed": 3})
+    wcs = frame.metadata["wcs"]
+    ra, dec = wcs.xy2rd((1280 + 1) / 2, (960 + 1) / 2)
+    assert float(ra) == pytest.approx(80.0)
+    assert float(dec) == pytest.approx(40.0)
+    stars = StarExtractor(downsample=1).extract(frame.data)[:5]
+    x, y = wcs.rd2xy(camera.ra, camera.dec)
+    for star in stars:
+        # every bright blob is a catalog star (or one of the hot pixels, which are single pixels)
+        assert np.min(np.hypot(x - star["X"], y - star["Y"])) < 1.5
+
+
+@pytest.mark.parametrize("bins", [1, 2])
+def test_default_exposure_is_solvable(camera, bins):
+    rng = np.random.default_rng(0)
+    triage = FrameTriage()
+    for seed in range(5):
+        ra, dec = rng.uniform(0, 360), np.degrees(np.arcsin(rng.uniform(-1, 1)))
+        verdict = triage.assess(camera.render(ra, dec, 1.0, 50, bins, seed), bins)
+        assert verdict.ok, verdict
+        assert verdict.star_count >= 15
+
+
+def test_binning_halves_the_frame(camera):
+    camera.set_binning(2)
+    try:
+        frame = camera.capture_array(1000000, 50, "radec", {})
+        assert frame.data.shape == (480, 640)
+        assert frame.binning == 2
+        assert camera.capture_array(1000000, 50, "radec", {"full_resolution": True}).data.shape == (960, 1280)
+    finally:
+        camera.set_binning(1)
+
+
+def test_an_unknown_pointing_falls_back_to_the_default(tmp_path):
+    camera = CameraSimulated(images_path=tmp_path, pointing=lambda: None, catalog_file=tmp_path / "hip.fits")
+    ra, dec = camera.position({})
+    assert ra == pytest.approx(0.0, abs=1e-6) and dec == pytest.approx(0.0, abs=1e-6)
+    assert camera.position({"radec": (6.0, 30.0)}) == pytest.approx((90.0, 30.0))
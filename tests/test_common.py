@@ -0,0 +1,12 @@
+import pytest
+from common import Common
+
+
+def test_offsets_of_binned_frames_are_in_sky_angles(tmp_path):
+    common = Common(tmp_path, tmp_path, 15, "")
+    # the same star on the full frame and on the 2x2 binned frame
+    unbinned = common.pixel2dxdy(840, 300, 1280, 960)
+    binned = common.pixel2dxdy(420, 150, 640, 480, 2)
+    assert binned[:2] == pytest.approx(unbinned[:2])
+    assert binned[2:] == unbinned[2:]
+    assert common.dxdy2pixel(binned[0], binned[1], 640, 480, 2)[:2] == pytest.approx((420, 150))
@@ -0,0 +1,62 @@
+import numpy as np
+from frame_triage import FrameTriage
+
+
+def star_field(count, shape=(480, 640), sigma=1.2, amplitude=120, background=20, seed=0, binning=1):
+    # gaussian stars on a noisy background, like a 1280x960 sensor binned 2x2
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    image = rng.normal(background, 2, shape)
+    yy, xx = np.mgrid[0:height, 0:width]
+    for x, y in zip(rng.uniform(20, width - 20, count), rng.uniform(20, height - 20, count)):
+        near = (abs(xx - x) < 8) & (abs(yy - y) < 8)
+        image[near] += amplitude * np.exp(-((xx[near] - x) ** 2 + (yy[near] - y) ** 2) / (2 * (sigma / binning) ** 2))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def test_a_star_field_passes():
+    verdict = FrameTriage().assess(star_field(30))
+    assert verdict.ok, verdict
+    assert verdict.star_count >= 20
+
+
+def test_a_sparse_field_passes_above_min_stars():
+    verdict = FrameTriage(min_stars=5).assess(star_field(6))
+    assert verdict.ok, verdict
+    assert FrameTriage(min_stars=10).assess(star_field(6)).reason == "too few stars"
+
+
+def test_an_empty_frame_has_too_few_stars():
+    assert FrameTriage().assess(star_field(0)).reason == "too few stars"
+
+
+def test_saturated_and_overexposed_frames():
+    image = star_field(30)
+    image[:40, :] = 255
+    assert FrameTriage().assess(image).reason == "saturated"
+    bright = star_field(30, background=230, amplitude=20)
+    assert FrameTriage().assess(bright).reason == "overexposed"
+
+
+def test_out_of_focus():
+    verdict = FrameTriage(max_fwhm=4).assess(star_field(30, sigma=4, amplitude=200))
+    assert verdict.reason == "out of focus", verdict
+
+
+def test_float_frames_are_normalised():
+    image = star_field(30).astype(np.float32) / 255
+    verdict = FrameTriage().assess(image)
+    assert verdict.ok, verdict
+    # the brightest pixel is not taken as saturated
+    assert verdict.saturation == 0
+    image[:40, :] = 1.0
+    assert FrameTriage().assess(image).reason == "saturated"
+    assert FrameTriage().assess(image * 1000, full_scale=1000.0).reason == "saturated"
+
+
+def test_binned_frames_are_binned_less_again():
+    # faint small stars of a 2x2 binned frame vanish when it is binned 4x on top
+    image = star_field(12, shape=(240, 320), sigma=1.2, amplitude=30, binning=2)
+    triage = FrameTriage(min_stars=5)
+    assert triage.assess(image, binning=2).ok
+    assert triage.assess(image, binning=1).star_count < triage.assess(image, binning=2).star_count
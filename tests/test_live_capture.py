@@ -0,0 +1,50 @@
+from pathlib import Path
+import time
+import pytest
+from CameraDebug import CameraDebug
+from live_capture import LiveCapture
+
+PACKAGE_PATH = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def live(tmp_path):
+    camera = CameraDebug(None, tmp_path, PACKAGE_PATH)
+    live = LiveCapture(camera, slots=3)
+    yield live
+    live.stop()
+
+
+def test_capture_returns_a_copy_of_the_newest_frame(live):
+    frame = live.capture_array(10000, 50, "radec", {"still": False})
+    assert frame.data.shape == (960, 1280)
+    assert frame.data.flags.owndata
+    assert frame.metadata["live"]
+    time.sleep(0.05)
+    later = live.capture_array(10000, 50, "radec", {"still": False})
+    assert later.metadata["sequence"] > frame.metadata["sequence"]
+
+
+def test_fresh_frames_start_after_the_call(live):
+    live.capture_array(10000, 50, "radec", {"still": False})
+    called = time.time()
+    frame = live.capture_array(10000, 50, "radec", {"still": False, "fresh": True})
+    assert frame.timestamp > called
+
+
+def test_new_settings_restart_the_stream(live):
+    live.capture_array(10000, 50, "radec", {"still": False})
+    frame = live.capture_array(20000, 25, "radec", {"still": False})
+    assert (live.exposure_time, live.gain) == (20000, 25)
+    assert (frame.exposure, frame.gain) == (0.02, 25)
+
+
+def test_binning_restarts_the_stream(live):
+    assert live.capture_array(10000, 50, "radec", {"still": False}).binning == 1
+    live.set_binning(2)
+    assert not live.running
+    frame = live.capture_array(10000, 50, "radec", {"still": False})
+    assert frame.data.shape == (480, 640)
+    assert frame.binning == 2 and frame.sensor_size == (1280, 960)
+    # a full resolution frame is a single unbinned exposure
+    assert live.capture_array(10000, 50, "radec", {"still": False, "full_resolution": True}).data.shape == (960, 1280)
@@ -0,0 +1,211 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from nexus_async import AsyncNexusClient, NexusSync
+
+REPLIES = {
+    b":GR#": b"05:14:32#", b":GD#": b"+45*59:53#", b":GZ#": b"\xff\xfe#", b":P#": b"HIGH PRECISION",
+    b":GW#": b"AT2#", b":Gr#": b"00:00:00#", b":Gd#": b"+00*00:00#", b":MS#": b"0", b":CM#": b"Coordinates matched#",
+}
+
+
+async def fake_nexus(silent=(), hang_up=()):
+    """An LX200 server on a free port, silent to some commands and hanging up on others"""
+
+    async def handle(reader, writer):
+        buffer = b""
+        while True:
+            data = await reader.read(64)
+            if not data:
+                break
+            buffer += data
+            while b"#" in buffer:
+                command, buffer = buffer.split(b"#", 1)
+                command += b"#"
+                if command in hang_up:
+                    writer.close()
+                    return
+                if command not in silent:
+                    writer.write(REPLIES.get(command, b"1" if command.startswith(b":S") else b""))
+                    await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+
+async def connected_client(**behaviour):
+    server, port = await fake_nexus(**behaviour)
+    client = AsyncNexusClient()
+    await client.open_tcp("127.0.0.1", port)
+    return server, client
+
+
+def test_replies_are_matched_in_order():
+    async def main():
+        server, client = await connected_client()
+        replies = await asyncio.gather(*[client.get(":GR#" if i % 2 else ":GD#") for i in range(10)])
+        batch = await client.get_batch([":GR#", ":Sr05:14:32#", ":P#", ":GD#"])
+        await client.close()
+        server.close()
+        return replies, batch
+
+    replies, batch = run(main())
+    assert replies == ["+45*59:53", "05:14:32"] * 5
+    assert batch == ["05:14:32", "1", "HIGH PRECISION", "+45*59:53"]
+
+
+def test_position_alignment_goto_and_sync():
+    async def main():
+        server, client = await connected_client()
+        results = (await client.get_radec(), await client.is_aligned(),
+                   await client.goto("05:14:32", "+45*59:53"), await client.sync("05:14:32", "+45*59:53"))
+        await client.close()
+        server.close()
+        return results
+
+    radec, aligned, goto, sync = run(main())
+    assert radec == pytest.approx((5 + 14 / 60 + 32 / 3600, 45 + 59 / 60 + 53 / 3600))
+    assert aligned
+    assert goto == "0"
+    assert sync == "Coordinates matched"
+
+
+def test_not_connected():
+    async def main():
+        await AsyncNexusClient().get(":GR#")
+
+    with pytest.raises(ConnectionError):
+        run(main())
+
+
+def test_garbled_reply_does_not_stop_the_worker():
+    async def main():
+        server, client = await connected_client()
+        with pytest.raises(UnicodeDecodeError):
+            await client.get(":GZ#")
+        reply = await client.get(":GR#")
+        await client.close()
+        server.close()
+        return reply, client.stats
+
+    reply, stats = run(main())
+    assert reply == "05:14:32"
+    assert stats["failures"] == 1
+    assert stats["connects"] == 2
+
+
+def test_timeout_closes_the_link():
+    async def main():
+        server, client = await connected_client(silent={b":GD#"})
+        with pytest.raises(TimeoutError):
+            await client.get(":GD#", timeout=0.1)
+        reply = await client.get(":GR#")
+        await client.close()
+        server.close()
+        return reply, client.stats
+
+    reply, stats = run(main())
+    assert reply == "05:14:32"
+    assert stats["timeouts"] == 1
+    assert stats["connects"] == 2
+
+
+def test_hang_up_is_a_connection_error():
+    async def main():
+        server, client = await connected_client(hang_up={b":GD#"})
+        with pytest.raises(ConnectionError):
+            await client.get(":GD#")
+        reply = await client.get(":GR#")
+        await client.close()
+        server.close()
+        return reply
+
+    assert run(main()) == "05:14:32"
+
+
+def test_cancelled_caller_does_not_stop_the_worker():
+    async def main():
+        server, client = await connected_client(silent={b":GD#"})
+        waiting = asyncio.ensure_future(client.get(":GD#", timeout=0.2))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        await asyncio.sleep(0.3)
+        reply = await client.get(":GR#")
+        await client.close()
+        server.close()
+        return reply
+
+    assert run(main()) == "05:14:32"
+
+
+def test_blocking_call_times_out():
+    # NexusSync without its handshake, only the event loop thread
+    nexus = NexusSync.__new__(NexusSync)
+    nexus.loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=nexus.loop.run_forever, daemon=True)
+    thread.start()
+    nexus.timeout = 0.1
+    try:
+        with pytest.raises(TimeoutError):
+            nexus.run(asyncio.sleep(10))
+        assert nexus.run(asyncio.sleep(0, result="done")) == "done"
+    finally:
+        nexus.loop.call_soon_threadsafe(nexus.loop.stop)
+        thread.join()
+
+
+class FakeHandpad:
+    def display(self, line0: str, line1: str, line2: str) -> None:
+        pass
+
+
+class FakeCoordinates:
+    def conv_altaz(self, nexus, ra: float, dec: float):
+        return 30.0, 120.0
+
+    def hh2dms(self, hours: float) -> str:
+        return str(hours)
+
+    def dd2dms(self, degrees: float) -> str:
+        return str(degrees)
+
+
+class FakeNexusSync(NexusSync):
+    """NexusSync on a fake Nexus served by its own event loop, no serial port"""
+
+    def open_link(self, link: str) -> None:
+        if link == "USB":
+            raise OSError("no serial port")
+        self.server, port = self.run(fake_nexus())
+        self.run(self.client.open_tcp("127.0.0.1", port))
+        self.connection = self.client
+
+
+def test_blocking_adapter_has_the_nexus_interface():
+    nexus = FakeNexusSync(FakeHandpad(), FakeCoordinates())
+    try:
+        assert nexus.get_nex_str() == "connected" and nexus.get_nexus_link() == "Wifi"
+        assert nexus.get(":GR#") == "05:14:32"
+        assert nexus.get_batch([":GR#", ":GD#"]) == ["05:14:32", "+45*59:53"]
+        nexus.write(":Sr05:14:32#")
+        snapshot = nexus.poll()
+        assert snapshot.aligned and snapshot.target is None and snapshot.short == "0514+4559"
+        assert nexus.get_radec() == snapshot.radec and nexus.get_altAz() == (30.0, 120.0)
+        assert nexus.is_aligned()
+        arr = np.array([[["", ""]] * 5], dtype=object)
+        arr = nexus.read_altAz(arr)
+        assert arr[0, 4][1] == "Nexus is aligned"
+        nexus.set_poller(None)
+        nexus.close()
+        # lets the fake Nexus see the link close
+        nexus.run(asyncio.sleep(0.05))
+    finally:
+        nexus.server.close()
+        nexus.loop.call_soon_threadsafe(nexus.loop.stop)
+        nexus.thread.join()
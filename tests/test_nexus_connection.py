@@ -0,0 +1,166 @@
+import pytest
+from nexus_connection import (
+    REPLY_CHAR, REPLY_GOTO, REPLY_NONE, REPLY_PRECISION, REPLY_STRING,
+    NexusConnection, is_read, reply_kind, reply_length, take_reply,
+)
+
+REPLIES = {":GR#": b"05:14:32#", ":GD#": b"+45*59:53#", ":P#": b"HIGH PRECISION", ":MS#": b"0", ":CM#": b"Coordinates matched#"}
+
+
+class FakeConnection(NexusConnection):
+    """A Nexus in memory, sends fail while failures is above 0"""
+
+    def __init__(self, retries: int = 1) -> None:
+        super().__init__("Fake", retries)
+        self.sent = []
+        self.pending = bytearray()
+        self.failures = 0
+
+    def _open(self):
+        return object()
+
+    def _close(self) -> None:
+        self.pending.clear()
+
+    def _send(self, data: bytes) -> None:
+        self.sent.append(data)
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionResetError("link dropped")
+        for command in data.decode().replace("#", "#\n").split():
+            if command.startswith(":S"):
+                self.pending += b"1"
+            else:
+                self.pending += REPLIES.get(command, b"")
+
+    def _read_some(self, timeout: float) -> bytes:
+        # a few bytes at a time, like a slow serial line
+        data = bytes(self.pending[:4])
+        del self.pending[:4]
+        return data
+
+    def _discard(self) -> None:
+        self.pending.clear()
+
+
+@pytest.mark.parametrize("command, kind", [
+    (":GR#", REPLY_STRING), (":GW#", REPLY_STRING), (":Sr05:14:32#", REPLY_CHAR), (":Sd+45*59:53#", REPLY_CHAR),
+    (":MS#", REPLY_GOTO), (":Mn#", REPLY_NONE), (":Q#", REPLY_NONE), (":RS#", REPLY_NONE), (":U#", REPLY_NONE),
+    (":P#", REPLY_PRECISION), (":CM#", REPLY_STRING), ("#:GR#", REPLY_STRING),
+])
+def test_reply_kind(command, kind):
+    assert reply_kind(command) == kind
+
+
+@pytest.mark.parametrize("kind, data, length", [
+    (REPLY_STRING, b"", 0), (REPLY_STRING, b"05:14", 0), (REPLY_STRING, b"05:14:32#+45", 9),
+    (REPLY_CHAR, b"", 0), (REPLY_CHAR, b"10", 1),
+    (REPLY_GOTO, b"0", 1), (REPLY_GOTO, b"1Below horizon", 0), (REPLY_GOTO, b"1Below horizon#", 15),
+    (REPLY_NONE, b"x", 0),
+    (REPLY_PRECISION, b"HIGH PREC", 0), (REPLY_PRECISION, b"HIGH PRECISION", 14),
+    (REPLY_PRECISION, b"LOW PRECISION#", 14), (REPLY_PRECISION, b"HIGH PRECISION#05", 15),
+    (REPLY_PRECISION, b"ERR#", 4),
+])
+def test_reply_length(kind, data, length):
+    assert reply_length(kind, data) == length
+
+
+def test_late_terminator_of_precision_reply_is_dropped():
+    buffer = bytearray(b"LOW PRECISION")
+    reply, skip = take_reply(REPLY_PRECISION, buffer, False)
+    assert (reply, skip) == (b"LOW PRECISION", True)
+    buffer += b"#05:14:32#"
+    assert take_reply(REPLY_STRING, buffer, skip) == (b"05:14:32#", False)
+
+
+def test_is_read():
+    assert is_read(":GR#") and is_read(":P#")
+    assert not is_read(":Sr05:14:32#") and not is_read(":CM#") and not is_read(":MS#") and not is_read(":Q#")
+
+
+def test_query_returns_the_reply_without_terminator():
+    connection = FakeConnection()
+    assert connection.query(":GR#") == "05:14:32"
+    assert connection.query(":CM#") == "Coordinates matched"
+    assert connection.stats["commands"] == 2
+    assert connection.stats["connects"] == 1
+
+
+def test_reads_are_retried_on_a_fresh_link():
+    connection = FakeConnection(retries=1)
+    connection.connect()
+    connection.failures = 1
+    assert connection.query(":GR#") == "05:14:32"
+    assert len(connection.sent) == 2
+    assert connection.stats["connects"] == 2
+    assert connection.stats["failures"] == 1
+
+
+def test_commands_that_change_the_nexus_are_not_sent_twice():
+    connection = FakeConnection(retries=1)
+    connection.failures = 1
+    with pytest.raises(ConnectionError):
+        connection.query(":CM#")
+    assert len(connection.sent) == 1
+    connection.failures = 1
+    with pytest.raises(ConnectionError):
+        connection.write(":Q#")
+    assert len(connection.sent) == 2
+    # the next command opens the link again
+    assert connection.query(":GR#") == "05:14:32"
+
+
+def test_a_read_that_keeps_failing_raises_connection_error():
+    connection = FakeConnection(retries=2)
+    connection.failures = 3
+    with pytest.raises(ConnectionError):
+        connection.query(":GD#")
+    assert len(connection.sent) == 3
+    assert connection.link is None
+
+
+def test_incomplete_reply_times_out():
+    connection = FakeConnection()
+    with pytest.raises(TimeoutError):
+        connection.query(":GZ#", timeout=0.05)
+    assert connection.stats["timeouts"] == 1
+    # a timeout is not a link failure, the link stays open
+    assert connection.link is not None
+    assert connection.query(":GR#") == "05:14:32"
+
+
+def test_burst_is_split_into_replies():
+    connection = FakeConnection()
+    assert connection.query_batch([":GR#", ":GD#", ":P#"]) == ["05:14:32", "+45*59:53", "HIGH PRECISION"]
+    assert connection.sent == [b":GR#:GD#:P#"]
+    # a :P# reply without terminator in the middle of the burst
+    assert connection.query_batch([":P#", ":GR#"]) == ["HIGH PRECISION", "05:14:32"]
+    assert connection.query_batch([":Sr05:14:32#", ":Sd+45*59:53#", ":CM#"]) == ["1", "1", "Coordinates matched"]
+    assert connection.query_batch([":Q#", ":GD#"]) == ["", "+45*59:53"]
+    assert connection.stats["commands"] == 10
+
+
+def test_read_bursts_are_retried_on_a_fresh_link():
+    connection = FakeConnection(retries=1)
+    connection.connect()
+    connection.failures = 1
+    assert connection.query_batch([":GR#", ":GD#"]) == ["05:14:32", "+45*59:53"]
+    assert connection.sent == [b":GR#:GD#", b":GR#:GD#"]
+    assert connection.stats["connects"] == 2
+
+
+def test_bursts_that_change_the_nexus_are_not_sent_twice():
+    connection = FakeConnection(retries=1)
+    connection.failures = 1
+    with pytest.raises(ConnectionError):
+        connection.query_batch([":GR#", ":Sr05:14:32#", ":Sd+45*59:53#", ":CM#"])
+    assert len(connection.sent) == 1
+
+
+def test_burst_with_a_missing_reply_times_out():
+    connection = FakeConnection()
+    with pytest.raises(TimeoutError):
+        connection.query_batch([":GR#", ":GZ#"], timeout=0.05)
+    assert connection.stats["timeouts"] == 1
+    # the replies of the failed burst are not taken for those of the next one
+    assert connection.query_batch([":GD#", ":GR#"]) == ["+45*59:53", "05:14:32"]
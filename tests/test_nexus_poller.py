@@ -0,0 +1,56 @@
+import time
+from nexus_poller import NexusPoller, NexusSnapshot
+
+
+class FakeNexus:
+    def __init__(self) -> None:
+        self.poller = None
+        self.polls = 0
+
+    def set_poller(self, poller) -> None:
+        self.poller = poller
+
+    def poll(self) -> NexusSnapshot:
+        self.polls += 1
+        if self.polls == 2:
+            raise ConnectionError("link dropped")
+        return NexusSnapshot(time.time(), (5.0, 45.0), (30.0, 120.0), True, None, "0514+4559")
+
+
+def snapshot(timestamp):
+    return NexusSnapshot(timestamp, (timestamp, 0.0), (0.0, 0.0), True, None, "")
+
+
+def test_polls_in_the_background_and_survives_failures():
+    nexus = FakeNexus()
+    poller = NexusPoller(nexus, rate=50)
+    poller.start()
+    assert nexus.poller is poller
+    time.sleep(0.2)
+    poller.stop()
+    assert nexus.poller is None
+    assert nexus.polls > 3
+    assert poller.failures == 1
+    assert poller.snapshot.radec == (5.0, 45.0)
+
+
+def test_latest_is_none_when_too_old():
+    poller = NexusPoller(FakeNexus(), rate=2)
+    assert poller.latest() is None
+    poller.publish(snapshot(time.time() - 5))
+    assert poller.latest() is None
+    assert poller.latest(max_age=10) is not None
+    poller.publish(snapshot(time.time()))
+    assert poller.latest() is poller.snapshot
+
+
+def test_snapshot_at_picks_the_closest():
+    poller = NexusPoller(FakeNexus(), history=3)
+    assert poller.snapshot_at(10.0) is None
+    for timestamp in (10.0, 11.0, 12.0, 13.0):
+        poller.publish(snapshot(timestamp))
+    assert poller.snapshot_at(12.4).timestamp == 12.0
+    assert poller.snapshot_at(12.6).timestamp == 13.0
+    assert poller.snapshot_at(100.0).timestamp == 13.0
+    # the oldest snapshot left the history
+    assert poller.snapshot_at(0.0).timestamp == 11.0
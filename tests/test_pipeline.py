@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+import numpy as np
+from CameraInterface import CameraFrame
+from frame_triage import TriageResult
+from pipeline import LiveSolvePipeline, put_latest
+
+
+class FakeJob:
+    def __init__(self, wcs) -> None:
+        self.state = "done"
+        self.priority = -1
+        self.wcs = wcs
+
+    def wait(self) -> None:
+        pass
+
+    def solved(self) -> bool:
+        return self.wcs is not None
+
+
+class FakePlateSolve:
+    """Solves every frame to the value of its first pixel, slowly enough for the camera to
+    capture the next frames meanwhile"""
+
+    def __init__(self) -> None:
+        self.running_job = None
+        self.mismatches = 0
+        self.solved = 0
+
+    def triage_frame(self, image, binning=1) -> TriageResult:
+        return TriageResult("", 20, 10.0, 0.0, 2.0)
+
+    def submit(self, offset_flag, radec_hint, image, priority=0, timeout=None, binning=1) -> FakeJob:
+        value = int(image[0, 0])
+        time.sleep(0.02)
+        # the camera wrote more frames into its buffer meanwhile, this frame must not change
+        if not np.all(image == value):
+            self.mismatches += 1
+        self.solved += 1
+        return FakeJob({"value": value})
+
+
+class BufferCamera:
+    """Returns views on one reused buffer, like the ASI and QHY drivers"""
+
+    def __init__(self) -> None:
+        self.buffer = np.zeros((48, 64), dtype=np.uint8)
+        self.count = 0
+
+    def capture(self) -> CameraFrame:
+        self.count += 1
+        self.buffer[:] = self.count % 256
+        time.sleep(0.002)
+        return CameraFrame(self.buffer[:], 0.001, 50, time.time(), (64, 48))
+
+
+def test_solver_owns_its_frame():
+    camera = BufferCamera()
+    platesolve = FakePlateSolve()
+    solutions = queue.Queue()
+    pipeline = LiveSolvePipeline(camera.capture, platesolve, on_solution=solutions.put)
+    pipeline.start()
+    time.sleep(0.5)
+    pipeline.stop()
+    assert platesolve.solved > 5
+    assert camera.count > platesolve.solved
+    assert platesolve.mismatches == 0
+    stats = pipeline.snapshot()
+    assert stats["solved"] == platesolve.solved
+    assert stats["captured"] == camera.count
+    while not solutions.empty():
+        solution = solutions.get()
+        # the frame handed out with the solution is the frame that was solved
+        assert solution.frame.data.flags.owndata
+        assert solution.wcs["value"] == solution.frame.data[0, 0]
+
+
+def test_solutions_reach_the_handler_in_its_thread():
+    threads = set()
+    platesolve = FakePlateSolve()
+    camera = BufferCamera()
+    pipeline = LiveSolvePipeline(
+        camera.capture, platesolve, on_solution=lambda solution: threads.add(threading.current_thread().name)
+    )
+    pipeline.start()
+    time.sleep(0.2)
+    pipeline.stop()
+    assert threads == {"live-output"}
+
+
+def test_put_latest_drops_the_oldest():
+    stage_queue = queue.Queue(maxsize=1)
+    assert put_latest(stage_queue, 1) == 0
+    assert put_latest(stage_queue, 2) == 1
+    assert stage_queue.get_nowait() == 2
+
+
+def test_hint_is_taken_for_the_captured_frame():
+    camera = BufferCamera()
+    platesolve = FakePlateSolve()
+    solutions = queue.Queue()
+    # like a poller snapshot, the hint depends on when the frame was exposed
+    pipeline = LiveSolvePipeline(
+        camera.capture, platesolve, radec_hint=lambda frame: (frame.timestamp, 0.0), on_solution=solutions.put
+    )
+    pipeline.start()
+    time.sleep(0.2)
+    pipeline.stop()
+    assert not solutions.empty()
+    while not solutions.empty():
+        solution = solutions.get()
+        assert solution.frame.metadata["radec_hint"] == (solution.frame.timestamp, 0.0)
@@ -0,0 +1,220 @@
+import json
+import os
+import sys
+import time
+import numpy as np
+import pytest
+from PIL import Image
+from platesolve import PlateSolve
+
+# stands in for solve-field: logs its search radius and cpulimit and solves when the radius or
+# the race strategy (the name of its --dir) is in the "solves" of its settings, writing capture.wcs
+FAKE_SOLVE_FIELD = """
+import json, sys, time
+from pathlib import Path
+import fitsio
+args = sys.argv[1:]
+settings = json.load(open(sys.argv[0] + ".json"))
+radius = args[args.index("--radius") + 1] if "--radius" in args else "blind"
+directory = Path(args[args.index("--dir") + 1])
+keys = [directory.name] if directory.parent.name == "race" else [radius]
+with open(sys.argv[0] + ".log", "a") as log:
+    log.write(json.dumps([radius, args[args.index("--cpulimit") + 1]]) + "\\n")
+time.sleep(max(settings["sleep"].get(key, 0.0) for key in keys))
+if any(key in settings["solves"] for key in keys):
+    header = {"CRVAL1": 10.68, "CRVAL2": 41.27, "CRPIX1": 320.5, "CRPIX2": 240.5, "CD1_1": -15 / 3600,
+              "CD1_2": 0.0, "CD2_1": 0.0, "CD2_2": 15 / 3600, "IMAGEW": 640, "IMAGEH": 480}
+    fitsio.write(str(directory / "capture.wcs"), None, header=header, clobber=True)
+    print("Field 1: solved")
+else:
+    print("Field 1 did not solve")
+"""
+FRAME = np.zeros((480, 640), dtype=np.uint8)
+
+
+@pytest.fixture
+def platesolve(tmp_path):
+    script = tmp_path / "solve-field.py"
+    script.write_text(FAKE_SOLVE_FIELD)
+    platesolve = PlateSolve(15, tmp_path, tmp_path)
+    platesolve.cmd = [sys.executable, str(script)]
+    return platesolve
+
+
+def fake_solve_field(platesolve, solves, sleep=None):
+    script = platesolve.cmd[1]
+    with open(script + ".json", "w") as f:
+        json.dump({"solves": solves, "sleep": sleep or {}}, f)
+
+
+def attempts(platesolve):
+    with open(platesolve.cmd[1] + ".log") as log:
+        return [json.loads(line) for line in log]
+
+
+def test_the_hint_ladder_widens_before_the_blind_solve(platesolve):
+    fake_solve_field(platesolve, ["blind"])
+    result, _ = platesolve.solve_image(False, (0.7, 41.3), FRAME)
+    assert platesolve.is_solved(result)
+    assert [radius for radius, _ in attempts(platesolve)] == ["2", "5", "15", "blind"]
+
+
+def test_a_solved_attempt_ends_the_ladder(platesolve):
+    fake_solve_field(platesolve, ["5"])
+    result, _ = platesolve.solve_image(False, (0.7, 41.3), FRAME)
+    assert platesolve.is_solved(result)
+    assert [radius for radius, _ in attempts(platesolve)] == ["2", "5"]
+
+
+def test_without_a_hint_the_solve_is_blind(platesolve):
+    fake_solve_field(platesolve, [])
+    result, _ = platesolve.solve_image(False, None, FRAME)
+    assert not platesolve.is_solved(result)
+    assert [radius for radius, _ in attempts(platesolve)] == ["blind"]
+
+
+def test_the_attempts_share_one_budget(platesolve):
+    fake_solve_field(platesolve, [], {"2": 0.7, "5": 0.7, "15": 0.7, "blind": 0.7})
+    platesolve.solve_budget = 2
+    _, elapsed = platesolve.solve_image(False, (0.7, 41.3), FRAME)
+    # each attempt gets what is left, the ladder stops when less than a second is
+    assert attempts(platesolve) == [["2", "2"], ["5", "2"]]
+    assert elapsed < 2
+
+
+def test_the_first_solution_of_a_race_wins(platesolve, tmp_path):
+    fake_solve_field(platesolve, ["blind", "blind_deep"], {"blind_deep": 5, "blind_bin4": 5})
+    platesolve.race = True
+    platesolve.race_size = 6
+    result, elapsed = platesolve.solve_image(False, None, FRAME)
+    assert platesolve.is_solved(result)
+    # the slower strategies were killed, not waited for
+    assert elapsed < 3
+    assert (tmp_path / "capture.wcs").exists()
+    # without a hint only the blind strategies race
+    assert set(platesolve.race_stats) == {"blind", "blind_bin4", "blind_deep"}
+    assert platesolve.race_stats["blind"]["wins"] == 1
+    assert platesolve.race_stats["blind_deep"] == {"runs": 1, "wins": 0, "win_time": 0.0}
+
+
+def test_a_race_without_a_winner(platesolve):
+    fake_solve_field(platesolve, [])
+    platesolve.race = True
+    result, _ = platesolve.solve_image(False, (0.7, 41.3), FRAME)
+    assert not platesolve.is_solved(result)
+    assert all(stats["wins"] == 0 for stats in platesolve.race_stats.values())
+
+
+def test_the_race_stats_are_saved_when_the_ranking_changes(platesolve):
+    platesolve.race_size = 6
+    strategies = platesolve.strategies
+    hint2, blind = strategies[0], strategies[3]
+    platesolve.record_race(strategies, hint2, 1.0)
+    # hint2 was already ranked first
+    assert not platesolve.race_stats_file.exists()
+    platesolve.record_race(strategies, blind, 1.0)
+    assert json.loads(platesolve.race_stats_file.read_text())["blind"]["wins"] == 1
+    assert platesolve.unsaved_races == 0
+
+
+def test_the_race_stats_are_saved_every_interval_and_at_shutdown(platesolve):
+    platesolve.race_size = 6
+    platesolve.race_save_interval = 3
+    strategies = platesolve.strategies
+    for _ in range(3):
+        platesolve.record_race(strategies, strategies[0], 1.0)
+    assert json.loads(platesolve.race_stats_file.read_text())["hint2"]["runs"] == 3
+    platesolve.record_race(strategies, strategies[0], 1.0)
+    assert json.loads(platesolve.race_stats_file.read_text())["hint2"]["runs"] == 3
+    platesolve.save_race_stats()
+    assert json.loads(platesolve.race_stats_file.read_text())["hint2"]["runs"] == 4
+    # reloaded by the next start
+    assert PlateSolve(15, platesolve.images_path, platesolve.cwd_path).race_stats["hint2"]["runs"] == 4
+
+
+def wait_for_attempts(platesolve, count):
+    start_time = time.time()
+    while time.time() - start_time < 5:
+        if os.path.exists(platesolve.cmd[1] + ".log") and len(attempts(platesolve)) >= count:
+            return
+        time.sleep(0.02)
+    raise AssertionError("solve-field was not started")
+
+
+def test_a_cancelled_job_kills_solve_field(platesolve, monkeypatch):
+    failures = []
+    monkeypatch.setattr(platesolve.scale_estimator, "record_failure", lambda: failures.append(1))
+    fake_solve_field(platesolve, ["blind"], {"blind": 5})
+    job = platesolve.submit(False, None, FRAME)
+    wait_for_attempts(platesolve, 1)
+    start_time = time.time()
+    job.cancel()
+    assert job.wait(2)
+    assert time.time() - start_time < 2
+    assert job.state == "cancelled" and not job.solved()
+    # a cancelled solve is not a failed one and leaves no temp files behind
+    assert failures == []
+    assert not any(platesolve.temp_path.iterdir())
+
+
+def test_a_new_job_preempts_the_running_one(platesolve):
+    fake_solve_field(platesolve, ["blind"], {"2": 5})
+    first = platesolve.submit(False, (0.7, 41.3), FRAME)
+    wait_for_attempts(platesolve, 1)
+    second = platesolve.submit(False, None, FRAME)
+    assert first.wait(2) and first.state == "cancelled"
+    assert second.wait(5) and second.solved()
+
+
+def test_a_higher_priority_job_is_not_preempted(platesolve):
+    fake_solve_field(platesolve, ["2", "blind"], {"2": 1})
+    first = platesolve.submit(False, (0.7, 41.3), FRAME, priority=1)
+    wait_for_attempts(platesolve, 1)
+    second = platesolve.submit(False, None, FRAME)
+    assert first.wait(5) and first.solved()
+    # the lower priority job waited for its turn
+    assert second.wait(5) and second.solved()
+    assert [radius for radius, _ in attempts(platesolve)] == ["2", "blind"]
+
+
+def test_a_job_times_out(platesolve):
+    fake_solve_field(platesolve, ["blind"], {"blind": 5})
+    job = platesolve.submit(False, None, FRAME, timeout=0.5)
+    assert job.wait(3)
+    assert job.state == "timeout"
+
+
+def test_an_offset_solve_writes_the_frame_for_solve_field(platesolve, tmp_path):
+    fake_solve_field(platesolve, ["blind"])
+    result, _ = platesolve.solve_image(True, None, FRAME)
+    assert platesolve.is_solved(result)
+    # naming the stars needs the image itself
+    assert np.array_equal(np.asarray(Image.open(tmp_path / "capture.jpg")), FRAME)
+
+
+def test_a_job_keeps_its_own_stars_and_solution(platesolve):
+    fake_solve_field(platesolve, ["blind"])
+    frame = FRAME.copy()
+    frame[99:102, 199:202] = 200
+    first = platesolve.submit(False, None, frame)
+    assert first.wait(5) and first.solved()
+    second = platesolve.submit(False, None, FRAME)
+    assert second.wait(5)
+    # the next solve replaced what PlateSolve holds, not what the first job holds
+    assert len(first.stars) == 1 and len(platesolve.stars) == 0
+    assert abs(first.stars[0]["X"] - 201) < 0.5 and abs(first.stars[0]["Y"] - 101) < 0.5
+    assert first.wcs is not None and first.wcs.pixel_scale() == pytest.approx(15)
+
+
+def test_a_binned_frame_is_solved_at_its_own_scale(platesolve):
+    fake_solve_field(platesolve, ["blind"])
+    binned = np.zeros((240, 320), dtype=np.uint8)
+    result, _ = platesolve.solve_image(False, None, binned, binning=2)
+    assert platesolve.is_solved(result)
+    # the window was searched around twice the unbinned scale, with half the downsampling
+    assert float(platesolve.scale_low) < 30 < float(platesolve.scale_high)
+    assert platesolve.optimizedOptions[1] == "1"
+    # the scale is learned per unbinned pixel, kept apart from the unbinned frames
+    estimator = platesolve.scale_estimator
+    assert estimator.binning == 2
+    assert estimator.store[estimator.profile]["scales"] == [pytest.approx(7.5)]
@@ -0,0 +1,47 @@
+import json
+import pytest
+from scale_estimator import ScaleEstimator
+
+
+def test_profiles_are_per_camera_binning_and_nominal_scale(tmp_path):
+    estimator = ScaleEstimator(tmp_path / "pixel_scale.json", 15, "ASI")
+    for _ in range(5):
+        estimator.record(15.3)
+    assert estimator.estimate() == pytest.approx(15.3)
+    estimator.set_binning(2)
+    assert estimator.estimate() == 15
+    estimator.set_binning(1)
+    assert estimator.estimate() == pytest.approx(15.3)
+    # another lens has another nominal scale
+    assert ScaleEstimator(tmp_path / "pixel_scale.json", 25, "ASI").estimate() == 25
+    assert ScaleEstimator(tmp_path / "pixel_scale.json", 15, "QHY").estimate() == 15
+    assert ScaleEstimator(tmp_path / "pixel_scale.json", 15, "ASI").estimate() == pytest.approx(15.3)
+
+
+def test_window_narrows_and_widens_after_failures(tmp_path):
+    estimator = ScaleEstimator(tmp_path / "pixel_scale.json", 15, min_solves=5, max_failures=3)
+    for _ in range(4):
+        estimator.record(15.3)
+    assert estimator.margin() == estimator.wide_margin
+    estimator.record(15.3)
+    assert estimator.margin() == estimator.narrow_margin
+    for _ in range(3):
+        estimator.record_failure()
+    assert estimator.margin() == estimator.wide_margin
+
+
+def test_store_is_written_only_when_the_window_moves(tmp_path):
+    store_file = tmp_path / "pixel_scale.json"
+    estimator = ScaleEstimator(store_file, 15, tolerance=0.002)
+    writes = 0
+    for i in range(30):
+        before = store_file.read_text() if store_file.exists() else None
+        estimator.record(15.3 + 0.001 * (i % 3))
+        writes += store_file.read_text() != before
+    # the first estimate and the window narrowing after min_solves
+    assert writes == 2
+    saved = json.loads(store_file.read_text())[estimator.profile]
+    assert len(saved["scales"]) == 5
+    # a failure that does not widen the window is not written
+    estimator.record_failure()
+    assert json.loads(store_file.read_text())[estimator.profile]["failures"] == 0
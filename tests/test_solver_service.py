@@ -0,0 +1,116 @@
+import threading
+import time
+import pytest
+from solver_service import SolverClient, SolverServer, check_message
+
+STARS = [[10.0, 20.0], [30.5, 40.0], [50.0, 60.0], [70.0, 15.0]]
+
+
+class FakeEngine:
+    """Solves any star list at a pixel scale of 15, takes as long as the hint radius says"""
+
+    loads = 0
+
+    def __init__(self, index_files) -> None:
+        FakeEngine.loads += 1
+        self.index_files = index_files
+
+    def solve(self, stars, scale, hint=None):
+        if hint is not None and hint[2] > 50:
+            time.sleep(hint[2])
+        if not scale[0] <= 15 <= scale[1]:
+            return None
+        return {"header": {"CRVAL1": float(stars[0, 0]), "CRVAL2": 41.0}, "log_odds": 50.0, "index": "index-4107.fits"}
+
+
+def start_server(tmp_path, engine_factory=FakeEngine):
+    (tmp_path / "index-4107.fits").write_bytes(b"\0" * 100)
+    server = SolverServer(tmp_path / "solver.sock", tmp_path, engine_factory)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    while server.engine_state == "loading" or not (tmp_path / "solver.sock").exists():
+        time.sleep(0.01)
+    return server, SolverClient(tmp_path / "solver.sock", tmp_path)
+
+
+def test_the_engine_is_loaded_once_and_solves_in_workers(tmp_path):
+    FakeEngine.loads = 0
+    server, client = start_server(tmp_path)
+    for _ in range(3):
+        solution, elapsed = client.solve(STARS, (14, 16))
+        assert solution["header"]["CRVAL1"] == 10.0
+    assert client.solve(STARS, (20, 22))[0] is None
+    assert FakeEngine.loads == 1
+    assert server.jobs_done == 4
+
+
+def test_only_the_first_solve_pings(tmp_path, monkeypatch):
+    server, client = start_server(tmp_path)
+    sent = []
+    request = client._request
+    monkeypatch.setattr(client, "_request", lambda message, timeout=None: sent.append(message["type"]) or request(message, timeout))
+    for _ in range(3):
+        client.solve(STARS, (14, 16))
+    assert sent == ["ping", "solve", "solve", "solve"]
+
+
+def test_a_job_is_killed_after_its_cpulimit_or_when_cancelled(tmp_path):
+    server, client = start_server(tmp_path)
+    start_time = time.time()
+    assert client.solve(STARS, (14, 16), hint=(10, 41, 60), cpulimit=0.5)[0] is None
+    assert time.time() - start_time < 5
+    threading.Timer(0.5, client.cancel, args=("job-1",)).start()
+    start_time = time.time()
+    assert client.solve(STARS, (14, 16), hint=(10, 41, 60), job="job-1")[0] is None
+    assert time.time() - start_time < 5
+    # the engine survives its killed workers
+    assert client.solve(STARS, (14, 16))[0] is not None
+
+
+def test_invalid_messages_are_rejected(tmp_path):
+    server, client = start_server(tmp_path)
+    assert client._request({"type": "solve", "stars": "many", "scale": [14, 16], "cpulimit": 10})["type"] == "error"
+    assert client._request({"type": "solve", "stars": STARS, "scale": [16, 14], "cpulimit": 10})["type"] == "error"
+    assert client._request({"type": "launch"})["type"] == "error"
+    assert client._request(["ping"])["type"] == "error"
+    assert client._request({"type": "cancel"})["type"] == "error"
+    assert client.is_healthy()
+    assert check_message({"type": "solve", "stars": STARS, "scale": [14, 16], "hint": [10, 41, 2], "cpulimit": 10}) is None
+    assert check_message({"type": "solve", "stars": STARS, "scale": [14, 16], "hint": [10, 95, 2], "cpulimit": 10})
+
+
+def test_a_broken_engine_makes_the_client_back_off(tmp_path):
+    def broken(index_files):
+        raise OSError("corrupt index")
+
+    server, client = start_server(tmp_path, broken)
+    with pytest.raises(RuntimeError, match="corrupt index"):
+        client.solve(STARS, (14, 16))
+    assert client.retry_after > time.time()
+
+
+def test_service_answers_while_the_engine_loads(tmp_path):
+    (tmp_path / "index-4107.fits").write_bytes(b"\0" * 1000000)
+    client = SolverClient(tmp_path / "solver.sock", tmp_path, start_timeout=10)
+    try:
+        client.start()
+        assert client.is_healthy()
+        assert client._request({"type": "ping"}, timeout=2)["type"] == "pong"
+    finally:
+        client.stop()
+    assert client.process is None
+
+
+def test_failed_start_backs_off(tmp_path):
+    # the socket can not be created, so the service never answers
+    client = SolverClient(tmp_path / "missing" / "solver.sock", tmp_path, start_timeout=1, retry_interval=60)
+    with pytest.raises(RuntimeError, match="did not start"):
+        client.ensure_running()
+    assert client.process is None
+    start_time = time.time()
+    with pytest.raises(RuntimeError, match="next try"):
+        client.ensure_running()
+    # no second service was started
+    assert time.time() - start_time < 0.5
+    assert client.process is None
+    assert client.backoff == 120
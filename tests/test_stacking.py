@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from CameraSimulated import CameraSimulated
+from frame_triage import FrameTriage
+from stacking import FrameStacker, capture_stack, phase_correlation_peak
+
+
+def test_phase_correlation_peak_is_signed_and_sub_pixel():
+    correlation = np.zeros((32, 32))
+    correlation[30, 3] = 1.0
+    correlation[30, 4] = 0.5
+    correlation[30, 2] = 0.1
+    dy, dx = phase_correlation_peak(correlation)
+    assert dy == pytest.approx(-2)
+    assert 3 < dx < 3.5
+
+
+@pytest.fixture(scope="module")
+def camera(tmp_path_factory):
+    return CameraSimulated(
+        images_path=tmp_path_factory.mktemp("images"), catalog_file=tmp_path_factory.mktemp("none") / "hip.fits",
+        # hot pixels stay put while the stars move, the calibration removes them before stacking
+        sensor_size=(640, 480), hot_pixels=0,
+    )
+
+
+def test_shift_is_measured(camera):
+    stacker = FrameStacker((480, 640), np.uint8)
+    stacker.add(camera.render(80.0, 40.0, 1.0, 50, seed=1))
+    # 10 pixels of 15 arcsec further east in RA at Dec 40
+    moved = camera.render(80.0 + 10 * 15 / 3600 / np.cos(np.radians(40)), 40.0, 1.0, 50, seed=2)
+    dy, dx = stacker.shift(moved)
+    assert abs(dy) <= 1
+    assert abs(abs(dx) - 10) <= 1
+
+
+def test_stack_reaches_fainter_stars(camera):
+    frames = [camera.render(80.0, 40.0, 0.2, 50, seed=seed) for seed in range(8)]
+    triage = FrameTriage(min_stars=1)
+    stacker = FrameStacker((480, 640), np.uint8)
+    for frame in frames:
+        assert stacker.add(frame)
+    stacked = stacker.result()
+    assert stacked.dtype == np.uint8
+    single = triage.assess(frames[0])
+    assert triage.assess(stacked).star_count > single.star_count
+    # the background stays at the level of one frame
+    assert abs(float(np.median(stacked)) - float(np.median(frames[0]))) < 3
+
+
+def test_capture_stack_reuses_the_stacker(camera):
+    stackers = {}
+    prepared = []
+    stacked = capture_stack(camera, 100000, 50, "radec", {"still": False}, 4, stackers, prepared.append)
+    assert stacked.metadata["stacked"] == 4
+    assert len(prepared) == 4
+    assert stacked.data.flags.owndata
+    stacker = next(iter(stackers.values()))
+    capture_stack(camera, 100000, 50, "radec", {"still": False}, 3, stackers)
+    assert next(iter(stackers.values())) is stacker
+    assert stacker.count == 3
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from star_extractor import StarExtractor
+
+
+def flood_fill_labels(mask):
+    # reference 8-connected labelling, labels numbered in raster order of the first pixel
+    labels = np.full(mask.shape, -1)
+    count = 0
+    for y, x in zip(*np.nonzero(mask)):
+        if labels[y, x] >= 0:
+            continue
+        stack = [(y, x)]
+        labels[y, x] = count
+        while stack:
+            cy, cx = stack.pop()
+            for ny in range(max(cy - 1, 0), min(cy + 2, mask.shape[0])):
+                for nx in range(max(cx - 1, 0), min(cx + 2, mask.shape[1])):
+                    if mask[ny, nx] and labels[ny, nx] < 0:
+                        labels[ny, nx] = count
+                        stack.append((ny, nx))
+        count += 1
+    return labels
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_label_runs_matches_flood_fill(seed):
+    rng = np.random.default_rng(seed)
+    mask = rng.random((30, 40)) < rng.uniform(0.1, 0.6)
+    rows, starts, ends = StarExtractor._runs(mask)
+    labels = StarExtractor._label_runs(rows, starts, ends)
+    reference = flood_fill_labels(mask)
+    for row, start, end, label in zip(rows, starts, ends, labels):
+        assert np.all(reference[row, start:end] == label)
+
+
+def test_label_runs_joins_a_snake():
+    # one blob that winds through the whole mask, the worst case for label propagation
+    mask = np.zeros((41, 20), dtype=bool)
+    mask[::2, :] = True
+    mask[1::4, -1] = True
+    mask[3::4, 0] = True
+    rows, starts, ends = StarExtractor._runs(mask)
+    assert np.all(StarExtractor._label_runs(rows, starts, ends) == 0)
+
+
+def test_label_runs_diagonal_touch():
+    mask = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]], dtype=bool)
+    rows, starts, ends = StarExtractor._runs(mask)
+    assert list(StarExtractor._label_runs(rows, starts, ends)) == [0, 0, 1]
+
+
+def test_extract_finds_the_stars():
+    rng = np.random.default_rng(1)
+    image = rng.normal(100, 3, (240, 320))
+    yy, xx = np.mgrid[0:240, 0:320]
+    positions = [(50.3, 40.7, 800), (200.0, 100.5, 400), (120.6, 200.2, 200)]
+    for x, y, amplitude in positions:
+        image += amplitude * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * 1.5**2))
+    stars = StarExtractor(downsample=1, tile=16).extract(image.astype(np.uint16))
+    assert len(stars) == 3
+    # brightest first, FITS coordinates are 1-indexed
+    for star, (x, y, _) in zip(stars, positions):
+        assert star["X"] - 1 == pytest.approx(x, abs=0.2)
+        assert star["Y"] - 1 == pytest.approx(y, abs=0.2)
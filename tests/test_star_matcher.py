@@ -0,0 +1,35 @@
+import numpy as np
+from star_matcher import estimate_shift, fit_similarity, match_stars
+
+
+def stars(count=40, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1000, (count, 2))
+
+
+def test_estimate_shift():
+    reference = stars()
+    shift = estimate_shift(reference, reference + [12.3, -7.8])
+    assert np.allclose(shift, [12.3, -7.8], atol=0.5)
+
+
+def test_estimate_shift_without_a_clear_peak():
+    assert estimate_shift(stars(2), stars(2, seed=1)) is None
+    assert estimate_shift(np.zeros((0, 2)), stars()) is None
+
+
+def test_match_stars_drops_ambiguous_pairs():
+    predicted = np.array([[10.0, 10.0], [50.0, 50.0], [90.0, 90.0]])
+    positions = np.array([[10.5, 10.0], [50.0, 51.0], [51.0, 50.0], [200.0, 200.0]])
+    reference_index, new_index = match_stars(predicted, positions)
+    assert list(reference_index) == [0]
+    assert list(new_index) == [0]
+
+
+def test_fit_similarity():
+    source = stars()
+    angle = np.radians(3)
+    matrix = 1.01 * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    target = source @ matrix.T + [5, -3]
+    fitted, offset = fit_similarity(source, target)
+    assert np.allclose(fitted, matrix)
+    assert np.allclose(offset, [5, -3])
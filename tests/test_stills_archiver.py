@@ -0,0 +1,89 @@
+import os
+import time
+import fitsio
+import numpy as np
+from PIL import Image
+from CameraInterface import CameraFrame
+from stills_archiver import INDEX_NAME, StillsArchiver
+
+
+def frame(value=0, shape=(100, 100)):
+    return CameraFrame(np.full(shape, value, dtype=np.uint16), 1.0, 50, time.time(), (100, 100), {"camera": "SIM"})
+
+
+def test_writes_the_formats(tmp_path):
+    archiver = StillsArchiver(tmp_path, fmt="jpg")
+    archiver.submit(frame(1000), "a")
+    archiver.stop()
+    archiver.configure("npy", 90, 0, 0)
+    archiver.submit(frame(1000), "b")
+    archiver.stop()
+    archiver.configure("fits", 90, 0, 0)
+    archiver.submit(frame(1000), "c")
+    archiver.stop()
+    assert Image.open(tmp_path / "a.jpg").size == (100, 100)
+    assert np.load(tmp_path / "b.npy")[0, 0] == 1000
+    data, header = fitsio.read(str(tmp_path / "c.fits"), header=True)
+    assert data[0, 0] == 1000
+    assert header["EXPTIME"] == 1.0
+    assert archiver.stats["written"] == 3
+
+
+def test_submit_copies_the_frame(tmp_path):
+    archiver = StillsArchiver(tmp_path, fmt="npy")
+    captured = frame(7)
+    archiver.submit(captured, "a")
+    # the camera reuses its buffer
+    captured.data[:] = 9
+    archiver.stop()
+    assert np.all(np.load(tmp_path / "a.npy") == 7)
+
+
+def test_quota_evicts_only_its_own_stills(tmp_path):
+    kept = tmp_path / "kept_by_the_user.jpg"
+    kept.write_bytes(b"\0" * 100000)
+    os.utime(kept, (0, 0))
+    # a 100x100 uint16 npy is about 20 kB, the quota holds two of them
+    archiver = StillsArchiver(tmp_path, fmt="npy", max_mb=0.045)
+    for i in range(4):
+        archiver.submit(frame(i), f"still{i}")
+        time.sleep(0.05)
+    archiver.stop()
+    assert kept.exists()
+    assert sorted(path.name for path in tmp_path.glob("still*")) == ["still2.npy", "still3.npy"]
+    assert archiver.stats["evicted"] == 2
+    assert (tmp_path / INDEX_NAME).read_text().split() == ["still2.npy", "still3.npy"]
+
+
+def test_earlier_sessions_count_towards_the_quota(tmp_path):
+    archiver = StillsArchiver(tmp_path, fmt="npy")
+    for i in range(3):
+        archiver.submit(frame(i), f"still{i}")
+        time.sleep(0.05)
+    archiver.stop()
+    (tmp_path / "still1.npy").unlink()
+    (tmp_path / "mine.npy").write_bytes(b"\0" * 100000)
+    later = StillsArchiver(tmp_path, fmt="npy", max_mb=0.03)
+    later.submit(frame(3), "still3")
+    later.stop()
+    assert sorted(path.name for path in tmp_path.glob("*.npy")) == ["mine.npy", "still3.npy"]
+
+
+def test_age_quota(tmp_path):
+    archiver = StillsArchiver(tmp_path, fmt="npy")
+    archiver.submit(frame(), "old")
+    archiver.stop()
+    os.utime(tmp_path / "old.npy", (time.time() - 3 * 86400,) * 2)
+    later = StillsArchiver(tmp_path, fmt="npy", max_days=2)
+    later.submit(frame(), "new")
+    later.stop()
+    assert sorted(path.name for path in tmp_path.glob("*.npy")) == ["new.npy"]
+
+
+def test_full_queue_drops_frames(tmp_path):
+    archiver = StillsArchiver(tmp_path, fmt="npy", queue_size=1)
+    # the writer thread is not started, so nothing leaves the queue
+    archiver._start = lambda: None
+    assert archiver.submit(frame(), "a")
+    assert not archiver.submit(frame(), "b")
+    assert archiver.stats["dropped"] == 1
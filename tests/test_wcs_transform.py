@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from solver_service import write_wcs
+from wcs_transform import TanSipWcs
+
+
+def make_wcs(ra=83.6, dec=22.0, scale=15 / 3600, roll=20.0, **sip):
+    roll = np.radians(roll)
+    header = {
+        "CRVAL1": ra, "CRVAL2": dec, "CRPIX1": 640.5, "CRPIX2": 480.5,
+        "CD1_1": -scale * np.cos(roll), "CD1_2": scale * np.sin(roll),
+        "CD2_1": scale * np.sin(roll), "CD2_2": scale * np.cos(roll),
+        "IMAGEW": 1280, "IMAGEH": 960,
+    }
+    header.update(sip)
+    return TanSipWcs(header)
+
+
+def test_reference_pixel_is_the_centre():
+    ra, dec = make_wcs().xy2rd(640.5, 480.5)
+    assert float(ra) == pytest.approx(83.6)
+    assert float(dec) == pytest.approx(22.0)
+
+
+@pytest.mark.parametrize("sip", [{}, {"A_ORDER": 2, "B_ORDER": 2, "A_2_0": 2e-6, "B_0_2": -3e-6, "A_1_1": 1e-6}])
+def test_round_trip(sip):
+    wcs = make_wcs(**sip)
+    x, y = np.meshgrid(np.linspace(1, 1280, 7), np.linspace(1, 960, 5))
+    ra, dec = wcs.xy2rd(x.ravel(), y.ravel())
+    x2, y2 = wcs.rd2xy(ra, dec)
+    assert np.allclose(x2, x.ravel(), atol=1e-3)
+    assert np.allclose(y2, y.ravel(), atol=1e-3)
+
+
+def test_pixel_scale():
+    assert make_wcs().pixel_scale() == pytest.approx(15)
+
+
+def test_read_a_solution_file(tmp_path):
+    # the solver service writes its solutions like solve-field writes capture.wcs
+    header = {
+        "CTYPE1": "RA---TAN-SIP", "CTYPE2": "DEC--TAN-SIP", "CRVAL1": 83.6, "CRVAL2": 22.0,
+        "CRPIX1": 640.5, "CRPIX2": 480.5, "CD1_1": -15 / 3600, "CD1_2": 0.0, "CD2_1": 0.0, "CD2_2": 15 / 3600,
+        "A_ORDER": 2, "B_ORDER": 2, "A_2_0": 2e-6, "B_0_2": -3e-6,
+    }
+    write_wcs(header, tmp_path / "capture.wcs", 1280, 960)
+    read = TanSipWcs.from_file(tmp_path / "capture.wcs")
+    assert (read.width, read.height) == (1280, 960)
+    expected = TanSipWcs(dict(header, IMAGEW=1280, IMAGEH=960))
+    assert np.allclose(read.xy2rd(100.0, 900.0), expected.xy2rd(100.0, 900.0))
+
+
+def test_write_and_read_back(tmp_path):
+    wcs = make_wcs()
+    wcs.write(tmp_path / "capture.wcs")
+    read = TanSipWcs.from_file(tmp_path / "capture.wcs")
+    assert np.allclose(read.cd, wcs.cd)
+    assert np.allclose(read.crval, wcs.crval)
+    assert (read.width, read.height) == (1280, 960)
+
+
+def test_fit_recovers_the_transform():
+    wcs = make_wcs()
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(1, 1280, 30), rng.uniform(1, 960, 30)
+    ra, dec = wcs.xy2rd(x, y)
+    fitted = TanSipWcs.fit(x, y, ra, dec, (83.6, 22.0), (640.5, 480.5), 1280, 960)
+    assert np.allclose(fitted.cd, wcs.cd, rtol=1e-6)